@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Нагрузочный бенчмарк: обработчики, опыт, антиспам и топ на синтетической базе.
+
+Работает без сети: апдейты собираются локально, бот отвечает через FakeRequest
+из tools/fake_telegram.py. Каждый размер базы прогоняется в отдельном процессе,
+чтобы пиковый RSS относился только к нему. Результаты пишутся в JSON,
+чтобы сравнивать хранилища и изменения между собой.
+
+Пример:
+    python benchmarks/bench_load.py --sizes 1000,10000 --backend sqlite --output sqlite.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+CHATS = 50
+CHAT_ID_BASE = -1000000000000
+USER_ID_BASE = 10**6
+
+def chat_of(user_id: int) -> int:
+    """Чат, в котором состоит синтетический пользователь"""
+    return CHAT_ID_BASE - (user_id - USER_ID_BASE) % CHATS
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Перцентиль по отсортированному списку"""
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+async def measure(name: str, calls: list) -> dict:
+    """Выполняет вызовы по очереди и считает пропускную способность и задержки"""
+    latencies = []
+    started = time.perf_counter()
+    for call in calls:
+        t = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "scenario": name,
+        "ops": len(calls),
+        "seconds": round(elapsed, 4),
+        "ops_per_sec": round(len(calls) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4)
+    }
+    print(f"  {name:<20} {result['ops_per_sec']:>12} оп/с  p50 {result['p50_ms']:.3f} мс  "
+          f"p99 {result['p99_ms']:.3f} мс", file=sys.stderr)
+    return result
+
+def seed_database(users: int, seed: int) -> float:
+    """Создает базу из users пользователей в ./data и возвращает время в секундах"""
+    from config import STORAGE
+    from database import create_database, default_user
+    from ranks import RankSystem
+    from shards import shard_path
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    # При разделении по чатам у каждого чата своя база со своими пользователями
+    if STORAGE["partition_by_chat"]:
+        groups = [
+            (shard_path("data", CHAT_ID_BASE - index), range(USER_ID_BASE + index, USER_ID_BASE + users, CHATS))
+            for index in range(min(CHATS, users))
+        ]
+    else:
+        groups = [("data", range(USER_ID_BASE, USER_ID_BASE + users))]
+
+    for data_dir, user_ids in groups:
+        db = create_database(data_dir, background=False)
+        chunk = {}
+        for user_id in user_ids:
+            user_data = default_user(user_id)
+            user_data.first_name = f"Тест {user_id}"
+            user_data.xp = rng.randint(0, 3000)
+            user_data.messages_count = rng.randint(0, 5000)
+            user_data.rank = RankSystem.get_rank(user_data.xp)
+            chunk[user_id] = user_data
+            if len(chunk) >= 10000:
+                db.save_users(chunk)
+                chunk = {}
+        if chunk:
+            db.save_users(chunk)
+        db.close()
+    return time.perf_counter() - started
+
+async def run_worker(args) -> dict:
+    """Один прогон на базе заданного размера (вызывается в отдельном процессе)"""
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    os.chdir(workdir)
+    os.environ.setdefault("BOT_TOKEN", "1:fake")
+
+    import config
+    config.STORAGE["backend"] = args.backend
+    seed_seconds = seed_database(args.users, args.seed)
+
+    # main создает хранилище в ./data при импорте, поэтому импортируется после заполнения базы
+    import main
+    from fake_telegram import FakeRequest
+    from moderation import ModerationSystem
+    from post_update import make_callback_update, make_update
+    from telegram import Update
+    from telegram.ext import Application, CallbackContext
+    logging.getLogger().setLevel(logging.WARNING)
+
+    app = (
+        Application.builder()
+        .token(os.environ["BOT_TOKEN"])
+        .request(FakeRequest(enforce_limits=False))
+        .get_updates_request(FakeRequest(enforce_limits=False))
+        .build()
+    )
+    await app.initialize()
+    moderation = ModerationSystem(main.db, app.bot, main.quests, main.activity)
+
+    rng = random.Random(args.seed)
+    random_user = lambda: USER_ID_BASE + rng.randrange(args.users)
+    random_chat = lambda: CHAT_ID_BASE - rng.randrange(CHATS)
+
+    def random_member() -> tuple:
+        """Пользователь и его чат"""
+        user_id = random_user()
+        return chat_of(user_id), user_id
+
+    def random_pair() -> tuple:
+        """Чат и два его участника"""
+        chat_id, from_id = random_member()
+        to_id = from_id + CHATS * rng.randrange(-2, 3)
+        if not USER_ID_BASE <= to_id < USER_ID_BASE + args.users:
+            to_id = from_id
+        return chat_id, from_id, to_id
+
+    def prepared(text: str, count: int) -> list:
+        """Готовые апдейты и контексты: их разбор не входит в замер"""
+        pairs = []
+        for i in range(count):
+            update = Update.de_json(make_update(i, *random_member(), text), app.bot)
+            pairs.append((update, CallbackContext.from_update(update, app)))
+        return pairs
+
+    ops = args.ops
+    results = []
+    print(f"{args.users} пользователей, хранилище {args.backend}:", file=sys.stderr)
+
+    messages = prepared("тестовое сообщение", ops)
+    results.append(await measure("handle_message", [
+        (lambda u=u, c=c: main.handle_message(u, c)) for u, c in messages
+    ]))
+    pending = sum(entry["count"] for entry in main.message_batcher._pending.values())
+    flush = await measure("xp_batch_flush", [main.message_batcher.flush])
+    flush["messages"] = pending
+    flush["messages_per_sec"] = round(pending / flush["seconds"], 1) if flush["seconds"] else None
+    results.append(flush)
+
+    results.append(await measure("add_message_xp", [
+        (lambda: main.experience.add_message_xp(*random_member())) for _ in range(ops)
+    ]))
+    results.append(await measure("give_reaction", [
+        (lambda: main.experience.give_reaction(*random_pair(), "heart"))
+        for _ in range(ops)
+    ]))
+    async def check_sticker_spam():
+        chat_id, user_id = random_member()
+        return await moderation.check_sticker_spam(user_id, chat_id)
+    results.append(await measure("check_sticker_spam", [check_sticker_spam for _ in range(ops)]))
+
+    async def get_top_users():
+        return await (await main.db.chat(random_chat())).get_top_users(10)
+    results.append(await measure("get_top_users", [
+        get_top_users for _ in range(max(ops // 20, 1))
+    ]))
+    tops = prepared("/top", max(ops // 10, 1))
+    results.append(await measure("top", [
+        (lambda u=u, c=c: main.top_command(u, c)) for u, c in tops
+    ]))
+    presses = []
+    for i in range(ops):
+        chat_id, from_id, to_id = random_pair()
+        update = Update.de_json(make_callback_update(
+            i, chat_id, from_id, f"react_heart_{to_id}"), app.bot)
+        presses.append((update, CallbackContext.from_update(update, app)))
+    results.append(await measure("callback_react", [
+        (lambda u=u, c=c: main.handle_callback(u, c)) for u, c in presses
+    ]))
+    profiles = prepared("/profile", max(ops // 10, 1))
+    results.append(await measure("profile", [
+        (lambda u=u, c=c: main.profile(u, c)) for u, c in profiles
+    ]))
+
+    await app.shutdown()
+    await main.db.close()
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "users": args.users,
+        "backend": args.backend,
+        "seed_seconds": round(seed_seconds, 2),
+        # ru_maxrss в Linux — в килобайтах
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "scenarios": results
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="размеры базы через запятую")
+    parser.add_argument("--backend", default="json", choices=("json", "sqlite"))
+    parser.add_argument("--ops", type=int, default=20000, help="вызовов на сценарий")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_load.json")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--users", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(run_worker(args)), ensure_ascii=False))
+        return
+
+    runs = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        command = [
+            sys.executable, os.path.abspath(__file__), "--worker", "--users", str(size),
+            "--backend", args.backend, "--ops", str(args.ops), "--seed", str(args.seed)
+        ]
+        process = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            runs.append({"users": size, "backend": args.backend, "error": f"код выхода {process.returncode}"})
+            continue
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "benchmark": "bench_load",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ops_per_scenario": args.ops,
+        "runs": runs
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
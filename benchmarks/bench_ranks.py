@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Микробенчмарк: стоимость отрисовки топ-листа со старым и новым поиском ранга"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RANKS
+from models import UserRecord
+from ranks import RankSystem
+from utils import Utils
+
+def legacy_get_rank_info(xp: int) -> dict:
+    """Прежняя реализация: линейный проход по RANKS и форматирование на каждый вызов"""
+    current_rank = 1
+    next_rank = 2
+
+    for rank, info in RANKS.items():
+        if xp >= info["xp_required"]:
+            current_rank = rank
+            if rank < len(RANKS):
+                next_rank = rank + 1
+
+    current_info = RANKS[current_rank]
+    next_info = RANKS.get(next_rank, current_info)
+
+    xp_for_current = xp - current_info["xp_required"]
+    xp_for_next = next_info["xp_required"] - current_info["xp_required"]
+    progress = (xp_for_current / xp_for_next * 100) if xp_for_next > 0 else 100
+
+    return {
+        "current_rank": current_rank,
+        "current_name": f"{current_info['symbols']} {current_info['name']} {current_info['emoji']}",
+        "next_rank": next_rank,
+        "next_name": f"{next_info['symbols']} {next_info['name']} {next_info['emoji']}",
+        "xp_current": xp,
+        "xp_required_current": current_info["xp_required"],
+        "xp_required_next": next_info["xp_required"],
+        "progress": min(progress, 100),
+        "symbols": current_info["symbols"]
+    }
+
+def main():
+    random.seed(0)
+    top_users = []
+    for i in range(10):
+        user = UserRecord(i)
+        user.set_profile({"username": f"user{i}", "first_name": f"Имя {i}"})
+        user.xp = random.randint(0, 3000)
+        user.messages_count = random.randint(0, 5000)
+        top_users.append(user)
+    number = 20000
+
+    # Проверяем, что обе реализации дают одинаковый результат
+    for xp in range(0, 3000):
+        assert legacy_get_rank_info(xp) == RankSystem.get_rank_info(xp), xp
+
+    new_info = RankSystem.get_rank_info
+    RankSystem.get_rank_info = staticmethod(legacy_get_rank_info)
+    before = timeit.timeit(lambda: Utils.create_top_users_list(top_users), number=number)
+    RankSystem.get_rank_info = staticmethod(new_info)
+    after = timeit.timeit(lambda: Utils.create_top_users_list(top_users), number=number)
+
+    print(f"create_top_users_list, {number} вызовов")
+    print(f"  до:    {before / number * 1e6:.2f} мкс/вызов")
+    print(f"  после: {after / number * 1e6:.2f} мкс/вызов")
+    print(f"  ускорение: x{before / after:.2f}")
+
+if __name__ == '__main__':
+    main()
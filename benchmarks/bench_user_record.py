@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Микробенчмарк: загрузка users.json — словари (как до UserRecord) против database.read_users.
+
+Время меряется без tracemalloc (он замедляет выделения в разы и искажает сравнение),
+лучшее из --repeat чередующихся прогонов; память — отдельным проходом под tracemalloc.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from array import array
+
+from database import Database, read_users
+from models import UserRecord
+
+def make_raw_users(count: int) -> str:
+    """users.json в прежнем формате: у части пользователей есть реакции, квесты и наказания"""
+    rng = random.Random(0)
+    users = {}
+    for user_id in range(count):
+        record = UserRecord(user_id)
+        record.set_profile({"username": f"user{user_id}", "first_name": f"Имя {user_id}"})
+        record.xp = rng.randint(0, 3000)
+        record.messages_count = rng.randint(0, 5000)
+        if rng.random() < 0.3:
+            record.reactions_given = array('I', [rng.randint(1, 50), 0, 0])
+            record.reactions_given_at = array('q', [int(time.time()), 0, 0])
+            record.reactions_received = array('I', [0, rng.randint(1, 50), 0])
+            record.quests_completed = ("Общительный 💬",)
+        users[str(user_id)] = record.to_dict()
+    return json.dumps(users, ensure_ascii=False)
+
+def load_dicts(file_path: str) -> dict:
+    """Загрузка до UserRecord: снимок оставался словарями"""
+    return Database._read_json(file_path)
+
+def best_times(loaders: dict, file_path: str, repeat: int) -> dict:
+    """Лучшее время каждого загрузчика; прогоны чередуются, чтобы шум машины делился поровну"""
+    best = {label: float("inf") for label in loaders}
+    for _ in range(repeat):
+        for label, load in loaders.items():
+            gc.collect()
+            started = time.perf_counter()
+            table = load(file_path)
+            best[label] = min(best[label], time.perf_counter() - started)
+            del table
+    return best
+
+def memory(load, file_path: str) -> tuple:
+    """Итоговая и пиковая память загруженной таблицы"""
+    gc.collect()
+    tracemalloc.start()
+    table = load(file_path)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del table
+    return current, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    loaders = {"словари": load_dicts, "UserRecord": read_users}
+    with tempfile.TemporaryDirectory() as data_dir:
+        file_path = os.path.join(data_dir, "users.json")
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(make_raw_users(args.users))
+        print(f"{args.users} пользователей, users.json {os.path.getsize(file_path) / 2**20:.1f} МБ:")
+
+        times = best_times(loaders, file_path, args.repeat)
+        for label, load in loaders.items():
+            current, peak = memory(load, file_path)
+            print(f"  {label:<12} {times[label]:6.2f} с  {current / 2**20:8.1f} МБ  (пик {peak / 2**20:.1f} МБ)")
+            loaders[label] = current
+
+    dicts, records = loaders["словари"], loaders["UserRecord"]
+    print(f"  время: x{times['UserRecord'] / times['словари']:.2f} от словарей")
+    print(f"  память: x{dicts / records:.2f} меньше, {(dicts - records) / args.users:.0f} байт на пользователя")
+
+if __name__ == '__main__':
+    main()
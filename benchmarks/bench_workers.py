@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Бенчмарк многопроцессного режима: пропускная способность при разном числе рабочих процессов.
+
+Работает без сети: принимающий процесс отвечает на вызовы API через FakeRequest
+из tools/fake_telegram.py, апдейты собираются локально (сообщения, /profile, /top,
+реакции кнопками) и передаются так же, как пришедшие от Telegram. Лимиты Telegram
+выключены, чтобы замер показывал работу процессов, а не очередь отправки.
+Рост близок к линейному, пока рабочих процессов не больше свободных ядер.
+
+Пример:
+    python benchmarks/bench_workers.py --workers 1,2,4 --updates 20000 --output workers.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+CHATS = 200
+USERS_PER_CHAT = 50
+CHAT_ID_BASE = -1000000000000
+USER_ID_BASE = 10**6
+
+def make_command(update_id: int, chat_id: int, user_id: int, command: str) -> dict:
+    """Апдейт с командой: без сущности bot_command PTB не считает текст командой"""
+    from post_update import make_update
+
+    update = make_update(update_id, chat_id, user_id, command)
+    update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return update
+
+def make_updates(count: int, seed: int) -> list:
+    """Смесь апдейтов: в основном сообщения, остальное — команды и кнопки"""
+    from post_update import make_callback_update, make_update
+
+    rng = random.Random(seed)
+    updates = []
+    for update_id in range(count):
+        chat_index = rng.randrange(CHATS)
+        chat_id = CHAT_ID_BASE - chat_index
+        user_id = USER_ID_BASE + chat_index * USERS_PER_CHAT + rng.randrange(USERS_PER_CHAT)
+        kind = rng.random()
+        if kind < 0.7:
+            updates.append(make_update(update_id, chat_id, user_id, "тестовое сообщение"))
+        elif kind < 0.8:
+            updates.append(make_command(update_id, chat_id, user_id, "/profile"))
+        elif kind < 0.9:
+            updates.append(make_command(update_id, chat_id, user_id, "/top"))
+        else:
+            target_id = USER_ID_BASE + chat_index * USERS_PER_CHAT + rng.randrange(USERS_PER_CHAT)
+            updates.append(make_callback_update(update_id, chat_id, user_id, f"react_heart_{target_id}"))
+    return updates
+
+async def run_pool(workers: int, args) -> dict:
+    """Один прогон с заданным числом рабочих процессов в чистом каталоге данных"""
+    from fake_telegram import FakeRequest
+    from telegram import Update
+    from telegram.ext import Application
+    from workers import build_front_application
+
+    workdir = tempfile.mkdtemp(prefix="bench_workers_")
+    os.chdir(workdir)
+    request = FakeRequest(enforce_limits=False)
+    app = build_front_application(
+        Application.builder()
+        .token(os.environ["BOT_TOKEN"])
+        .request(request)
+        .get_updates_request(FakeRequest(enforce_limits=False)),
+        workers
+    )
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    pool = app.bot_data['workers']
+
+    # Разогрев: каждый чат открывает свое хранилище до замера
+    for i in range(CHATS):
+        warmup = make_command(-1 - i, CHAT_ID_BASE - i, USER_ID_BASE + i * USERS_PER_CHAT, "/top")
+        await app.process_update(Update.de_json(warmup, app.bot))
+    await pool.drain()
+
+    # Разбор JSON в Update не входит в замер: принимающий процесс делает его и так
+    updates = [Update.de_json(update, app.bot) for update in make_updates(args.updates, args.seed)]
+    calls_before = len(request.calls)
+    started = time.perf_counter()
+    for update in updates:
+        await app.process_update(update)
+    await pool.drain()
+    elapsed = time.perf_counter() - started
+    api_calls = len(request.calls) - calls_before
+
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "workers": workers,
+        "updates": len(updates),
+        "api_calls": api_calls,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(updates) / elapsed, 1) if elapsed else None
+    }
+    print(f"  {workers:>2} процессов  {result['updates_per_sec']:>10} апд/с  "
+          f"({api_calls} вызовов API)", file=sys.stderr)
+    return result
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+async def run(args) -> list:
+    runs = []
+    for workers in (int(count) for count in args.workers.split(",")):
+        runs.append(await run_pool(workers, args))
+    baseline = runs[0]["updates_per_sec"] if runs else None
+    for result in runs:
+        if baseline and result["updates_per_sec"]:
+            result["speedup"] = round(result["updates_per_sec"] / baseline, 2)
+    return runs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4", help="число рабочих процессов через запятую")
+    parser.add_argument("--updates", type=int, default=20000, help="апдейтов на прогон")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_workers.json")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "1:fake")
+    logging.basicConfig(level=logging.WARNING)
+    # Рабочие процессы наследуют окружение: строка лога на каждое сообщение исказила бы замер
+    os.environ.setdefault("BOT_LOG_LEVEL", "WARNING")
+
+    print(f"Ядер: {os.cpu_count()}", file=sys.stderr)
+    runs = asyncio.run(run(args))
+
+    report = {
+        "benchmark": "bench_workers",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "runs": runs
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Обработчик кнопки: (update, context, аргумент из callback_data) -> текст всплывающего
+# уведомления или None
+CallbackHandler = Callable[[Update, ContextTypes.DEFAULT_TYPE, Optional[str]], Awaitable[Optional[str]]]
+
+class CallbackRouter:
+    """Таблица маршрутов callback_data: точные значения и префиксы вида "<префикс>_<аргумент>\""""
+
+    # callback_data разбирается один раз: поиск точного значения, затем префикса
+    # до последнего "_" — два обращения к словарю независимо от числа кнопок
+
+    def __init__(self):
+        self._exact: Dict[str, Tuple[CallbackHandler, bool]] = {}
+        self._prefixed: Dict[str, Tuple[CallbackHandler, bool]] = {}
+
+    def exact(self, data: str, handler: CallbackHandler, answer_first: bool = True):
+        """Маршрут для точного значения callback_data"""
+        self._exact[data] = (handler, answer_first)
+
+    def prefix(self, prefix: str, handler: CallbackHandler, answer_first: bool = False):
+        """Маршрут для "<prefix>_<аргумент>"; аргумент передается обработчику"""
+        self._prefixed[prefix] = (handler, answer_first)
+
+    def resolve(self, data: str) -> Optional[Tuple[CallbackHandler, bool, Optional[str]]]:
+        """Обработчик, флаг ответа и аргумент для callback_data"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route[0], route[1], None
+        prefix, _, argument = data.rpartition("_")
+        route = self._prefixed.get(prefix)
+        if route is None or not argument:
+            return None
+        return route[0], route[1], argument
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик CallbackQueryHandler"""
+        # Пока на запрос не ответили, у кнопки крутится индикатор. Кнопки, которые
+        # меняют сообщение, получают ответ сразу, до работы; действия с результатом
+        # отвечают всплывающим текстом, как только он готов
+        query = update.callback_query
+        resolved = self.resolve(query.data or "")
+        if resolved is None:
+            await query.answer()
+            return
+
+        handler, answer_first, argument = resolved
+        if answer_first:
+            await query.answer()
+            await handler(update, context, argument)
+            return
+
+        toast = None
+        try:
+            toast = await handler(update, context, argument)
+        finally:
+            await query.answer(toast)
+
+async def edit_menu(update: Update, text: str, reply_markup=None):
+    """Заменяет текст сообщения с кнопками"""
+    try:
+        await update.callback_query.edit_message_text(text, parse_mode='HTML', reply_markup=reply_markup)
+    except BadRequest as e:
+        # Повторное нажатие той же кнопки: сообщение уже такое
+        if "not modified" not in str(e):
+            raise
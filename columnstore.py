@@ -0,0 +1,164 @@
+import mmap
+import os
+import struct
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+# Файл ids.col: заголовок (число занятых слотов, отметка снимка), затем user_id по слотам.
+# Остальные колонки — по файлу <имя>.col без заголовка, значение слота n лежит
+# по смещению n * ширина. Порядок байт — родной для машины: файлы локальные
+HEADER = struct.Struct("<Qqq")
+INITIAL_CAPACITY = 1024
+
+class _Column:
+    """Файл одной колонки, отображенный в память"""
+
+    # Файл открывается только на время отображения: mmap держит собственную копию
+    # дескриптора, и второй открытый дескриптор на колонку удвоил бы их число у хранилища
+
+    __slots__ = ("path", "typecode", "offset", "mm", "view")
+
+    def __init__(self, path: str, typecode: str, offset: int = 0):
+        self.path = path
+        self.typecode = typecode
+        self.offset = offset
+        self.mm = None
+        self.view = None
+
+    @property
+    def itemsize(self) -> int:
+        return struct.calcsize(self.typecode)
+
+    def map(self, capacity: int):
+        """Отображает файл, при необходимости растягивая его до capacity слотов"""
+        self.unmap()
+        size = self.offset + capacity * self.itemsize
+        with open(self.path, "a+b") as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            self.mm = mmap.mmap(f.fileno(), size)
+        self.view = memoryview(self.mm)[self.offset:].cast(self.typecode)
+
+    def unmap(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def close(self):
+        self.unmap()
+
+class ColumnStore:
+    """Числовые поля фиксированной ширины: по массиву на поле, строка — плотный слот"""
+
+    # Обновление значения — запись нескольких байт в отображенную страницу,
+    # без сериализации. После падения процесса записанное остается в кэше страниц ОС;
+    # на диск страницы уходят при flush() или когда решит ОС
+
+    def __init__(self, directory: str, columns: Sequence[Tuple[str, str]]):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.names = tuple(name for name, _ in columns)
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+        self._ids = _Column(os.path.join(directory, "ids.col"), "q", HEADER.size)
+        self._columns = [
+            _Column(os.path.join(directory, f"{name}.col"), typecode) for name, typecode in columns
+        ]
+        size = os.path.getsize(self._ids.path) if os.path.exists(self._ids.path) else 0
+        self.capacity = max(INITIAL_CAPACITY, (size - HEADER.size) // self._ids.itemsize)
+        try:
+            self._map()
+        except BaseException:
+            # Уже отображенные колонки не должны держать дескрипторы после ошибки
+            for column in (self._ids, *self._columns):
+                column.close()
+            raise
+
+        self.count, stamp_mtime, stamp_size = HEADER.unpack_from(self._ids.mm)
+        self.stamp = (stamp_mtime, stamp_size)
+        # Отображение user_id -> слот строится по колонке ids при открытии
+        self._slots: Dict[int, int] = {
+            user_id: slot for slot, user_id in enumerate(self._ids.view[:self.count])
+        }
+
+    def _map(self):
+        for column in (self._ids, *self._columns):
+            column.map(self.capacity)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._slots
+
+    def slot(self, key: int) -> Optional[int]:
+        """Слот записи или None"""
+        return self._slots.get(key)
+
+    def allocate(self, key: int) -> int:
+        """Выделяет слот под новую запись (значения колонок — нули)"""
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        if self.count == self.capacity:
+            self.capacity *= 2
+            self._map()
+        slot = self.count
+        self._ids.view[slot] = key
+        for column in self._columns:
+            column.view[slot] = 0
+        # Счетчик в заголовке увеличивается последним: слот становится видимым целиком
+        self.count += 1
+        self._write_header()
+        self._slots[key] = slot
+        return slot
+
+    def get(self, slot: int, name: str):
+        """Значение одной колонки"""
+        return self._columns[self._index[name]].view[slot]
+
+    def set(self, slot: int, name: str, value):
+        """Записывает значение одной колонки на месте"""
+        self._columns[self._index[name]].view[slot] = value
+
+    def read(self, slot: int) -> tuple:
+        """Строка целиком в порядке колонок"""
+        return tuple(column.view[slot] for column in self._columns)
+
+    def write(self, slot: int, values: Sequence):
+        """Записывает строку целиком в порядке колонок"""
+        for column, value in zip(self._columns, values):
+            column.view[slot] = value
+
+    def items(self, name: str) -> Iterator[Tuple[int, int]]:
+        """Пары (ключ, значение) одной колонки по всем слотам"""
+        column = self._columns[self._index[name]].view
+        ids = self._ids.view
+        for slot in range(self.count):
+            yield ids[slot], column[slot]
+
+    def set_stamp(self, stamp: Tuple[int, int]):
+        """Запоминает отметку снимка, с которым согласованы колонки"""
+        self.stamp = stamp
+        self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self._ids.mm, 0, self.count, *self.stamp)
+
+    def clear(self):
+        """Освобождает все слоты (файлы не укорачиваются)"""
+        self.count = 0
+        self._slots.clear()
+        self._write_header()
+
+    def flush(self):
+        """Сбрасывает отображенные страницы на диск (msync)"""
+        for column in (self._ids, *self._columns):
+            column.mm.flush()
+
+    def close(self):
+        self.flush()
+        for column in (self._ids, *self._columns):
+            column.close()
@@ -7,6 +7,38 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 DEVELOPER_ID = int(os.getenv('DEVELOPER_ID', 0))  # Ваш ID в Telegram
 
+# Режим работы: long polling или вебхук
+SERVER = {
+    "mode": os.getenv('BOT_MODE', 'polling'),       # "polling" или "webhook"
+    "webhook_url": os.getenv('WEBHOOK_URL', ''),     # Публичный HTTPS-адрес вебхука
+    "secret_token": os.getenv('WEBHOOK_SECRET', ''), # Проверка заголовка от Telegram
+    "listen": "0.0.0.0",
+    "port": int(os.getenv('WEBHOOK_PORT', 8443)),
+    "url_path": "telegram",
+    "concurrent_updates": 64    # Сколько апдейтов обрабатывать одновременно (порядок в чате сохраняется)
+}
+
+# Многопроцессный режим (workers.py): принимающий процесс раздает апдейты по хешу чата.
+# Число процессов лучше не менять без нужды: история активности чата ведется процессом чата
+WORKERS = {
+    "count": int(os.getenv('BOT_WORKERS', 0)),  # Рабочих процессов; 0 — все в одном процессе
+    "start_timeout": 60,    # Секунд на запуск рабочего процесса
+    "stop_timeout": 60,     # Секунд на сброс данных при остановке, затем процесс завершается принудительно
+    "restart_delay": 1,     # Пауза перед перезапуском упавшего рабочего процесса
+    "max_backlog": 10000    # Апдейтов в очереди к неготовому процессу; сверх этого они отбрасываются
+}
+
+# Лимиты исходящих запросов к Telegram
+SENDER = {
+    "global_rate": 30,      # Запросов в секунду на весь бот
+    "group_rate": 20,       # Сообщений в группу...
+    "group_period": 60,     # ...за N секунд
+    "private_rate": 1,      # Сообщений в личный чат...
+    "private_period": 1,    # ...за N секунд
+    "max_backlog": 200,     # При такой очереди некритичные сообщения отбрасываются
+    "max_retries": 3        # Повторов после ответа RetryAfter
+}
+
 # Настройки рангов
 RANKS = {
     1: {"name": "Луркер", "emoji": "🕶️", "xp_required": 0, "symbols": "?"},
@@ -28,10 +60,23 @@ EXPERIENCE_CONFIG = {
     "nerd": {"xp": 10, "daily_limit": 1, "cooldown": 0, "min_rank": 7}
 }
 
+# Пакетное начисление опыта за сообщения
+MESSAGE_BATCH = {
+    "window": 1.5,          # Применять накопленное раз в N секунд
+    "max_messages": 500     # ...или как только накопится N сообщений
+}
+
 # Настройки модерации
 MODERATION = {
-    "max_stickers_per_minute": 5,
+    # Ограничения частоты: не больше limit событий за window секунд
+    "rate_limits": {
+        "stickers": {"limit": 5, "window": 60, "reason": "Спам стикерами"},
+        "messages": {"limit": 20, "window": 10, "reason": "Флуд сообщениями"},
+        "media": {"limit": 10, "window": 60, "reason": "Спам медиа"},
+        "forwards": {"limit": 5, "window": 60, "reason": "Спам пересылками"}
+    },
     "warns_before_ban": 3,
+    "bulk_concurrency": 10,  # Одновременных запросов к Telegram при массовых действиях
     "mute_durations": {
         "low": 300,      # 5 минут
         "medium": 1800,  # 30 минут
@@ -40,8 +85,69 @@ MODERATION = {
 }
 
 # Настройки заданий
+# Квесты: "counter" — дневной счетчик и цель "target", "without" — счетчик,
+# который за день должен остаться нулем, "top" — место в дневном топе по счетчику.
+# Счетчики: messages, <реакция>_given, <реакция>_received, punishments, <действие>s_issued
 QUESTS_BY_RANK = {
-    "1-3": ["Общительный 💬", "Оценщик ❤️", "Послушатель 😇"],
-    "4-7": ["Добряк 👍", "Надзиратель ⚠️"],
-    "7-9": ["Мудрец 🤓", "Контент-мейкер 🎨", "Лидер сообщества 👑"]
+    "1-3": [
+        {"name": "Общительный 💬", "top": "messages", "places": 3, "reward": 50},
+        {"name": "Оценщик ❤️", "counter": "heart_given", "target": 3, "reward": 50},
+        {"name": "Послушатель 😇", "counter": "messages", "target": 10, "without": "punishments", "reward": 50}
+    ],
+    "4-7": [
+        {"name": "Добряк 👍", "counter": "thumbs_up_given", "target": 5, "reward": 100},
+        {"name": "Надзиратель ⚠️", "counter": "warns_issued", "target": 2, "reward": 100}
+    ],
+    "7-9": [
+        {"name": "Мудрец 🤓", "counter": "nerd_received", "target": 3, "reward": 150},
+        {"name": "Контент-мейкер 🎨", "counter": "heart_received", "target": 10, "reward": 150},
+        {"name": "Лидер сообщества 👑", "top": "messages", "places": 1, "reward": 200}
+    ]
+}
+
+# Настройки хранилища
+STORAGE = {
+    "backend": "json",      # Хранилище: "json" или "sqlite"
+    "sqlite_file": "bot.sqlite3",  # Имя файла SQLite внутри data/
+    "cache": True,          # Держать таблицу пользователей в памяти
+    "flush_interval": 5,    # Сбрасывать изменения на диск раз в N секунд
+    "flush_every": 100,     # ...или после N измененных записей
+    "journal": True,        # Писать изменения в журнал users.journal (требует cache)
+    "compact_after": 4 * 1024 * 1024,  # Сворачивать журнал в снимок после N байт
+    "fsync": False,         # fsync после каждой записи журнала
+    "columns": True,        # Горячие числовые поля в колонках data/columns/ с обновлением на месте (требует journal)
+    "io_workers": 4,        # Потоков для файлового ввода-вывода AsyncDatabase
+    "partition_by_chat": True,  # Отдельное хранилище (пользователи, логи, рейтинг) на каждый чат в data/chats/
+    "shard_idle": 600,      # Закрывать хранилище чата после N секунд без обращений
+    "max_open_shards": 32   # Открытых хранилищ чатов не больше N (у каждого ~22 файловых дескриптора)
+}
+
+# Кэш готовых текстов топа и карточек профиля (render_cache.py)
+RENDER_CACHE = {
+    "max_entries": 2048,    # Вытеснение давно не запрошенных (LRU)
+    "top_size": 10          # Мест в топе: изменения за его пределами топ не перерисовывают
+}
+
+# История активности (timeseries.py): записи по 16-24 байта на активную сущность за период.
+# Год истории на 100 тыс. пользователей при ~20% активных в день — около 55 МБ
+ACTIVITY = {
+    "retention_days": 31,   # Сколько дней хранить подневные данные
+    "retention_weeks": 13,  # ...недельные сводки
+    "retention_months": 12, # ...месячные сводки
+    "flush_interval": 60    # Запись текущего дня на диск раз в N секунд
+}
+
+# Метрики в формате Prometheus (metrics.py)
+METRICS = {
+    "http_port": int(os.getenv('METRICS_PORT', 0)),  # 0 — HTTP-эндпоинт выключен
+    "listen": os.getenv('METRICS_LISTEN', '127.0.0.1')
+}
+
+# Профилирование по запросу разработчика (profiler.py)
+PROFILING = {
+    "default_duration": 30,     # Длительность сессии /profile_start по умолчанию, секунд
+    "max_duration": 300,
+    "top": 30,                  # Строк в сводке горячих мест
+    "slow_callback": 0.1,       # Блокировка цикла событий дольше N секунд считается медленной
+    "watchdog_interval": 0.05   # Период проверки цикла событий
 }
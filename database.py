@@ -1,119 +1,654 @@
+import asyncio
+import atexit
+import gc
 import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Any, Optional
+
+from columnstore import ColumnStore
+from config import STORAGE
+from leaderboard import Leaderboard
+from locks import KeyedLocks
+from logstore import ModerationLog
+from metrics import DB_SECONDS, STORAGE_READ_BYTES, STORAGE_WRITTEN_BYTES
+from models import HOT_FIELDS, UserRecord
+
+# Колонки горячих полей и контрольная сумма остальных: по ней save_users
+# решает, нужна ли запись в журнал
+COLUMNS = HOT_FIELDS + (("cold_crc", "I"),)
+
+# Записей, переводимых в словари за одно взятие блокировки при компактификации
+SNAPSHOT_CHUNK = 1000
+
+def default_user(user_id: int) -> UserRecord:
+    """Данные нового пользователя по умолчанию"""
+    return UserRecord(user_id)
+
+def read_users(file_path: str) -> Dict[int, UserRecord]:
+    """Читает снимок users.json в записи"""
+    # Циклов в разобранном JSON и записях нет, а сборщик мусора при росте таблицы
+    # снова и снова обходит ее целиком: на время загрузки он выключается (сборщик общий
+    # для процесса; включает его тот, кто застал включенным). Словари снимка снимаются
+    # по одному и освобождаются сразу после перевода в запись
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        raw = Database._read_json(file_path)
+        users = {}
+        while raw:
+            user_id, user_data = raw.popitem()
+            users[int(user_id)] = UserRecord.from_dict(user_data)
+        return users
+    finally:
+        if enabled:
+            gc.enable()
 
 class Database:
-    def __init__(self):
-        self.data_dir = "data"
+    def __init__(self, data_dir: str = "data", cache: Optional[bool] = None, background: bool = True):
+        self.data_dir = data_dir
         self.users_file = os.path.join(self.data_dir, "users.json")
         self.stats_file = os.path.join(self.data_dir, "stats.json")
         self.logs_file = os.path.join(self.data_dir, "logs.json")
+        self.journal_file = os.path.join(self.data_dir, "users.journal")
         self._ensure_directories()
         self._init_files()
-    
+        self.moderation_log = ModerationLog(os.path.join(self.data_dir, "logs"))
+        self._migrate_logs()
+
+        # Режим кэша: таблица пользователей живет в памяти,
+        # измененные записи сбрасываются на диск фоновым потоком
+        self.cache = STORAGE["cache"] if cache is None else cache
+        self.flush_interval = STORAGE["flush_interval"]
+        self.flush_every = STORAGE["flush_every"]
+        # Журнал: каждое изменение дописывается одной строкой,
+        # снимок users.json пересобирается только при компактификации
+        self.journal = self.cache and STORAGE["journal"]
+        self.compact_after = STORAGE["compact_after"]
+        self.fsync = STORAGE["fsync"]
+        self._journal = None
+        self._journal_size = 0
+        # Колонки: горячие поля обновляются на месте, в журнал пишутся только
+        # записи с изменившимися остальными полями (требует journal)
+        self.columns: Optional[ColumnStore] = None
+        self._column_updates = 0
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._users: Optional[Dict[int, UserRecord]] = None
+        self._dirty = set()
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._flusher = None
+        self.leaderboard = None
+        # Версии записей для кэша отрисовки: растут при каждом сохранении
+        self.user_versions: Dict[int, int] = {}
+        # Начальные данные нового пользователя (например, из общего хранилища)
+        self.seed_user: Optional[Callable[[int], Optional[UserRecord]]] = None
+        # Асинхронные блокировки по user_id для составных операций в обработчиках
+        self.locks = KeyedLocks()
+
+        try:
+            if self.cache:
+                self._users = self._read_users()
+                if self.journal:
+                    self._replay_journal()
+                    self._journal = open(self.journal_file, 'a', encoding='utf-8')
+                    self._journal_size = self._journal.tell()
+                    if STORAGE["columns"]:
+                        self._open_columns()
+                self.leaderboard = Leaderboard(self._users.values())
+                # Без фонового потока flush() вызывает владелец (см. shards.ChatStorage)
+                if background:
+                    self._flusher = threading.Thread(
+                        target=self._flush_loop, name="db-flusher", daemon=True
+                    )
+                    self._flusher.start()
+                    atexit.register(self.close)
+            else:
+                self.leaderboard = Leaderboard(self._read_users().values())
+        except BaseException:
+            # Недооткрытое хранилище не должно держать дескрипторы
+            if self._journal is not None:
+                self._journal.close()
+            if self.columns is not None:
+                self.columns.close()
+            self.moderation_log.close()
+            raise
+
     def _ensure_directories(self):
         """Создает директории если их нет"""
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
-    
+
     def _init_files(self):
         """Инициализирует JSON файлы"""
-        for file_path in [self.users_file, self.stats_file, self.logs_file]:
+        for file_path in [self.users_file, self.stats_file]:
             if not os.path.exists(file_path):
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, ensure_ascii=False, indent=2)
-    
-    def get_user(self, user_id: int) -> Dict[str, Any]:
+                self._write_json(file_path, {})
+
+    def _migrate_logs(self):
+        """Однократно переносит logs.json в сегментированный журнал"""
+        if not os.path.exists(self.logs_file):
+            return
+
+        logs = self._read_json(self.logs_file)
+        if logs:
+            self.moderation_log.import_legacy(logs)
+        os.replace(self.logs_file, self.logs_file + ".migrated")
+
+    @staticmethod
+    def _read_json(file_path: str) -> Dict[str, Any]:
+        """Читает JSON файл"""
+        STORAGE_READ_BYTES.inc("json", amount=os.path.getsize(file_path))
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_json(file_path: str, data: Dict[str, Any]):
+        """Атомарно записывает JSON файл через временный файл"""
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, file_path)
+
+    def _read_users(self) -> Dict[int, UserRecord]:
+        """Читает снимок users.json в записи"""
+        return read_users(self.users_file)
+
+    def _users_snapshot(self) -> str:
+        """Сериализует таблицу пользователей в формате users.json"""
+        return json.dumps(
+            {str(user_id): record.to_dict() for user_id, record in self._users.items()},
+            ensure_ascii=False, indent=2
+        )
+
+    def _compact_snapshot(self, user_ids: list) -> str:
+        """Снимок для компактификации: блокировка берется на каждую порцию записей"""
+        # Снимок получается несогласованным между порциями, но все изменения после
+        # начала компактификации остаются в журнале целыми записями и при открытии
+        # применяются поверх него
+        snapshot = {}
+        for start in range(0, len(user_ids), SNAPSHOT_CHUNK):
+            with self._lock:
+                for user_id in user_ids[start:start + SNAPSHOT_CHUNK]:
+                    record = self._users.get(user_id)
+                    if record is not None:
+                        snapshot[str(user_id)] = record.to_dict()
+        return json.dumps(snapshot, ensure_ascii=False, indent=2)
+
+    def _load_users(self) -> Dict[int, UserRecord]:
+        """Возвращает таблицу пользователей из памяти или с диска"""
+        if self.cache:
+            return self._users
+        return self._read_users()
+
+    def _replay_journal(self):
+        """Применяет журнал поверх последнего снимка"""
+        if not os.path.exists(self.journal_file):
+            return
+
+        valid_size = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                # Оборванная последняя строка после падения
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                self._apply_journal_entry(entry)
+                valid_size += len(line)
+
+        # Отрезаем оборванный хвост, чтобы новые записи не склеились с ним
+        if valid_size != os.path.getsize(self.journal_file):
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def _apply_journal_entry(self, entry: Dict[str, Any]):
+        """Применяет одну запись журнала к таблице в памяти"""
+        if entry["op"] == "set":
+            self._users[int(entry["id"])] = UserRecord.from_dict(entry["data"])
+        elif entry["op"] == "set_many":
+            for user_id, user_data in entry["users"].items():
+                self._users[int(user_id)] = UserRecord.from_dict(user_data)
+        elif entry["op"] == "reset_daily":
+            # Запись из старых журналов: теперь статистика обнуляется лениво
+            pass
+
+    def _snapshot_stamp(self) -> tuple:
+        """Отметка текущего снимка users.json: время изменения и размер"""
+        stat = os.stat(self.users_file)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _open_columns(self):
+        """Открывает колонки и накладывает их на записи из снимка и журнала"""
+        self.columns = ColumnStore(os.path.join(self.data_dir, "columns"), COLUMNS)
+        hot_count = len(HOT_FIELDS)
+
+        # Колонки согласованы со снимком, после которого они велись. Если users.json
+        # переписан без них (первый запуск, откат версии), колонки строятся заново
+        if self.columns.stamp == self._snapshot_stamp():
+            for user_id, user_data in self._users.items():
+                slot = self.columns.slot(user_id)
+                if slot is not None:
+                    user_data.set_hot_values(self.columns.read(slot)[:hot_count])
+            return
+
+        self.columns.clear()
+        for user_id, user_data in self._users.items():
+            self._write_columns(user_id, user_data)
+        self.columns.set_stamp(self._snapshot_stamp())
+        self.columns.flush()
+
+    @staticmethod
+    def _cold_crc(user_data: UserRecord) -> int:
+        return zlib.crc32(repr(user_data.cold_values()).encode('utf-8'))
+
+    def _write_columns(self, user_id: int, user_data: UserRecord) -> bool:
+        """Пишет горячие поля на место; True, если изменились остальные поля"""
+        columns = self.columns
+        slot = columns.slot(user_id)
+        if slot is None:
+            slot = columns.allocate(user_id)
+            cold_changed = True
+        else:
+            cold_changed = False
+        crc = self._cold_crc(user_data)
+        if columns.get(slot, "cold_crc") != crc:
+            cold_changed = True
+        columns.write(slot, user_data.hot_values() + (crc,))
+        return cold_changed
+
+    def _append_journal(self, entry: Dict[str, Any]):
+        """Дописывает запись в журнал"""
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n"
+        self._journal.write(line)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        size = len(line.encode('utf-8'))
+        self._journal_size += size
+        STORAGE_WRITTEN_BYTES.inc("json", amount=size)
+        if self._journal_size >= self.compact_after:
+            self._flush_event.set()
+
+    def compact(self):
+        """Сворачивает журнал в новый снимок users.json"""
+        if not self.journal:
+            return
+
+        with self._write_lock:
+            with self._lock:
+                if self._journal_size == 0 and self._column_updates == 0:
+                    return
+                # Чтения из памяти идут прямо в цикле событий: блокировка берется
+                # короткими порциями, а JSON и запись с fsync выполняются без нее
+                snapshot_size = self._journal_size
+                column_updates = self._column_updates
+                user_ids = list(self._users)
+            payload = self._compact_snapshot(user_ids)
+
+            tmp_path = self.users_file + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.users_file)
+            STORAGE_WRITTEN_BYTES.inc("json", amount=os.path.getsize(self.users_file))
+
+            with self._lock:
+                if self.columns is not None:
+                    self.columns.set_stamp(self._snapshot_stamp())
+                    self.columns.flush()
+                    self._column_updates -= column_updates
+                # Снимок уже на диске: повторное применение журнала идемпотентно,
+                # поэтому падение до замены журнала не теряет данных. Записи, дописанные
+                # во время записи снимка, переходят в новый журнал
+                self._journal.flush()
+                with open(self.journal_file, 'rb') as f:
+                    f.seek(snapshot_size)
+                    tail = f.read()
+                tmp_path = self.journal_file + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal.close()
+                os.replace(tmp_path, self.journal_file)
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+                self._journal_size = len(tail)
+
+    def get_user(self, user_id: int) -> UserRecord:
         """Получает данные пользователя"""
-        with open(self.users_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        if str(user_id) not in data:
-            return self._create_default_user(user_id)
-        
-        return data[str(user_id)]
-    
-    def _create_default_user(self, user_id: int) -> Dict[str, Any]:
+        with self._lock:
+            user_data = self._load_users().get(user_id)
+            if user_data is None:
+                return self._create_default_user(user_id)
+
+            user_data.roll_daily()
+            return user_data
+
+    def find_user(self, user_id: int) -> Optional[UserRecord]:
+        """Получает пользователя, не создавая нового"""
+        with self._lock:
+            user_data = self._load_users().get(user_id)
+            if user_data is not None:
+                user_data.roll_daily()
+            return user_data
+
+    def get_cached_user(self, user_id: int) -> Optional[UserRecord]:
+        """Получает пользователя из памяти, не обращаясь к диску"""
+        if not self.cache:
+            return None
+        with self._lock:
+            user_data = self._users.get(user_id)
+            if user_data is not None:
+                user_data.roll_daily()
+            return user_data
+
+    def _create_default_user(self, user_id: int) -> UserRecord:
         """Создает пользователя по умолчанию"""
-        user_data = {
-            "user_id": user_id,
-            "username": "",
-            "first_name": "",
-            "last_name": "",
-            "xp": 0,
-            "rank": 1,
-            "messages_count": 0,
-            "reactions_given": {
-                "heart": {"count": 0, "last_date": None},
-                "thumbs_up": {"count": 0, "last_date": None},
-                "nerd": {"count": 0, "last_date": None}
-            },
-            "reactions_received": {"heart": 0, "thumbs_up": 0, "nerd": 0},
-            "quests_completed": [],
-            "daily_stats": {
-                "messages": 0,
-                "reactions_given": {"heart": 0, "thumbs_up": 0, "nerd": 0}
-            },
-            "moderation": {
-                "warns": 0,
-                "mutes": 0,
-                "bans": 0,
-                "last_warn": None
-            },
-            "join_date": datetime.now().isoformat(),
-            "last_active": datetime.now().isoformat()
-        }
-        
+        user_data = (self.seed_user and self.seed_user(user_id)) or default_user(user_id)
         self.save_user(user_id, user_data)
         return user_data
-    
-    def save_user(self, user_id: int, user_data: Dict[str, Any]):
+
+    def iter_users(self):
+        """Перебирает всех пользователей"""
+        with self._lock:
+            users = list(self._load_users().values())
+        return iter(users)
+
+    def save_user(self, user_id: int, user_data: UserRecord):
         """Сохраняет данные пользователя"""
-        with open(self.users_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        data[str(user_id)] = user_data
-        
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    
-    def add_log(self, action: str, moderator_id: int, target_id: int, reason: str = ""):
+        self.save_users({user_id: user_data})
+
+    def save_users(self, users: Dict[int, UserRecord]):
+        """Сохраняет несколько пользователей одной записью"""
+        self._save_users(users)
+        # Без фонового потока пороги flush_every и compact_after проверяются здесь,
+        # после снятия _lock: flush берет _write_lock раньше _lock
+        if self._flusher is None and self._flush_event.is_set():
+            self._flush_event.clear()
+            self.flush()
+
+    def _save_users(self, users: Dict[int, UserRecord]):
+        with self._lock:
+            if self.cache:
+                data = self._users
+            else:
+                data = self._read_users()
+
+            for user_id, user_data in users.items():
+                data[user_id] = user_data
+                self.leaderboard.update(user_id, user_data.xp)
+                self.user_versions[user_id] = self.user_versions.get(user_id, 0) + 1
+
+            if self.columns is not None:
+                # В журнал попадают только записи с изменившимися холодными полями
+                self._column_updates += len(users)
+                users = {
+                    user_id: user_data for user_id, user_data in users.items()
+                    if self._write_columns(user_id, user_data)
+                }
+                if self.fsync:
+                    self.columns.flush()
+
+            if self.journal:
+                if not users:
+                    return
+                if len(users) == 1:
+                    [(user_id, user_data)] = users.items()
+                    self._append_journal({"op": "set", "id": str(user_id), "data": user_data.to_dict()})
+                else:
+                    self._append_journal({
+                        "op": "set_many",
+                        "users": {str(user_id): user_data.to_dict() for user_id, user_data in users.items()}
+                    })
+            elif self.cache:
+                self._dirty.update(users)
+                if len(self._dirty) >= self.flush_every:
+                    self._flush_event.set()
+            else:
+                self._write_json(
+                    self.users_file,
+                    {str(user_id): user_data.to_dict() for user_id, user_data in data.items()}
+                )
+
+    @contextmanager
+    def transaction(self, *user_ids: int):
+        """Загружает пользователей один раз и сохраняет их одной записью"""
+        # При исключении внутри блока ничего не сохраняется
+        with self._lock:
+            users = {user_id: self.get_user(user_id) for user_id in user_ids}
+            if self.cache:
+                # В памяти лежат живые записи: работаем с копиями, чтобы откат был честным
+                users = {user_id: user_data.copy() for user_id, user_data in users.items()}
+            yield users
+            # Пустой словарь означает «ничего не сохранять»
+            if users:
+                self.save_users(users)
+
+    def flush(self):
+        """Сбрасывает измененные записи кэша на диск"""
+        if not self.cache:
+            return
+
+        if self.journal:
+            if self._journal_size >= self.compact_after:
+                self.compact()
+            elif self.columns is not None:
+                with self._lock:
+                    self.columns.flush()
+            return
+
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                # Сериализуем под блокировкой, чтобы снимок был согласованным
+                payload = self._users_snapshot()
+                self._dirty.clear()
+
+            tmp_path = self.users_file + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.users_file)
+            STORAGE_WRITTEN_BYTES.inc("json", amount=os.path.getsize(self.users_file))
+
+    def _flush_loop(self):
+        """Фоновый поток: сбрасывает кэш по таймеру или по числу изменений"""
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
+    def close(self):
+        """Останавливает фоновый поток и сбрасывает кэш на диск"""
+        self.moderation_log.close()
+        if not self.cache:
+            return
+
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._flusher and self._flusher.is_alive() and self._flusher is not threading.current_thread():
+            self._flusher.join()
+
+        if self.journal:
+            self.compact()
+            self._journal.close()
+            self.journal = False
+            if self.columns is not None:
+                self.columns.close()
+                self.columns = None
+            return
+        self.flush()
+
+    def add_log(self, action: str, moderator_id: int, target_id: int, reason: str = "") -> int:
         """Добавляет лог модерации"""
-        with open(self.logs_file, 'r', encoding='utf-8') as f:
-            logs = json.load(f)
-        
-        log_id = str(len(logs) + 1)
-        logs[log_id] = {
-            "action": action,
-            "moderator_id": moderator_id,
-            "target_id": target_id,
-            "reason": reason,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        with open(self.logs_file, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
-    
+        return self.moderation_log.append(action, moderator_id, target_id, reason)
+
+    def add_logs(self, entries: list) -> list:
+        """Добавляет пачку логов модерации одной записью"""
+        return self.moderation_log.append_many(entries)
+
+    def iter_logs(self, since: Optional[datetime] = None, until: Optional[datetime] = None):
+        """Потоково читает логи модерации за интервал"""
+        return self.moderation_log.read(since, until)
+
     def get_top_users(self, limit: int = 10) -> list:
         """Получает топ пользователей по XP"""
-        with open(self.users_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        users = list(data.values())
-        users.sort(key=lambda x: x.get('xp', 0), reverse=True)
-        return users[:limit]
-    
+        with self._lock:
+            data = self._load_users()
+            return [data[user_id] for user_id, _ in self.leaderboard.top(limit)]
+
+    def get_user_position(self, user_id: int) -> Optional[int]:
+        """Место пользователя в топе по XP"""
+        with self._lock:
+            return self.leaderboard.position(user_id)
+
+    @property
+    def top_version(self) -> int:
+        """Версия первых мест рейтинга"""
+        return self.leaderboard.version
+
     def reset_daily_stats(self):
         """Сбрасывает ежедневную статистику"""
-        with open(self.users_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        for user_id, user_data in data.items():
-            user_data["daily_stats"] = {
-                "messages": 0,
-                "reactions_given": {"heart": 0, "thumbs_up": 0, "nerd": 0}
-            }
-        
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # daily_stats помечены датой и обнуляются лениво в get_user
+        # (см. UserRecord.roll_daily), поэтому неактивные записи не переписываются
+        pass
+
+def create_database(data_dir: str = "data", background: bool = True):
+    """Создает хранилище, выбранное в STORAGE["backend"]"""
+    if STORAGE["backend"] == "sqlite":
+        from sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(data_dir)
+    return Database(data_dir, background=background)
+
+class AsyncDatabase:
+    """Асинхронный фасад над хранилищем: файловый ввод-вывод идет в пуле потоков"""
+
+    def __init__(self, db, max_workers: Optional[int] = None,
+                 executor: Optional[ThreadPoolExecutor] = None, generation: int = 0):
+        self.db = db
+        self.locks = db.locks
+        # Номер открытия: версии данных после повторного открытия начинаются заново,
+        # и ключи кэша отрисовки различаются только по нему (см. shards.ChatStorage)
+        self.generation = generation
+        # Общий пул (например, на все хранилища чатов) закрывает его владелец
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers or STORAGE["io_workers"],
+            thread_name_prefix="db-io"
+        )
+        # Кэшированное JSON-хранилище читает из памяти: такие чтения
+        # дешевле выполнить сразу, чем передавать в пул
+        self._reads_inline = getattr(db, "cache", False)
+        self.closed = False
+
+    async def _write(self, func, *args, op: Optional[str] = None):
+        """Запись: в закрытое хранилище она бы молча пропала, поэтому это ошибка"""
+        if self.closed:
+            raise RuntimeError(f"Хранилище {getattr(self.db, 'data_dir', '')} закрыто, запись не выполнена")
+        return await self._run(func, *args, op=op)
+
+    async def _run(self, func, *args, op: Optional[str] = None):
+        """Выполняет синхронный вызов хранилища в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, op or func.__name__)
+
+    async def _read(self, func, *args):
+        """Чтение: из памяти сразу, с диска — через пул"""
+        if self._reads_inline:
+            started = time.perf_counter()
+            result = func(*args)
+            DB_SECONDS.observe(time.perf_counter() - started, func.__name__)
+            return result
+        return await self._run(func, *args)
+
+    async def get_user(self, user_id: int) -> UserRecord:
+        """Получает данные пользователя"""
+        if self._reads_inline:
+            user_data = self.db.get_cached_user(user_id)
+            if user_data is not None:
+                return user_data
+        # Новый пользователь сохраняется при создании — это уже запись
+        return await self._write(self.db.get_user, user_id)
+
+    async def save_user(self, user_id: int, user_data: UserRecord):
+        """Сохраняет данные пользователя"""
+        await self._write(self.db.save_user, user_id, user_data)
+
+    async def save_users(self, users: Dict[int, UserRecord]):
+        """Сохраняет несколько пользователей одной записью"""
+        await self._write(self.db.save_users, users)
+
+    def _load_copies(self, user_ids) -> Dict[int, UserRecord]:
+        """Загружает копии записей для транзакции"""
+        return {user_id: self.db.get_user(user_id).copy() for user_id in user_ids}
+
+    @asynccontextmanager
+    async def transaction(self, *user_ids: int):
+        """Загружает пользователей один раз и сохраняет их одной записью"""
+        # Согласованность между корутинами обеспечивают db.locks
+        users = await self._write(self._load_copies, user_ids, op="transaction")
+        yield users
+        # Пустой словарь означает «ничего не сохранять»
+        if users:
+            await self._write(self.db.save_users, users)
+
+    async def add_log(self, action: str, moderator_id: int, target_id: int, reason: str = "") -> int:
+        """Добавляет лог модерации"""
+        return await self._write(self.db.add_log, action, moderator_id, target_id, reason)
+
+    async def add_logs(self, entries: list) -> list:
+        """Добавляет пачку логов модерации одной записью"""
+        return await self._write(self.db.add_logs, entries)
+
+    async def get_all_users(self) -> list:
+        """Получает всех пользователей"""
+        return await self._run(lambda: list(self.db.iter_users()), op="iter_users")
+
+    async def get_logs(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> list:
+        """Читает логи модерации за интервал"""
+        return await self._run(lambda: list(self.db.iter_logs(since, until)), op="iter_logs")
+
+    async def get_top_users(self, limit: int = 10) -> list:
+        """Получает топ пользователей по XP"""
+        return await self._read(self.db.get_top_users, limit)
+
+    async def get_user_position(self, user_id: int) -> Optional[int]:
+        """Место пользователя в топе по XP"""
+        return await self._read(self.db.get_user_position, user_id)
+
+    def top_version(self) -> int:
+        """Версия первых мест рейтинга (без обращения к диску)"""
+        return self.db.top_version
+
+    def user_version(self, user_id: int) -> int:
+        """Версия записи пользователя (без обращения к диску)"""
+        return self.db.user_versions.get(user_id, 0)
+
+    async def reset_daily_stats(self):
+        """Сбрасывает ежедневную статистику"""
+        await self._write(self.db.reset_daily_stats)
+
+    async def flush(self):
+        """Сбрасывает изменения на диск"""
+        await self._run(self.db.flush)
+
+    async def close(self):
+        """Закрывает хранилище и пул потоков"""
+        self.closed = True
+        await self._run(self.db.close)
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
@@ -1,60 +1,74 @@
-from datetime import datetime, timedelta
-from config import EXPERIENCE_CONFIG
+import asyncio
+import logging
+import time
+from config import EXPERIENCE_CONFIG, MESSAGE_BATCH
+from models import REACTION_INDEX, UserRecord
+from ranks import RankSystem
+
+logger = logging.getLogger(__name__)
 
 class ExperienceSystem:
-    def __init__(self, db):
-        self.db = db
+    def __init__(self, db, quests=None, activity=None):
+        self.db = db  # shards.ChatStorage: опыт и ранги у каждого чата свои
+        self.quests = quests  # QuestSystem: получает события сообщений и реакций
+        self.activity = activity  # ActivityStats: история реакций по дням
     
-    def can_give_reaction(self, user_id: int, reaction_type: str) -> dict:
+    async def can_give_reaction(self, chat_id: int, user_id: int, reaction_type: str,
+                                user_data: UserRecord = None) -> dict:
         """Проверяет, можно ли дать реакцию"""
-        user_data = self.db.get_user(user_id)
+        if user_data is None:
+            user_data = await (await self.db.chat(chat_id)).get_user(user_id)
         config = EXPERIENCE_CONFIG[reaction_type]
+        index = REACTION_INDEX[reaction_type]
         
         # Проверка ранга
-        if user_data["rank"] < config["min_rank"]:
+        if user_data.rank < config["min_rank"]:
             return {"can": False, "reason": f"Доступно с {config['min_rank']} ранга"}
         
         # Проверка ежедневного лимита
-        daily_count = user_data["daily_stats"]["reactions_given"][reaction_type]
+        daily_count = user_data.daily_stats.reactions_given[index]
         if daily_count >= config["daily_limit"]:
             return {"can": False, "reason": "Достигнут дневной лимит"}
         
         # Проверка кулдауна
-        last_date_str = user_data["reactions_given"][reaction_type]["last_date"]
-        if last_date_str and config["cooldown"] > 0:
-            last_date = datetime.fromisoformat(last_date_str)
-            if datetime.now() - last_date < timedelta(seconds=config["cooldown"]):
+        last_given = user_data.reactions_given_at[index]
+        if last_given and config["cooldown"] > 0:
+            if time.time() - last_given < config["cooldown"]:
                 return {"can": False, "reason": "Подождите перед следующей реакцией"}
         
         return {"can": True, "reason": ""}
     
-    def give_reaction(self, from_user_id: int, to_user_id: int, reaction_type: str) -> dict:
+    async def give_reaction(self, chat_id: int, from_user_id: int, to_user_id: int, reaction_type: str) -> dict:
         """Дает реакцию и начисляет опыт"""
-        # Проверка отправителя
-        check_result = self.can_give_reaction(from_user_id, reaction_type)
-        if not check_result["can"]:
-            return {"success": False, "message": check_result["reason"]}
-        
-        # Получаем данные пользователей
-        from_user = self.db.get_user(from_user_id)
-        to_user = self.db.get_user(to_user_id)
-        
-        # Начисляем опыт получателю
-        xp_gain = EXPERIENCE_CONFIG[reaction_type]["xp"]
-        to_user["xp"] += xp_gain
-        to_user["reactions_received"][reaction_type] += 1
-        
-        # Обновляем статистику отправителя
-        from_user["reactions_given"][reaction_type]["count"] += 1
-        from_user["reactions_given"][reaction_type]["last_date"] = datetime.now().isoformat()
-        from_user["daily_stats"]["reactions_given"][reaction_type] += 1
-        
-        # Проверяем повышение ранга
-        to_user = RankSystem.update_rank(to_user)
+        db = await self.db.chat(chat_id)
+        # Обе стороны блокируются, читаются один раз и сохраняются одной записью
+        async with db.locks.hold(from_user_id, to_user_id):
+            async with db.transaction(from_user_id, to_user_id) as users:
+                from_user = users[from_user_id]
+                to_user = users[to_user_id]
+                
+                # Проверка отправителя
+                check_result = await self.can_give_reaction(chat_id, from_user_id, reaction_type, from_user)
+                if not check_result["can"]:
+                    users.clear()
+                    return {"success": False, "message": check_result["reason"]}
+                
+                # Начисляем опыт получателю
+                index = REACTION_INDEX[reaction_type]
+                xp_gain = EXPERIENCE_CONFIG[reaction_type]["xp"]
+                to_user.xp += xp_gain
+                to_user.receive_reaction(index)
+                
+                # Обновляем статистику отправителя
+                from_user.give_reaction(index, int(time.time()))
+                if self.quests:
+                    self.quests.on_reaction(chat_id, from_user, to_user, reaction_type)
+                
+                # Проверяем повышение ранга
+                RankSystem.update_rank(to_user)
         
-        # Сохраняем изменения
-        self.db.save_user(from_user_id, from_user)
-        self.db.save_user(to_user_id, to_user)
+        if self.activity:
+            self.activity.add_reaction(from_user_id, to_user_id, chat_id)
         
         return {
             "success": True,
@@ -63,26 +77,109 @@ class ExperienceSystem:
             "to_user": to_user
         }
     
-    def add_message_xp(self, user_id: int) -> dict:
-        """Начисляет опыт за сообщение"""
-        user_data = self.db.get_user(user_id)
+    async def add_message_xp(self, chat_id: int, user_id: int, count: int = 1, profile: dict = None) -> dict:
+        """Начисляет опыт за сообщение (или сразу за count сообщений)"""
+        db = await self.db.chat(chat_id)
+        async with db.locks.hold(user_id):
+            user_data = await db.get_user(user_id)
+            old_rank = user_data.rank
+            
+            # Базовый опыт за сообщение
+            base_xp = 1
+            xp_gain = base_xp * count
+            
+            user_data.messages_count += count
+            user_data.daily_stats.messages += count
+            if self.quests:
+                self.quests.on_message(chat_id, user_data, count)
+            user_data.xp += xp_gain
+            user_data.last_active = int(time.time())
+            if profile:
+                user_data.set_profile(profile)
+            
+            # Проверяем повышение ранга
+            user_data = RankSystem.update_rank(user_data)
+            
+            await db.save_user(user_id, user_data)
         
-        # Базовый опыт за сообщение
-        base_xp = 1
-        
-        # Бонус за длину сообщения
-        user_data["messages_count"] += 1
-        user_data["daily_stats"]["messages"] += 1
-        user_data["xp"] += base_xp
-        user_data["last_active"] = datetime.now().isoformat()
+        return {
+            "xp_gain": xp_gain,
+            "new_xp": user_data.xp,
+            "rank_up": user_data.rank > old_rank,
+            "user": user_data
+        }
+
+class MessageXPBatcher:
+    """Копит опыт за сообщения и применяет его пачкой: одна запись на пользователя чата за окно"""
+    
+    def __init__(self, experience: ExperienceSystem, on_rank_up=None):
+        self.experience = experience
+        self.on_rank_up = on_rank_up  # async (user_id, chat_id, user_data)
+        self.window = MESSAGE_BATCH["window"]
+        self.max_messages = MESSAGE_BATCH["max_messages"]
+        self._pending = {}
+        self._pending_messages = 0
+        self._wakeup = asyncio.Event()
+        self._stopped = False
+    
+    def add(self, user_id: int, chat_id: int, profile: dict = None):
+        """Учитывает одно сообщение за O(1), без обращения к хранилищу"""
+        key = (chat_id, user_id)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {"count": 0, "profile": None}
+        entry["count"] += 1
+        if profile:
+            entry["profile"] = profile
         
-        # Проверяем повышение ранга
-        user_data = RankSystem.update_rank(user_data)
+        self._pending_messages += 1
+        if self._pending_messages >= self.max_messages:
+            self._wakeup.set()
+    
+    async def flush(self) -> list:
+        """Применяет накопленное и рассылает поздравления с новым рангом"""
+        pending, self._pending = self._pending, {}
+        self._pending_messages = 0
+        return await self._apply(pending)
+    
+    async def flush_user(self, chat_id: int, user_id: int) -> list:
+        """Применяет накопленное только для одного пользователя чата"""
+        entry = self._pending.pop((chat_id, user_id), None)
+        if entry is None:
+            return []
+        self._pending_messages -= entry["count"]
+        return await self._apply({(chat_id, user_id): entry})
+    
+    async def _apply(self, pending: dict) -> list:
+        """Начисляет опыт по записям пачки и рассылает поздравления с новым рангом"""
+        rank_ups = []
+        for (chat_id, user_id), entry in pending.items():
+            result = await self.experience.add_message_xp(chat_id, user_id, entry["count"], entry["profile"])
+            if result["rank_up"]:
+                rank_ups.append((user_id, chat_id, result["user"]))
         
-        self.db.save_user(user_id, user_data)
+        if self.on_rank_up:
+            for user_id, chat_id, user_data in rank_ups:
+                try:
+                    await self.on_rank_up(user_id, chat_id, user_data)
+                except Exception as e:
+                    logger.error(f"Ошибка поздравления с рангом {user_id}: {e}")
         
-        return {
-            "xp_gain": base_xp,
-            "new_xp": user_data["xp"],
-            "rank_up": RankSystem.check_rank_up(user_data)
-        }
+        return rank_ups
+    
+    async def run(self):
+        """Фоновый цикл: сброс раз в окно или при переполнении"""
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                await self.flush()
+    
+    async def stop(self):
+        """Останавливает цикл и применяет остаток"""
+        self._stopped = True
+        self._wakeup.set()
+        await self.flush()
@@ -1,68 +1,87 @@
+from bisect import bisect_right
+from functools import lru_cache
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+# Разметки PTB неизменяемы, поэтому строятся один раз при импорте
+# и отдаются всем вызывающим без копирования
+
+_MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👤 Профиль", callback_data="profile")],
+    [InlineKeyboardButton("🎯 Задания", callback_data="quests")],
+    [InlineKeyboardButton("🏆 Топ игроков", callback_data="top")],
+    [InlineKeyboardButton("📜 Правила", callback_data="rules")],
+    [InlineKeyboardButton("🛠️ Модерация", callback_data="moderation")]
+])
+
+_JOIN_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("✅ Присоединиться к сообществу", callback_data="join_community")
+]])
+
+_BACK_TO_MENU = InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад", callback_data="main_menu")]])
+_BACK_TO_MODERATION = InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад", callback_data="moderation")]])
+
+# Ряды меню модерации и минимальный ранг, с которого они видны
+_MODERATION_ROWS = (
+    (1, [[
+        InlineKeyboardButton("🔇 Мут 5 мин", callback_data="mute_5min"),
+        InlineKeyboardButton("🆘 Помощь админа", callback_data="help_admin")
+    ]]),
+    (4, [[
+        InlineKeyboardButton("⚠️ Варн", callback_data="warn"),
+        InlineKeyboardButton("🔇 Мут 30 мин", callback_data="mute_30min")
+    ]]),
+    (8, [[
+        InlineKeyboardButton("🚫 Бан", callback_data="ban"),
+        InlineKeyboardButton("🔇 Мут 7 дней", callback_data="mute_7days")
+    ], [
+        InlineKeyboardButton("🔄 Амнистия", callback_data="amnesty"),
+        InlineKeyboardButton("📊 Статистика", callback_data="mod_stats")
+    ]])
+)
+_MODERATION_TIERS = [min_rank for min_rank, _ in _MODERATION_ROWS]
+# Меню для каждого уровня; нулевое — для ранга ниже первого порога
+_MODERATION_MENUS = [
+    InlineKeyboardMarkup(
+        [row for _, rows in _MODERATION_ROWS[:tier] for row in rows]
+        + [[InlineKeyboardButton("↩️ Назад", callback_data="main_menu")]]
+    )
+    for tier in range(len(_MODERATION_ROWS) + 1)
+]
+
+# Шаблон клавиатуры реакций: подпись и префикс callback_data
+_REACTION_BUTTONS = (
+    ("❤️ +1 XP", "react_heart_"),
+    ("👍 +5 XP", "react_thumbs_"),
+    ("🤓 +10 XP", "react_nerd_")
+)
+
 class KeyboardManager:
     @staticmethod
     def get_main_menu() -> InlineKeyboardMarkup:
         """Основное меню"""
-        keyboard = [
-            [InlineKeyboardButton("👤 Профиль", callback_data="profile")],
-            [InlineKeyboardButton("🎯 Задания", callback_data="quests")],
-            [InlineKeyboardButton("🏆 Топ игроков", callback_data="top")],
-            [InlineKeyboardButton("📜 Правила", callback_data="rules")],
-            [InlineKeyboardButton("🛠️ Модерация", callback_data="moderation")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
-    
+        return _MAIN_MENU
+
     @staticmethod
     def get_join_keyboard() -> InlineKeyboardMarkup:
         """Клавиатура для присоединения"""
-        keyboard = [[
-            InlineKeyboardButton(
-                "✅ Присоединиться к сообществу", 
-                callback_data="join_community"
-            )
-        ]]
-        return InlineKeyboardMarkup(keyboard)
-    
+        return _JOIN_KEYBOARD
+
+    @staticmethod
+    def get_back_keyboard(to_moderation: bool = False) -> InlineKeyboardMarkup:
+        """Кнопка возврата в основное меню или в меню модерации"""
+        return _BACK_TO_MODERATION if to_moderation else _BACK_TO_MENU
+
     @staticmethod
     def get_moderation_menu(rank: int) -> InlineKeyboardMarkup:
         """Меню модерации в зависимости от ранга"""
-        keyboard = []
-        
-        if rank >= 1:
-            keyboard.append([
-                InlineKeyboardButton("🔇 Мут 5 мин", callback_data="mute_5min"),
-                InlineKeyboardButton("🆘 Помощь админа", callback_data="help_admin")
-            ])
-        
-        if rank >= 4:
-            keyboard.append([
-                InlineKeyboardButton("⚠️ Варн", callback_data="warn"),
-                InlineKeyboardButton("🔇 Мут 30 мин", callback_data="mute_30min")
-            ])
-        
-        if rank >= 8:
-            keyboard.append([
-                InlineKeyboardButton("🚫 Бан", callback_data="ban"),
-                InlineKeyboardButton("🔇 Мут 7 дней", callback_data="mute_7days")
-            ])
-            keyboard.append([
-                InlineKeyboardButton("🔄 Амнистия", callback_data="amnesty"),
-                InlineKeyboardButton("📊 Статистика", callback_data="mod_stats")
-            ])
-        
-        keyboard.append([InlineKeyboardButton("↩️ Назад", callback_data="main_menu")])
-        
-        return InlineKeyboardMarkup(keyboard)
-    
+        return _MODERATION_MENUS[bisect_right(_MODERATION_TIERS, rank)]
+
     @staticmethod
+    @lru_cache(maxsize=1024)
     def get_reaction_keyboard(target_id: int) -> InlineKeyboardMarkup:
         """Клавиатура реакций"""
-        keyboard = [
-            [
-                InlineKeyboardButton("❤️ +1 XP", callback_data=f"react_heart_{target_id}"),
-                InlineKeyboardButton("👍 +5 XP", callback_data=f"react_thumbs_{target_id}"),
-                InlineKeyboardButton("🤓 +10 XP", callback_data=f"react_nerd_{target_id}")
-            ]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton(text, callback_data=f"{prefix}{target_id}")
+            for text, prefix in _REACTION_BUTTONS
+        ]])
@@ -0,0 +1,62 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from config import RENDER_CACHE
+from models import UserRecord
+
+class Leaderboard:
+    """Упорядоченный по XP рейтинг, обновляемый инкрементально"""
+
+    def __init__(self, users: Iterable[UserRecord] = (), window: int = None):
+        # Ключ (-xp, user_id): первые элементы списка — лидеры
+        self._entries = SortedList()
+        self._xp: Dict[int, int] = {}
+        # Версия первых window мест: растет, когда меняется кто-то из них
+        # (по ней кэш отрисовки понимает, что топ пора перерисовать)
+        self.window = window or RENDER_CACHE["top_size"]
+        self.version = 0
+        for user in users:
+            self.update(user.user_id, user.xp)
+
+    def __len__(self) -> int:
+        return len(self._xp)
+
+    def _in_window(self, key: Tuple[int, int]) -> bool:
+        if len(self._entries) <= self.window:
+            return True
+        return key <= self._entries[self.window - 1]
+
+    def update(self, user_id: int, xp: int):
+        """Обновляет XP пользователя в рейтинге за O(log n)"""
+        old_xp = self._xp.get(user_id)
+        # Запись из топа сохраняется и без изменения XP (имя, сообщения) — топ тоже меняется
+        if old_xp is not None and self._in_window((-old_xp, user_id)):
+            self.version += 1
+        if old_xp == xp:
+            return
+        if old_xp is not None:
+            self._entries.remove((-old_xp, user_id))
+        self._entries.add((-xp, user_id))
+        self._xp[user_id] = xp
+        if self._in_window((-xp, user_id)):
+            self.version += 1
+
+    def remove(self, user_id: int):
+        """Убирает пользователя из рейтинга"""
+        old_xp = self._xp.pop(user_id, None)
+        if old_xp is not None:
+            if self._in_window((-old_xp, user_id)):
+                self.version += 1
+            self._entries.remove((-old_xp, user_id))
+
+    def top(self, limit: int = 10) -> List[Tuple[int, int]]:
+        """Первые limit позиций: список (user_id, xp) за O(limit)"""
+        return [(user_id, -neg_xp) for neg_xp, user_id in self._entries.islice(0, limit)]
+
+    def position(self, user_id: int) -> Optional[int]:
+        """Место пользователя в рейтинге (с 1) за O(log n)"""
+        xp = self._xp.get(user_id)
+        if xp is None:
+            return None
+        return self._entries.index((-xp, user_id)) + 1
@@ -0,0 +1,53 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable
+
+class KeyedLocks:
+    """Асинхронные блокировки по ключу (например, user_id)"""
+
+    def __init__(self):
+        # Блокировка создается при первом обращении и удаляется, как только
+        # ее никто не держит и не ждет: в памяти только ключи «в работе»
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    async def acquire(self, key: Hashable):
+        """Захватывает блокировку ключа"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._release_ref(key)
+            raise
+
+    def release(self, key: Hashable):
+        """Освобождает блокировку ключа"""
+        self._locks[key].release()
+        self._release_ref(key)
+
+    def _release_ref(self, key: Hashable):
+        """Уменьшает счетчик и вытесняет простаивающую блокировку"""
+        self._waiters[key] -= 1
+        if self._waiters[key] == 0:
+            del self._waiters[key]
+            del self._locks[key]
+
+    @asynccontextmanager
+    async def hold(self, *keys: Hashable):
+        """Захватывает несколько ключей в едином порядке, чтобы не было взаимоблокировок"""
+        ordered = sorted(set(keys))
+        acquired = []
+        try:
+            for key in ordered:
+                await self.acquire(key)
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self.release(key)
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional
+
+from metrics import STORAGE_WRITTEN_BYTES
+
+class ModerationLog:
+    """Журнал модерации: JSON Lines, один сегмент-файл на день"""
+
+    SUFFIX = ".jsonl"
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+
+        self._lock = threading.Lock()
+        self._segment_date = None
+        self._segment = None
+        self._last_id = self._recover_last_id()
+
+    def _segment_path(self, day: str) -> str:
+        """Путь к сегменту за день (YYYY-MM-DD)"""
+        return os.path.join(self.log_dir, day + self.SUFFIX)
+
+    def _segment_days(self) -> list:
+        """Отсортированный список дней, за которые есть сегменты"""
+        return sorted(
+            name[:-len(self.SUFFIX)]
+            for name in os.listdir(self.log_dir)
+            if name.endswith(self.SUFFIX)
+        )
+
+    def _recover_last_id(self) -> int:
+        """Восстанавливает счетчик id по хвосту последнего сегмента"""
+        days = self._segment_days()
+        if not days:
+            return 0
+
+        path = self._segment_path(days[-1])
+        last_id = 0
+        valid_size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    last_id = json.loads(line)["id"]
+                except ValueError:
+                    break
+                valid_size += len(line)
+
+        # Отрезаем оборванную после падения строку
+        if valid_size != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+
+        return last_id
+
+    def append(self, action: str, moderator_id: int, target_id: int,
+               reason: str = "", timestamp: Optional[datetime] = None) -> int:
+        """Дописывает запись в сегмент текущего дня и возвращает ее id"""
+        [log_id] = self.append_many([{
+            "action": action,
+            "moderator_id": moderator_id,
+            "target_id": target_id,
+            "reason": reason
+        }], timestamp)
+        return log_id
+
+    def append_many(self, entries: List[Dict[str, Any]],
+                    timestamp: Optional[datetime] = None) -> List[int]:
+        """Дописывает пачку записей одной записью в файл и возвращает их id"""
+        timestamp = timestamp or datetime.now()
+        day = timestamp.date().isoformat()
+
+        with self._lock:
+            if day != self._segment_date:
+                if self._segment:
+                    self._segment.close()
+                self._segment = open(self._segment_path(day), 'a', encoding='utf-8')
+                self._segment_date = day
+
+            ids = []
+            lines = []
+            for entry in entries:
+                self._last_id += 1
+                ids.append(self._last_id)
+                lines.append(json.dumps({
+                    "id": self._last_id,
+                    "action": entry["action"],
+                    "moderator_id": entry["moderator_id"],
+                    "target_id": entry["target_id"],
+                    "reason": entry.get("reason", ""),
+                    "timestamp": timestamp.isoformat()
+                }, ensure_ascii=False) + "\n")
+
+            payload = "".join(lines)
+            self._segment.write(payload)
+            STORAGE_WRITTEN_BYTES.inc("moderation_log", amount=len(payload.encode('utf-8')))
+            self._segment.flush()
+            return ids
+
+    def read(self, since: Optional[datetime] = None,
+             until: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+        """Потоково читает записи за интервал [since, until], открывая только нужные сегменты"""
+        since_day = since.date().isoformat() if since else None
+        until_day = until.date().isoformat() if until else None
+        since_ts = since.isoformat() if since else None
+        until_ts = until.isoformat() if until else None
+
+        for day in self._segment_days():
+            if since_day and day < since_day:
+                continue
+            if until_day and day > until_day:
+                break
+
+            with open(self._segment_path(day), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since_ts and entry["timestamp"] < since_ts:
+                        continue
+                    if until_ts and entry["timestamp"] > until_ts:
+                        return
+                    yield entry
+
+    def import_legacy(self, logs: Dict[str, Any]):
+        """Переносит записи из старого logs.json"""
+        for log_id, log in sorted(logs.items(), key=lambda item: int(item[0])):
+            self.append(
+                log["action"], log["moderator_id"], log["target_id"],
+                log.get("reason", ""), datetime.fromisoformat(log["timestamp"])
+            )
+
+    def close(self):
+        """Закрывает открытый сегмент"""
+        with self._lock:
+            if self._segment:
+                self._segment.close()
+                self._segment = None
+                self._segment_date = None
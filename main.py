@@ -1,19 +1,37 @@
 #!/usr/bin/env python3
+import io
 import os
 import asyncio
 import logging
-from datetime import datetime, timedelta
 
-from telegram import Update, ChatPermissions
+from telegram import Update
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
     CallbackQueryHandler, ContextTypes, filters
 )
 
+from callback_router import CallbackRouter, edit_menu
+from config import DEVELOPER_ID, METRICS, MODERATION, PROFILING, RENDER_CACHE, SERVER, STORAGE, WORKERS
+from experience import ExperienceSystem, MessageXPBatcher
+from keyboard import KeyboardManager
+from metrics import REGISTRY, UPDATES_PENDING, start_http_server, track_handler
+from models import UserRecord
+from profiler import LoopWatchdog, Profiler
+from moderation import ModerationSystem
+from quest import QUESTS, QuestSystem
+from ranks import RankSystem
+from render_cache import RenderCache
+from sender import PRIORITY_COSMETIC, MessageDropped, SendScheduler
+from shards import ChatStorage
+from timeseries import ActivityStats
+from update_processor import ChatOrderedUpdateProcessor, get_allowed_updates
+from utils import Utils
+from workers import build_front_application, worker_data_dir, worker_index
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=os.getenv('BOT_LOG_LEVEL', 'INFO')
 )
 logger = logging.getLogger(__name__)
 
@@ -23,25 +41,34 @@ if not BOT_TOKEN:
     logger.error("BOT_TOKEN не установлен!")
     exit(1)
 
-# База данных в памяти (для примера, позже замените на JSON)
-users_db = {}
+# Хранилище (по чатам) и системы опыта
+db = ChatStorage()
+# История активности ведет процесс, которому принадлежат чаты (workers.py)
+activity = ActivityStats(worker_data_dir())
+quests = QuestSystem(db)
+experience = ExperienceSystem(db, quests, activity)
+message_batcher = MessageXPBatcher(experience)
+profiler = Profiler()
+render_cache = RenderCache()
+watchdog = LoopWatchdog()
+
+def user_profile(user) -> dict:
+    """Поля профиля пользователя Telegram для сохранения в базе"""
+    return {
+        'username': user.username or '',
+        'first_name': user.first_name or '',
+        'last_name': user.last_name or ''
+    }
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user = update.effective_user
     
     # Сохраняем пользователя
-    if user.id not in users_db:
-        users_db[user.id] = {
-            'id': user.id,
-            'username': user.username or '',
-            'first_name': user.first_name or '',
-            'last_name': user.last_name or '',
-            'xp': 0,
-            'rank': 1,
-            'messages': 0,
-            'join_date': datetime.now().isoformat()
-        }
+    chat_db = await db.chat(update.effective_chat.id)
+    async with chat_db.locks.hold(user.id):
+        async with chat_db.transaction(user.id) as users:
+            users[user.id].set_profile(user_profile(user))
     
     welcome_text = f"""
 👋 Привет, {user.first_name}!
@@ -67,30 +94,37 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /profile"""
     user = update.effective_user
     
-    if user.id not in users_db:
-        await update.message.reply_text(
-            "Сначала используйте /start для регистрации!",
-            parse_mode='HTML'
-        )
-        return
-    
-    user_data = users_db[user.id]
+    # Применяем накопленный опыт пользователя, чтобы профиль был актуальным
+    await message_batcher.flush_user(update.effective_chat.id, user.id)
     
-    profile_text = f"""
-👤 <b>ПРОФИЛЬ</b>
+    await update.message.reply_text(await render_profile(update.effective_chat.id, user.id), parse_mode='HTML')
 
-<b>Имя:</b> {user_data['first_name']} {user_data['last_name']}
-<b>Username:</b> @{user_data['username'] or 'не установлен'}
-<b>ID:</b> <code>{user.id}</code>
+async def render_profile(chat_id: int, user_id: int) -> str:
+    """Карточка профиля из кэша или отрисованная заново"""
+    chat_db = await db.chat(chat_id)
+    position = await chat_db.get_user_position(user_id)
+    key = ("profile", chat_id, chat_db.generation, user_id, chat_db.user_version(user_id), position)
+    text = render_cache.get(key)
+    if text is None:
+        text = Utils.create_profile_card(await chat_db.get_user(user_id), position)
+        render_cache.put(key, text)
+    return text
 
-<b>Ранг:</b> Луркер 🕶️
-<b>Опыт:</b> {user_data['xp']} XP
-<b>Сообщений:</b> {user_data['messages']}
+async def render_top(chat_id: int) -> str:
+    """Топ игроков чата из кэша или отрисованный заново"""
+    # Версия берется до чтения: если топ изменится во время отрисовки,
+    # текст ляжет под устаревший ключ и следующий запрос перерисует его
+    chat_db = await db.chat(chat_id)
+    key = ("top", chat_id, chat_db.generation, chat_db.top_version())
+    text = render_cache.get(key)
+    if text is None:
+        text = Utils.create_top_users_list(await chat_db.get_top_users(RENDER_CACHE["top_size"]))
+        render_cache.put(key, text)
+    return text
 
-<b>В сообществе с:</b> {user_data['join_date'][:10]}
-    """.strip()
-    
-    await update.message.reply_text(profile_text, parse_mode='HTML')
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /top"""
+    await update.message.reply_text(await render_top(update.effective_chat.id), parse_mode='HTML')
 
 async def show_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /id"""
@@ -117,6 +151,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 <b>Основные команды:</b>
 /start — Начать работу с ботом
+/menu — Меню с кнопками
 /profile — Ваш профиль
 /id — Показать ID
 /top — Топ игроков
@@ -136,9 +171,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(help_text, parse_mode='HTML')
 
-async def rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /rules"""
-    rules_text = """
+RULES_TEXT = """
 📜 <b>ПРАВИЛА СООБЩЕСТВА</b>
 
 1. Уважайте друг друга
@@ -151,34 +184,281 @@ async def rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
 1. Предупреждение ⚠️
 2. Мут 🔇
 3. Бан 🚫
+""".strip()
+
+MENU_TEXT = "📋 <b>МЕНЮ</b>"
+
+async def rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /rules"""
+    await update.message.reply_text(RULES_TEXT, parse_mode='HTML')
+
+async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /menu"""
+    message = update.message
+    # Меню, вызванное ответом на сообщение, отвечает на него же:
+    # кнопки модерации действуют на автора этого сообщения
+    target = message.reply_to_message or message
+    await context.bot.send_message(
+        message.chat_id, MENU_TEXT, parse_mode='HTML',
+        reply_to_message_id=target.message_id,
+        reply_markup=KeyboardManager.get_main_menu()
+    )
+
+# Обработчики кнопок: (update, context, аргумент) -> текст уведомления или None
+
+async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    await edit_menu(update, MENU_TEXT, KeyboardManager.get_main_menu())
+
+async def profile_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    await message_batcher.flush_user(update.effective_chat.id, update.effective_user.id)
+    text = await render_profile(update.effective_chat.id, update.effective_user.id)
+    await edit_menu(update, text, KeyboardManager.get_back_keyboard())
+
+async def top_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    await edit_menu(update, await render_top(update.effective_chat.id), KeyboardManager.get_back_keyboard())
+
+async def rules_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    await edit_menu(update, RULES_TEXT, KeyboardManager.get_back_keyboard())
+
+async def quests_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    lines = []
+    for name in await quests.get_available_quests(chat_id, user_id):
+        mark = "✅" if await quests.check_quest_completion(chat_id, user_id, name) else "▫️"
+        lines.append(f"{mark} {name} — {QUESTS[name]['reward']} XP")
+    text = "🎯 <b>ЗАДАНИЯ НА СЕГОДНЯ</b>\n\n" + ("\n".join(lines) or "Все задания выполнены")
+    await edit_menu(update, text, KeyboardManager.get_back_keyboard())
+
+async def moderation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    chat_db = await db.chat(update.effective_chat.id)
+    user_data = await chat_db.get_user(update.effective_user.id)
+    text = "🛠️ <b>МОДЕРАЦИЯ</b>\n\nДействия применяются к автору сообщения, на которое ответило меню"
+    await edit_menu(update, text, KeyboardManager.get_moderation_menu(user_data.rank))
+
+async def join_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    user = update.effective_user
+    chat_db = await db.chat(update.effective_chat.id)
+    async with chat_db.locks.hold(user.id):
+        async with chat_db.transaction(user.id) as users:
+            users[user.id].set_profile(user_profile(user))
+    return "✅ Добро пожаловать в сообщество!"
+
+async def help_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    if not DEVELOPER_ID:
+        return "Администратор не назначен"
+    user = update.effective_user
+    chat = update.effective_chat
+    await context.bot.send_message(
+        DEVELOPER_ID,
+        f"🆘 {Utils.escape_html(user.full_name)} (<code>{user.id}</code>) зовет администратора "
+        f"в чат {Utils.escape_html(chat.title or str(chat.id))}",
+        parse_mode='HTML'
+    )
+    return "🆘 Администратор уведомлен"
+
+def moderation_action_callback(action: str, duration: int = 0):
+    """Обработчик кнопки наказания для автора сообщения, на которое ответило меню"""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+        reply = update.callback_query.message.reply_to_message
+        target = reply.from_user if reply else None
+        moderator_id = update.effective_user.id
+        if target is None or target.is_bot or target.id == moderator_id:
+            return "Вызовите /menu ответом на сообщение нарушителя"
+
+        moderation = context.bot_data['moderation']
+        chat_id = update.effective_chat.id
+        reason = "Меню модерации"
+        if action == "mute":
+            result = await moderation.mute_user(moderator_id, target.id, chat_id, duration, reason)
+        elif action == "warn":
+            result = await moderation.warn_user(moderator_id, target.id, chat_id, reason)
+        else:
+            result = await moderation.ban_user(moderator_id, target.id, chat_id, duration, reason)
+
+        if not result["success"]:
+            return f"❌ {result['message']}"
+        if action == "mute":
+            return f"🔇 Мут на {Utils.format_time(duration)}"
+        if action == "warn":
+            return f"⚠️ Варн {result['warns']}/{MODERATION['warns_before_ban']}"
+        return f"🚫 Бан на {Utils.format_time(duration)}"
+    return handler
+
+async def amnesty_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    result = await context.bot_data['moderation'].amnesty(update.effective_user.id, update.effective_chat.id)
+    if not result["success"]:
+        return f"❌ {result['message']}"
+    return f"🔄 Варны сняты: {len(result['pardoned'])}"
+
+async def mod_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+    chat_db = await db.chat(update.effective_chat.id)
+    user_data = await chat_db.get_user(update.effective_user.id)
+    if not context.bot_data['moderation'].has_bulk_permission(user_data.rank):
+        return "❌ Недостаточно прав"
+    summary = activity.chat_summary(update.effective_chat.id)
+    text = f"""
+📊 <b>СТАТИСТИКА ЧАТА ЗА 7 ДНЕЙ</b>
+
+<b>Сообщений:</b> {summary['messages']}
+<b>Реакций:</b> {summary['reactions_given']}
+<b>Предупреждений:</b> {summary['warns']}
     """.strip()
-    
-    await update.message.reply_text(rules_text, parse_mode='HTML')
+    await edit_menu(update, text, KeyboardManager.get_back_keyboard(to_moderation=True))
+
+def reaction_callback(reaction_type: str):
+    """Обработчик кнопки реакции; аргумент — ID получателя"""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE, argument):
+        try:
+            target_id = int(argument)
+        except ValueError:
+            return None
+        if target_id == update.effective_user.id:
+            return "Нельзя оценивать себя"
+        result = await experience.give_reaction(
+            update.effective_chat.id, update.effective_user.id, target_id, reaction_type
+        )
+        if not result["success"]:
+            return result["message"]
+        return f"+{result['xp_gain']} XP"
+    return handler
+
+def build_callback_router() -> CallbackRouter:
+    """Таблица кнопок: меню отвечают сразу, действия — текстом результата"""
+    router = CallbackRouter()
+    router.exact("main_menu", main_menu_callback)
+    router.exact("profile", profile_callback)
+    router.exact("top", top_callback)
+    router.exact("rules", rules_callback)
+    router.exact("quests", quests_callback)
+    router.exact("moderation", moderation_callback)
+    router.exact("join_community", join_callback, answer_first=False)
+    router.exact("help_admin", help_admin_callback, answer_first=False)
+    durations = MODERATION["mute_durations"]
+    router.exact("mute_5min", moderation_action_callback("mute", durations["low"]), answer_first=False)
+    router.exact("mute_30min", moderation_action_callback("mute", durations["medium"]), answer_first=False)
+    router.exact("mute_7days", moderation_action_callback("mute", durations["high"]), answer_first=False)
+    router.exact("warn", moderation_action_callback("warn"), answer_first=False)
+    router.exact("ban", moderation_action_callback("ban", 86400), answer_first=False)
+    router.exact("amnesty", amnesty_callback, answer_first=False)
+    router.exact("mod_stats", mod_stats_callback, answer_first=False)
+    # Префиксы совпадают с KeyboardManager.get_reaction_keyboard
+    router.prefix("react_heart", reaction_callback("heart"))
+    router.prefix("react_thumbs", reaction_callback("thumbs_up"))
+    router.prefix("react_nerd", reaction_callback("nerd"))
+    return router
+
+callback_router = build_callback_router()
+
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик нажатий на кнопки"""
+    await callback_router.dispatch(update, context)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик обычных сообщений"""
     user = update.effective_user
     
-    # Регистрируем пользователя если его нет
-    if user.id not in users_db:
-        users_db[user.id] = {
-            'id': user.id,
-            'username': user.username or '',
-            'first_name': user.first_name or '',
-            'last_name': user.last_name or '',
-            'xp': 0,
-            'rank': 1,
-            'messages': 0,
-            'join_date': datetime.now().isoformat()
-        }
-    
-    # Увеличиваем счетчик сообщений
-    users_db[user.id]['messages'] += 1
-    users_db[user.id]['xp'] += 1  # 1 XP за сообщение
+    # 1 XP за сообщение: копим в пачке, в хранилище пишем раз в окно
+    message_batcher.add(user.id, update.effective_chat.id, user_profile(user))
+    activity.add_message(user.id, update.effective_chat.id)
     
     # Логируем (для отладки)
     logger.info(f"Сообщение от {user.username or user.id}: {update.message.text[:50]}...")
 
+# Правила MODERATION["rate_limits"] по типу сообщения; "messages" считает все сообщения
+RATE_LIMIT_FILTERS = (
+    ("stickers", filters.Sticker.ALL),
+    ("media", filters.PHOTO | filters.VIDEO | filters.ANIMATION | filters.AUDIO
+              | filters.VOICE | filters.VIDEO_NOTE | filters.Document.ALL),
+    ("forwards", filters.FORWARDED),
+)
+
+async def check_rate_limits(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверяет лимиты частоты сообщений в группе и выдает варн за превышение"""
+    moderation = context.bot_data['moderation']
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    # За одно сообщение — не больше одного варна
+    if await moderation.check_rate_limit("messages", user_id, chat_id):
+        return
+    for rule, message_filter in RATE_LIMIT_FILTERS:
+        if message_filter.check_update(update) and await moderation.check_rate_limit(rule, user_id, chat_id):
+            return
+
+def is_developer(update: Update) -> bool:
+    """Команды диагностики доступны только разработчику"""
+    return bool(DEVELOPER_ID) and update.effective_user.id == DEVELOPER_ID
+
+async def send_text_or_file(bot, chat_id: int, text: str, filename: str):
+    """Короткий текст — сообщением, длинный — файлом"""
+    if len(text) <= 4000:
+        await bot.send_message(chat_id, f"<pre>{Utils.escape_html(text)}</pre>", parse_mode='HTML')
+    else:
+        await bot.send_document(chat_id, io.BytesIO(text.encode('utf-8')), filename=filename)
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /metrics (только для разработчика)"""
+    if not is_developer(update):
+        return
+    await send_text_or_file(context.bot, update.effective_chat.id, REGISTRY.render(), "metrics.txt")
+
+async def send_profile_report(bot, chat_id: int, report):
+    """Отправляет сводку горячих мест и дамп pstats"""
+    await send_text_or_file(bot, chat_id, report.summary, "profile.txt")
+    await bot.send_document(chat_id, io.BytesIO(report.dump), filename="profile.pstats",
+                            caption=f"cProfile, {report.duration:.1f} с")
+
+async def profile_start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile_start [секунды] (только для разработчика)"""
+    if not is_developer(update):
+        return
+    
+    try:
+        duration = float(context.args[0]) if context.args else PROFILING["default_duration"]
+    except ValueError:
+        await update.message.reply_text("Использование: /profile_start [секунды]")
+        return
+    
+    chat_id = update.effective_chat.id
+    bot = context.bot
+    
+    async def on_done(report):
+        await send_profile_report(bot, chat_id, report)
+    
+    if profiler.start(duration, on_done):
+        await update.message.reply_text(
+            f"⏱ Профилирование на {min(duration, PROFILING['max_duration']):g} с. Досрочно: /profile_stop"
+        )
+    else:
+        await update.message.reply_text("Профилирование уже идет")
+
+async def profile_stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile_stop (только для разработчика)"""
+    if not is_developer(update):
+        return
+    
+    report = profiler.stop()
+    if report is None:
+        await update.message.reply_text("Профилирование не запущено")
+        return
+    await send_profile_report(context.bot, update.effective_chat.id, report)
+
+async def slow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /slow: последние блокировки цикла событий (только для разработчика)"""
+    if not is_developer(update):
+        return
+    
+    if not watchdog.episodes:
+        await update.message.reply_text(f"Блокировок дольше {watchdog.threshold} с не было")
+        return
+    
+    text = "\n\n".join(
+        f"{episode['time']} — {episode['duration'] * 1000:.0f} мс, {episode['handler']}\n{episode['stack']}"
+        for episode in reversed(watchdog.episodes)
+    )
+    await send_text_or_file(context.bot, update.effective_chat.id, text, "slow.txt")
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Ошибка: {context.error}")
@@ -191,6 +471,93 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
 
+async def announce_rank_up(app: Application, user_id: int, chat_id: int, user_data: UserRecord):
+    """Поздравляет пользователя с новым рангом"""
+    name = Utils.escape_html(user_data.first_name or str(user_id))
+    try:
+        await app.bot.send_message(
+            chat_id=chat_id,
+            text=f"🎉 <b>{name}</b> получает новый ранг: {RankSystem.get_rank_label(user_data.rank)}",
+            parse_mode='HTML',
+            # Поздравление некритично: под нагрузкой его можно отбросить,
+            # а из нескольких поздравлений одного пользователя отправить последнее
+            rate_limit_args={"priority": PRIORITY_COSMETIC, "coalesce_key": ("rank_up", user_id)}
+        )
+    except MessageDropped:
+        pass
+
+async def post_init(app: Application):
+    """Запускает фоновые задачи после инициализации бота"""
+    async def on_rank_up(user_id: int, chat_id: int, user_data: UserRecord):
+        await announce_rank_up(app, user_id, chat_id, user_data)
+    
+    message_batcher.on_rank_up = on_rank_up
+    app.bot_data['moderation'] = ModerationSystem(db, app.bot, quests, activity)
+    app.bot_data['message_batcher_task'] = asyncio.create_task(message_batcher.run())
+    app.bot_data['activity_task'] = asyncio.create_task(activity.run())
+    app.bot_data['watchdog_task'] = asyncio.create_task(watchdog.run())
+    app.bot_data['storage_task'] = asyncio.create_task(db.run())
+    
+    UPDATES_PENDING.set_function(app.update_queue.qsize, "queued")
+    if METRICS["http_port"]:
+        # Основной порт занят принимающим процессом, рабочие процессы слушают следующие
+        port = METRICS["http_port"]
+        if worker_index() is not None:
+            port += 1 + worker_index()
+        app.bot_data['metrics_server'] = await start_http_server(METRICS["listen"], port)
+
+async def post_shutdown(app: Application):
+    """Сохраняет накопленные данные при остановке"""
+    if 'metrics_server' in app.bot_data:
+        app.bot_data['metrics_server'].close()
+    app.bot_data['watchdog_task'].cancel()
+    profiler.stop()
+    await message_batcher.stop()
+    activity.stop()
+    await app.bot_data['activity_task']
+    db.stop()
+    await app.bot_data['storage_task']
+    await db.close()
+
+def build_application(builder) -> Application:
+    """Приложение со всеми обработчиками; токен, запросы к API и лимиты задает builder"""
+    app = (
+        builder
+        .concurrent_updates(ChatOrderedUpdateProcessor(SERVER["concurrent_updates"], pin=db.pin))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    
+    # Регистрируем обработчики
+    app.add_handler(CommandHandler("start", track_handler(start)))
+    app.add_handler(CommandHandler("profile", track_handler(profile)))
+    app.add_handler(CommandHandler("id", track_handler(show_id)))
+    app.add_handler(CommandHandler("top", track_handler(top_command)))
+    app.add_handler(CommandHandler("menu", track_handler(menu_command)))
+    app.add_handler(CommandHandler("help", track_handler(help_command)))
+    app.add_handler(CommandHandler("rules", track_handler(rules)))
+    app.add_handler(CommandHandler("metrics", metrics_command))
+    app.add_handler(CommandHandler("profile_start", profile_start_command))
+    app.add_handler(CommandHandler("profile_stop", profile_stop_command))
+    app.add_handler(CommandHandler("slow", slow_command))
+    
+    # Кнопки: один обработчик с таблицей маршрутов
+    app.add_handler(CallbackQueryHandler(track_handler(handle_callback)))
+    
+    # Лимиты частоты: отдельная группа, чтобы сообщение дошло и до начисления опыта
+    app.add_handler(MessageHandler(
+        filters.UpdateType.MESSAGE & filters.ChatType.GROUPS & ~filters.COMMAND,
+        track_handler(check_rate_limits)
+    ), group=-1)
+    
+    # Обработчик текстовых сообщений
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, track_handler(handle_message)))
+    
+    # Обработчик ошибок
+    app.add_error_handler(error_handler)
+    return app
+
 def main():
     """Основная функция запуска бота"""
     print("=== ЗАПУСК БОТА ===")
@@ -202,26 +569,37 @@ def main():
         exit(1)
     
     # Создаем приложение
-    app = Application.builder().token(BOT_TOKEN).build()
-    
-    # Регистрируем обработчики
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("profile", profile))
-    app.add_handler(CommandHandler("id", show_id))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("rules", rules))
-    
-    # Обработчик текстовых сообщений
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    
-    # Обработчик ошибок
-    app.add_error_handler(error_handler)
+    if WORKERS["count"]:
+        # Общее хранилище нельзя вести из нескольких процессов, а хранилище чата — можно:
+        # чат всегда обрабатывает один и тот же процесс
+        if not STORAGE["partition_by_chat"]:
+            print("ОШИБКА: для BOT_WORKERS нужно STORAGE['partition_by_chat'] = True")
+            exit(1)
+        # Здесь только прием апдейтов и вызовы API; обработчики работают в рабочих процессах
+        app = build_front_application(
+            Application.builder().token(BOT_TOKEN).rate_limiter(SendScheduler()), WORKERS["count"]
+        )
+        allowed_updates = get_allowed_updates(build_application(Application.builder().token(BOT_TOKEN)))
+        print(f"Рабочих процессов: {WORKERS['count']}")
+    else:
+        app = build_application(Application.builder().token(BOT_TOKEN).rate_limiter(SendScheduler()))
+        allowed_updates = get_allowed_updates(app)
     
     print("Бот запускается...")
     print("Для остановки нажмите Ctrl+C")
     
     # Запускаем бота
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if SERVER["mode"] == "webhook":
+        app.run_webhook(
+            listen=SERVER["listen"],
+            port=SERVER["port"],
+            url_path=SERVER["url_path"],
+            webhook_url=SERVER["webhook_url"] or None,
+            secret_token=SERVER["secret_token"] or None,
+            allowed_updates=allowed_updates
+        )
+    else:
+        app.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in values]
+
+class Gauge:
+    """Текущее значение: задается явно или читается функцией при выгрузке"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values: Dict[Tuple, float] = {}
+        self._callbacks: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def set_function(self, callback: Callable[[], float], *label_values):
+        self._callbacks[label_values] = callback
+
+    def render(self) -> List[str]:
+        values = dict(self._values)
+        for key, callback in list(self._callbacks.items()):
+            try:
+                values[key] = callback()
+            except Exception as e:
+                logger.error(f"Метрика {self.name}: {e}")
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in values.items()]
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: observe — бинарный поиск и два сложения"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # метки -> [счетчики корзин + inf, сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+
+        lines = []
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _labels(self.label_names, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+class Registry:
+    """Набор метрик и выгрузка в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Метрики бота
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Время работы обработчика", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+UPDATES_PENDING = REGISTRY.gauge(
+    "bot_updates_pending", "Апдейты в очереди и в обработке", ("stage",))
+DB_SECONDS = REGISTRY.histogram(
+    "bot_db_operation_seconds", "Время операции хранилища, включая ожидание пула", ("op",))
+STORAGE_READ_BYTES = REGISTRY.counter(
+    "bot_storage_read_bytes_total", "Прочитано байт с диска", ("store",))
+STORAGE_WRITTEN_BYTES = REGISTRY.counter(
+    "bot_storage_written_bytes_total", "Записано байт на диск", ("store",))
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "bot_telegram_request_seconds", "Время запроса к Bot API", ("endpoint",))
+TELEGRAM_ERRORS = REGISTRY.counter(
+    "bot_telegram_errors_total", "Ошибки запросов к Bot API", ("endpoint", "error"))
+SEND_QUEUE_SECONDS = REGISTRY.histogram(
+    "bot_send_queue_seconds", "Ожидание в очереди отправки", ("priority",))
+SEND_BACKLOG = REGISTRY.gauge(
+    "bot_send_backlog", "Запросы в очереди отправки")
+LOOP_BLOCKS = REGISTRY.histogram(
+    "bot_event_loop_block_seconds", "Блокировки цикла событий дольше порога", ("handler",))
+STORAGE_SHARDS = REGISTRY.gauge(
+    "bot_storage_shards_loaded", "Открытые хранилища чатов")
+WORKER_UPDATES = REGISTRY.counter(
+    "bot_worker_updates_total", "Апдейты, переданные рабочим процессам", ("worker",))
+WORKER_RESTARTS = REGISTRY.counter(
+    "bot_worker_restarts_total", "Перезапуски упавших рабочих процессов", ("worker",))
+RENDER_CACHE_REQUESTS = REGISTRY.counter(
+    "bot_render_cache_requests_total", "Обращения к кэшу отрисовки", ("kind", "result"))
+
+def track_handler(callback):
+    """Оборачивает обработчик PTB: время выполнения и число исключений"""
+    name = callback.__name__
+
+    @wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+async def start_http_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Локальный HTTP-эндпоинт /metrics для Prometheus"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # Заголовки запроса не нужны, но их надо дочитать
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", REGISTRY.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,291 @@
+import time
+from array import array
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+# Порядок реакций в массивах счетчиков
+REACTIONS = ("heart", "thumbs_up", "nerd")
+REACTION_INDEX = {reaction: i for i, reaction in enumerate(REACTIONS)}
+
+# Горячие числовые поля записи в порядке UserRecord.hot_values():
+# JSON-хранилище держит их в columnstore.ColumnStore и обновляет на месте
+HOT_FIELDS = (
+    ("xp", "i"), ("rank", "B"), ("messages_count", "I"), ("warns", "H"), ("last_active", "q"),
+    ("daily_day", "I"), ("daily_messages", "I"),
+    *((f"{reaction}_given", "I") for reaction in REACTIONS),
+    *((f"{reaction}_given_at", "q") for reaction in REACTIONS),
+    *((f"{reaction}_received", "I") for reaction in REACTIONS),
+    *((f"daily_{reaction}_given", "H") for reaction in REACTIONS)
+)
+
+# Время хранится в секундах эпохи (0 — «не было»), в users.json — в ISO,
+# как и раньше, поэтому формат файлов не меняется
+
+def _to_epoch(value) -> int:
+    if not value:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+def _to_iso(epoch: int) -> Optional[str]:
+    return datetime.fromtimestamp(epoch).isoformat() if epoch else None
+
+# Массивы реакций не изменяются на месте: изменение заменяет массив копией
+# (см. UserRecord.give_reaction). Поэтому записи без реакций — у большинства
+# пользователей — делят эти нулевые массивы, а копия записи делит массивы с исходной
+_ZERO_COUNTS = array('I', [0] * len(REACTIONS))
+_ZERO_EPOCHS = array('q', [0] * len(REACTIONS))
+
+# Пустые вложенные объекты в формате users.json. Сравнение словарей выполняется
+# целиком в C, поэтому пустые части записи (у большинства пользователей) читаются
+# одним сравнением вместо разбора по полям
+_NO_REACTIONS = dict.fromkeys(REACTIONS, 0)
+_NO_REACTIONS_GIVEN = {reaction: {"count": 0, "last_date": None} for reaction in REACTIONS}
+_NO_MODERATION = {"warns": 0, "mutes": 0, "bans": 0, "last_warn": None}
+
+# ISO-дата -> порядковый номер: дат у дневной статистики в снимке единицы
+_DAY_ORDINALS: Dict[str, int] = {}
+
+def _counts(values: Dict[str, int]) -> array:
+    if not values or values == _NO_REACTIONS:
+        return _ZERO_COUNTS
+    return array('I', [values.get(reaction, 0) for reaction in REACTIONS])
+
+def _to_ordinal(value: Optional[str]) -> int:
+    if not value:
+        return 0
+    day = _DAY_ORDINALS.get(value)
+    if day is None:
+        if len(_DAY_ORDINALS) > 1024:
+            _DAY_ORDINALS.clear()
+        day = _DAY_ORDINALS[value] = date.fromisoformat(value).toordinal()
+    return day
+
+def _incremented(values: array, index: int) -> array:
+    values = values[:]
+    values[index] += 1
+    return values
+
+class DailyStats:
+    """Дневная статистика; day — порядковый номер даты (date.toordinal), 0 — дата неизвестна"""
+
+    __slots__ = ("day", "messages", "reactions_given", "counters")
+
+    def __init__(self, day: Optional[int] = None, messages: int = 0, reactions_given: array = None,
+                 counters: Optional[Dict[str, int]] = None):
+        # Статистика без даты (записи старых версий) считается устаревшей:
+        # roll_daily обнулит ее при первом обращении
+        self.day = date.today().toordinal() if day is None else day
+        self.messages = messages
+        self.reactions_given = reactions_given if reactions_given is not None else _ZERO_COUNTS
+        self.counters = counters  # Дневные счетчики квестов, создаются при первом событии
+
+    def copy(self) -> "DailyStats":
+        return DailyStats(self.day, self.messages, self.reactions_given,
+                          dict(self.counters) if self.counters else None)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DailyStats":
+        stats = cls.__new__(cls)
+        get = data.get
+        stats.day = _to_ordinal(get("date"))
+        stats.messages = get("messages", 0)
+        stats.reactions_given = _counts(get("reactions_given"))
+        counters = get("counters")
+        stats.counters = dict(counters) if counters else None
+        return stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "date": date.fromordinal(self.day).isoformat() if self.day else None,
+            "messages": self.messages,
+            "reactions_given": dict(zip(REACTIONS, self.reactions_given)),
+            "counters": dict(self.counters) if self.counters else {}
+        }
+
+class ModerationStats:
+    """Счетчики наказаний пользователя"""
+
+    __slots__ = ("warns", "mutes", "bans", "last_warn")
+
+    def __init__(self, warns: int = 0, mutes: int = 0, bans: int = 0, last_warn: int = 0):
+        self.warns = warns
+        self.mutes = mutes
+        self.bans = bans
+        self.last_warn = last_warn
+
+    def copy(self) -> "ModerationStats":
+        return ModerationStats(self.warns, self.mutes, self.bans, self.last_warn)
+
+class UserRecord:
+    """Запись пользователя: слоты вместо вложенных словарей, счетчики реакций в массивах"""
+
+    __slots__ = (
+        "user_id", "username", "first_name", "last_name", "xp", "rank", "messages_count",
+        "reactions_given", "reactions_given_at", "reactions_received", "quests_completed",
+        "daily_stats", "moderation", "join_date", "last_active"
+    )
+
+    def __init__(self, user_id: int):
+        now = int(time.time())
+        self.user_id = user_id
+        self.username = ""
+        self.first_name = ""
+        self.last_name = ""
+        self.xp = 0
+        self.rank = 1
+        self.messages_count = 0
+        self.reactions_given = _ZERO_COUNTS
+        self.reactions_given_at = _ZERO_EPOCHS
+        self.reactions_received = _ZERO_COUNTS
+        self.quests_completed = ()
+        self.daily_stats = DailyStats()
+        self.moderation = ModerationStats()
+        self.join_date = now
+        self.last_active = now
+
+    def roll_daily(self) -> DailyStats:
+        """Лениво обнуляет дневную статистику, если она за прошлый день"""
+        today = date.today().toordinal()
+        if self.daily_stats.day != today:
+            self.daily_stats = DailyStats(today)
+        return self.daily_stats
+
+    def give_reaction(self, index: int, now: int):
+        """Учитывает отданную реакцию в общих и дневных счетчиках"""
+        self.reactions_given = _incremented(self.reactions_given, index)
+        self.reactions_given_at = self.reactions_given_at[:]
+        self.reactions_given_at[index] = now
+        daily_stats = self.daily_stats
+        daily_stats.reactions_given = _incremented(daily_stats.reactions_given, index)
+
+    def receive_reaction(self, index: int):
+        """Учитывает полученную реакцию"""
+        self.reactions_received = _incremented(self.reactions_received, index)
+
+    def set_profile(self, profile: Dict[str, str]):
+        """Обновляет имя и username из профиля Telegram"""
+        self.username = profile.get("username", self.username)
+        self.first_name = profile.get("first_name", self.first_name)
+        self.last_name = profile.get("last_name", self.last_name)
+
+    def copy(self) -> "UserRecord":
+        """Независимая копия (для транзакций)"""
+        record = UserRecord.__new__(UserRecord)
+        for name in ("user_id", "username", "first_name", "last_name", "xp", "rank",
+                     "messages_count", "reactions_given", "reactions_given_at",
+                     "reactions_received", "quests_completed", "join_date", "last_active"):
+            setattr(record, name, getattr(self, name))
+        record.daily_stats = self.daily_stats.copy()
+        record.moderation = self.moderation.copy()
+        return record
+
+    def hot_values(self) -> tuple:
+        """Горячие поля в порядке HOT_FIELDS"""
+        daily_stats = self.daily_stats
+        return (
+            self.xp, self.rank, self.messages_count, self.moderation.warns, self.last_active,
+            daily_stats.day, daily_stats.messages,
+            *self.reactions_given, *self.reactions_given_at, *self.reactions_received,
+            *daily_stats.reactions_given
+        )
+
+    def set_hot_values(self, values: tuple):
+        """Применяет горячие поля, прочитанные из колонок"""
+        n = len(REACTIONS)
+        self.xp, self.rank, self.messages_count, self.moderation.warns, self.last_active = values[:5]
+        day, messages = values[5:7]
+        self.reactions_given = array('I', values[7:7 + n])
+        self.reactions_given_at = array('q', values[7 + n:7 + 2 * n])
+        self.reactions_received = array('I', values[7 + 2 * n:7 + 3 * n])
+        # Счетчики квестов относятся к своему дню: при другой дате они устарели
+        counters = self.daily_stats.counters if self.daily_stats.day == day else None
+        self.daily_stats = DailyStats(day, messages, array('I', values[7 + 3 * n:7 + 4 * n]), counters)
+
+    def cold_values(self) -> tuple:
+        """Поля, не попавшие в HOT_FIELDS (по ним видно, нужна ли запись в журнал)"""
+        moderation = self.moderation
+        counters = self.daily_stats.counters
+        return (
+            self.username, self.first_name, self.last_name, self.quests_completed,
+            tuple(sorted(counters.items())) if counters else (),
+            moderation.mutes, moderation.bans, moderation.last_warn, self.join_date
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "UserRecord":
+        """Читает запись в формате users.json"""
+        # Вызывается на каждого пользователя при загрузке снимка: поля читаются напрямую,
+        # пустые части узнаются сравнением с _NO_*, без реакций запись получает общие
+        # нулевые массивы
+        record = cls.__new__(cls)
+        get = data.get
+        record.user_id = data["user_id"]
+        record.username = get("username", "")
+        record.first_name = get("first_name", "")
+        record.last_name = get("last_name", "")
+        record.xp = get("xp", 0)
+        record.rank = get("rank", 1)
+        record.messages_count = get("messages_count", 0)
+
+        given = get("reactions_given")
+        if given and given != _NO_REACTIONS_GIVEN:
+            record.reactions_given = array('I', [
+                given.get(reaction, {}).get("count", 0) for reaction in REACTIONS
+            ])
+            record.reactions_given_at = array('q', [
+                _to_epoch(given.get(reaction, {}).get("last_date")) for reaction in REACTIONS
+            ])
+        else:
+            record.reactions_given = _ZERO_COUNTS
+            record.reactions_given_at = _ZERO_EPOCHS
+        record.reactions_received = _counts(get("reactions_received"))
+        quests = get("quests_completed")
+        record.quests_completed = tuple(quests) if quests else ()
+
+        daily_stats = get("daily_stats")
+        record.daily_stats = DailyStats.from_dict(daily_stats) if daily_stats else DailyStats()
+        moderation = get("moderation")
+        if not moderation or moderation == _NO_MODERATION:
+            record.moderation = ModerationStats()
+        else:
+            record.moderation = ModerationStats(
+                moderation.get("warns", 0), moderation.get("mutes", 0),
+                moderation.get("bans", 0), _to_epoch(moderation.get("last_warn"))
+            )
+
+        join_date = get("join_date")
+        last_active = get("last_active")
+        now = 0 if join_date and last_active else int(time.time())
+        record.join_date = _to_epoch(join_date) if join_date else now
+        record.last_active = _to_epoch(last_active) if last_active else now
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Запись в формате users.json"""
+        moderation = self.moderation
+        return {
+            "user_id": self.user_id,
+            "username": self.username,
+            "first_name": self.first_name,
+            "last_name": self.last_name,
+            "xp": self.xp,
+            "rank": self.rank,
+            "messages_count": self.messages_count,
+            "reactions_given": {
+                reaction: {"count": self.reactions_given[i], "last_date": _to_iso(self.reactions_given_at[i])}
+                for i, reaction in enumerate(REACTIONS)
+            },
+            "reactions_received": dict(zip(REACTIONS, self.reactions_received)),
+            "quests_completed": list(self.quests_completed),
+            "daily_stats": self.daily_stats.to_dict(),
+            "moderation": {
+                "warns": moderation.warns,
+                "mutes": moderation.mutes,
+                "bans": moderation.bans,
+                "last_warn": _to_iso(moderation.last_warn)
+            },
+            "join_date": _to_iso(self.join_date),
+            "last_active": _to_iso(self.last_active)
+        }
@@ -1,103 +1,159 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
+from telegram import ChatPermissions
 from config import MODERATION, RANKS
 
-class ModerationSystem:
-    def __init__(self, db, bot):
-        self.db = db
-        self.bot = bot
-        self.sticker_count = {}
+class RateLimiter:
+    """Скользящие окна по именованным правилам с вытеснением неактивных ключей"""
     
-    async def check_sticker_spam(self, user_id: int, chat_id: int) -> bool:
-        """Проверяет спам стикерами"""
-        now = datetime.now()
+    def __init__(self, rules: dict):
+        self.rules = rules
+        # Для каждого правила: ключ -> очередь времен событий,
+        # ключи упорядочены по последнему обращению
+        self._events = {name: OrderedDict() for name in rules}
+    
+    def hit(self, rule: str, key, now: float = None) -> bool:
+        """Учитывает событие; True, если лимит превышен. Амортизированно O(1)"""
+        now = time.monotonic() if now is None else now
+        limit = self.rules[rule]["limit"]
+        window = self.rules[rule]["window"]
+        events = self._events[rule]
         
-        if user_id not in self.sticker_count:
-            self.sticker_count[user_id] = []
+        queue = events.get(key)
+        if queue is None:
+            # Храним не больше limit + 1 отметок — этого достаточно для проверки
+            queue = events[key] = deque(maxlen=limit + 1)
+        else:
+            events.move_to_end(key)
         
-        # Добавляем текущее время
-        self.sticker_count[user_id].append(now)
+        queue.append(now)
+        while now - queue[0] >= window:
+            queue.popleft()
         
-        # Очищаем старые записи (старше 1 минуты)
-        self.sticker_count[user_id] = [
-            time for time in self.sticker_count[user_id]
-            if now - time < timedelta(minutes=1)
-        ]
+        self._evict_idle(events, now, window)
         
-        # Проверяем лимит
-        if len(self.sticker_count[user_id]) > MODERATION["max_stickers_per_minute"]:
-            await self.warn_user(
-                moderator_id=self.bot.id,
-                target_id=user_id,
-                chat_id=chat_id,
-                reason="Спам стикерами"
-            )
+        if len(queue) > limit:
+            # Окно начинается заново, чтобы не наказывать за каждое следующее событие
+            queue.clear()
             return True
-        
         return False
     
+    @staticmethod
+    def _evict_idle(events: OrderedDict, now: float, window: float):
+        """Удаляет ключи, у которых все события вышли за окно"""
+        while events:
+            key, queue = next(iter(events.items()))
+            if queue and now - queue[-1] < window:
+                break
+            del events[key]
+    
+    def size(self, rule: str) -> int:
+        """Число отслеживаемых ключей правила"""
+        return len(self._events[rule])
+
+class ModerationSystem:
+    def __init__(self, db, bot, quests=None, activity=None):
+        self.db = db  # shards.ChatStorage: данные модерации у каждого чата свои
+        self.bot = bot
+        self.quests = quests  # QuestSystem: получает события наказаний
+        self.activity = activity  # ActivityStats: история варнов по дням
+        self.rate_limiter = RateLimiter(MODERATION["rate_limits"])
+    
+    async def check_rate_limit(self, rule: str, user_id: int, chat_id: int) -> bool:
+        """Проверяет лимит частоты и выдает предупреждение при превышении"""
+        if not self.rate_limiter.hit(rule, (chat_id, user_id)):
+            return False
+        
+        await self.warn_user(
+            moderator_id=self.bot.id,
+            target_id=user_id,
+            chat_id=chat_id,
+            reason=MODERATION["rate_limits"][rule]["reason"]
+        )
+        return True
+    
+    async def check_sticker_spam(self, user_id: int, chat_id: int) -> bool:
+        """Проверяет спам стикерами"""
+        return await self.check_rate_limit("stickers", user_id, chat_id)
+    
     async def mute_user(self, moderator_id: int, target_id: int, 
                        chat_id: int, duration: int, reason: str = "") -> dict:
         """Мутит пользователя"""
-        moderator_data = self.db.get_user(moderator_id)
-        target_data = self.db.get_user(target_id)
+        db = await self.db.chat(chat_id)
+        moderator_data = await db.get_user(moderator_id)
         
         # Проверка прав
-        if not self.has_mute_permission(moderator_data["rank"], duration):
+        if not self.has_mute_permission(moderator_data.rank, duration):
             return {"success": False, "message": "Недостаточно прав"}
         
-        try:
-            # Устанавливаем права
-            until_date = datetime.now() + timedelta(seconds=duration)
-            
-            await self.bot.restrict_chat_member(
-                chat_id=chat_id,
-                user_id=target_id,
-                permissions=ChatPermissions(
-                    can_send_messages=False,
-                    can_send_media_messages=False,
-                    can_send_other_messages=False,
-                    can_add_web_page_previews=False
-                ),
-                until_date=until_date
-            )
-            
-            # Логируем действие
-            self.db.add_log(
-                action="mute",
-                moderator_id=moderator_id,
-                target_id=target_id,
-                reason=reason
-            )
-            
-            # Обновляем статистику
-            target_data["moderation"]["mutes"] += 1
-            self.db.save_user(target_id, target_data)
-            
-            return {"success": True, "duration": duration}
-            
-        except Exception as e:
-            return {"success": False, "message": str(e)}
+        async with db.locks.hold(target_id):
+            try:
+                # Устанавливаем права
+                until_date = datetime.now() + timedelta(seconds=duration)
+                
+                await self.bot.restrict_chat_member(
+                    chat_id=chat_id,
+                    user_id=target_id,
+                    permissions=ChatPermissions.no_permissions(),
+                    until_date=until_date
+                )
+                
+                # Логируем действие
+                await db.add_log(
+                    action="mute",
+                    moderator_id=moderator_id,
+                    target_id=target_id,
+                    reason=reason
+                )
+                
+                # Обновляем статистику
+                async with db.transaction(target_id) as users:
+                    users[target_id].moderation.mutes += 1
+                    self._quest_event(chat_id, "mute", None, users[target_id])
+                
+                return {"success": True, "duration": duration}
+                
+            except Exception as e:
+                return {"success": False, "message": str(e)}
     
     async def warn_user(self, moderator_id: int, target_id: int, 
                        chat_id: int, reason: str = "") -> dict:
         """Выдает предупреждение"""
-        moderator_data = self.db.get_user(moderator_id)
-        target_data = self.db.get_user(target_id)
-        
-        # Проверка прав
-        if not self.has_warn_permission(moderator_data["rank"]):
-            return {"success": False, "message": "Недостаточно прав"}
-        
-        # Проверка дневного лимита
-        if self.get_daily_warns(moderator_id) >= 2:
-            return {"success": False, "message": "Достигнут дневной лимит варнов"}
-        
-        # Добавляем варн
-        target_data["moderation"]["warns"] += 1
-        target_data["moderation"]["last_warn"] = datetime.now().isoformat()
+        db = await self.db.chat(chat_id)
+        # Автоматические варны бота не проверяют ранг и дневной лимит,
+        # а запись бота не заводится в таблице участников
+        automatic = self.is_automatic(moderator_id)
+        user_ids = (target_id,) if automatic else (moderator_id, target_id)
+        async with db.locks.hold(*user_ids):
+            async with db.transaction(*user_ids) as users:
+                moderator_data = None if automatic else users[moderator_id]
+                target_data = users[target_id]
+                
+                # Проверка прав
+                if not automatic and not self.has_warn_permission(moderator_data.rank):
+                    users.clear()
+                    return {"success": False, "message": "Недостаточно прав"}
+                
+                # Проверка дневного лимита
+                if not automatic and await self.get_daily_warns(moderator_id, chat_id) >= 2:
+                    users.clear()
+                    return {"success": False, "message": "Достигнут дневной лимит варнов"}
+                
+                # Добавляем варн
+                target_data.moderation.warns += 1
+                target_data.moderation.last_warn = int(time.time())
+                warns = target_data.moderation.warns
+                self._quest_event(chat_id, "warn", moderator_data, target_data)
+            
+            # Варн сохранен и записан в лог до возможного бана
+            await db.add_log("warn", moderator_id, target_id, reason)
+            if self.activity:
+                self.activity.add_warn(target_id, chat_id)
         
         # Проверяем бан
-        if target_data["moderation"]["warns"] >= MODERATION["warns_before_ban"]:
+        if warns >= MODERATION["warns_before_ban"]:
             await self.ban_user(
                 moderator_id=moderator_id,
                 target_id=target_id,
@@ -106,19 +162,18 @@ class ModerationSystem:
                 reason="Слишком много предупреждений"
             )
         
-        self.db.save_user(target_id, target_data)
-        self.db.add_log("warn", moderator_id, target_id, reason)
-        
-        return {"success": True, "warns": target_data["moderation"]["warns"]}
+        return {"success": True, "warns": warns}
     
     async def ban_user(self, moderator_id: int, target_id: int, 
                       chat_id: int, duration: int, reason: str = "") -> dict:
         """Банит пользователя"""
-        moderator_data = self.db.get_user(moderator_id)
+        db = await self.db.chat(chat_id)
         
         # Проверка прав
-        if not self.has_ban_permission(moderator_data["rank"], duration):
-            return {"success": False, "message": "Недостаточно прав"}
+        if not self.is_automatic(moderator_id):
+            moderator_data = await db.get_user(moderator_id)
+            if not self.has_ban_permission(moderator_data.rank, duration):
+                return {"success": False, "message": "Недостаточно прав"}
         
         try:
             until_date = datetime.now() + timedelta(seconds=duration)
@@ -129,13 +184,151 @@ class ModerationSystem:
                 until_date=until_date
             )
             
-            self.db.add_log("ban", moderator_id, target_id, reason)
+            await db.add_log("ban", moderator_id, target_id, reason)
+            
+            async with db.locks.hold(target_id):
+                async with db.transaction(target_id) as users:
+                    users[target_id].moderation.bans += 1
+                    self._quest_event(chat_id, "ban", None, users[target_id])
             
             return {"success": True, "duration": duration}
             
         except Exception as e:
             return {"success": False, "message": str(e)}
     
+    def _quest_event(self, chat_id: int, action: str, moderator_data: dict, target_data: dict):
+        """Передает действие модерации в систему квестов"""
+        if self.quests:
+            self.quests.on_moderation(chat_id, action, moderator_data, target_data)
+    
+    async def _bulk_call(self, target_ids: list, call) -> dict:
+        """Выполняет запрос к Telegram для каждой цели с ограниченным параллелизмом"""
+        semaphore = asyncio.Semaphore(MODERATION["bulk_concurrency"])
+        failed = {}
+        
+        async def run(target_id: int):
+            async with semaphore:
+                try:
+                    await call(target_id)
+                except Exception as e:
+                    failed[target_id] = str(e)
+        
+        await asyncio.gather(*(run(target_id) for target_id in target_ids))
+        succeeded = [target_id for target_id in target_ids if target_id not in failed]
+        return {"succeeded": succeeded, "failed": failed}
+    
+    async def _bulk_commit(self, chat_id: int, action: str, moderator_id: int, target_ids: list,
+                           reason: str = "", counter: str = None):
+        """Одна запись пользователей и одна пачка логов на всю массовую операцию"""
+        if not target_ids:
+            return
+        
+        db = await self.db.chat(chat_id)
+        if counter:
+            async with db.locks.hold(*target_ids):
+                async with db.transaction(*target_ids) as users:
+                    for user_data in users.values():
+                        setattr(user_data.moderation, counter, getattr(user_data.moderation, counter) + 1)
+                        self._quest_event(chat_id, action, None, user_data)
+        
+        await db.add_logs([
+            {"action": action, "moderator_id": moderator_id, "target_id": target_id, "reason": reason}
+            for target_id in target_ids
+        ])
+    
+    async def mass_mute(self, moderator_id: int, target_ids: list,
+                        chat_id: int, duration: int, reason: str = "") -> dict:
+        """Мутит сразу много пользователей (например, при рейде)"""
+        db = await self.db.chat(chat_id)
+        moderator_data = await db.get_user(moderator_id)
+        if not self.has_mute_permission(moderator_data.rank, duration):
+            return {"success": False, "message": "Недостаточно прав"}
+        
+        until_date = datetime.now() + timedelta(seconds=duration)
+        result = await self._bulk_call(target_ids, lambda target_id: self.bot.restrict_chat_member(
+            chat_id=chat_id,
+            user_id=target_id,
+            permissions=ChatPermissions.no_permissions(),
+            until_date=until_date
+        ))
+        await self._bulk_commit(chat_id, "mute", moderator_id, result["succeeded"], reason, counter="mutes")
+        return {"success": True, **result}
+    
+    async def mass_ban(self, moderator_id: int, target_ids: list,
+                       chat_id: int, duration: int, reason: str = "") -> dict:
+        """Банит сразу много пользователей"""
+        db = await self.db.chat(chat_id)
+        moderator_data = await db.get_user(moderator_id)
+        if not self.has_ban_permission(moderator_data.rank, duration):
+            return {"success": False, "message": "Недостаточно прав"}
+        
+        until_date = datetime.now() + timedelta(seconds=duration)
+        result = await self._bulk_call(target_ids, lambda target_id: self.bot.ban_chat_member(
+            chat_id=chat_id,
+            user_id=target_id,
+            until_date=until_date
+        ))
+        await self._bulk_commit(chat_id, "ban", moderator_id, result["succeeded"], reason, counter="bans")
+        return {"success": True, **result}
+    
+    async def mass_unmute(self, moderator_id: int, target_ids: list, chat_id: int) -> dict:
+        """Снимает мут сразу со многих пользователей"""
+        db = await self.db.chat(chat_id)
+        moderator_data = await db.get_user(moderator_id)
+        if not self.has_bulk_permission(moderator_data.rank):
+            return {"success": False, "message": "Недостаточно прав"}
+        
+        result = await self._bulk_call(target_ids, lambda target_id: self.bot.restrict_chat_member(
+            chat_id=chat_id,
+            user_id=target_id,
+            permissions=ChatPermissions.all_permissions()
+        ))
+        await self._bulk_commit(chat_id, "unmute", moderator_id, result["succeeded"])
+        return {"success": True, **result}
+    
+    async def mass_unban(self, moderator_id: int, target_ids: list, chat_id: int) -> dict:
+        """Разбанивает сразу многих пользователей"""
+        db = await self.db.chat(chat_id)
+        moderator_data = await db.get_user(moderator_id)
+        if not self.has_bulk_permission(moderator_data.rank):
+            return {"success": False, "message": "Недостаточно прав"}
+        
+        result = await self._bulk_call(target_ids, lambda target_id: self.bot.unban_chat_member(
+            chat_id=chat_id,
+            user_id=target_id,
+            only_if_banned=True
+        ))
+        await self._bulk_commit(chat_id, "unban", moderator_id, result["succeeded"])
+        return {"success": True, **result}
+    
+    async def amnesty(self, moderator_id: int, chat_id: int, target_ids: list = None) -> dict:
+        """Обнуляет варны у перечисленных пользователей или у всех в чате"""
+        db = await self.db.chat(chat_id)
+        moderator_data = await db.get_user(moderator_id)
+        if not self.has_bulk_permission(moderator_data.rank):
+            return {"success": False, "message": "Недостаточно прав"}
+        
+        if target_ids is None:
+            target_ids = [
+                user.user_id for user in await db.get_all_users()
+                if user.moderation.warns > 0
+            ]
+        
+        pardoned = []
+        if target_ids:
+            async with db.locks.hold(*target_ids):
+                async with db.transaction(*target_ids) as users:
+                    for target_id, user_data in list(users.items()):
+                        if user_data.moderation.warns > 0:
+                            user_data.moderation.warns = 0
+                            pardoned.append(target_id)
+                        else:
+                            # Не переписываем тех, кому нечего прощать
+                            del users[target_id]
+        
+        await self._bulk_commit(chat_id, "amnesty", moderator_id, pardoned)
+        return {"success": True, "pardoned": pardoned}
+    
     def has_mute_permission(self, rank: int, duration: int) -> bool:
         """Проверяет право на мут"""
         if rank <= 3:
@@ -145,15 +338,29 @@ class ModerationSystem:
         else:
             return duration <= MODERATION["mute_durations"]["high"]
     
+    def is_automatic(self, moderator_id: int) -> bool:
+        """Действие выполняет сам бот по правилам частоты"""
+        return moderator_id == self.bot.id
+    
     def has_warn_permission(self, rank: int) -> bool:
         """Проверяет право на варн"""
         return rank >= 4
     
+    def has_bulk_permission(self, rank: int) -> bool:
+        """Проверяет право на массовые действия и амнистию"""
+        return rank >= 8
+    
     def has_ban_permission(self, rank: int, duration: int) -> bool:
         """Проверяет право на бан"""
         return rank >= 8 and duration <= 2592000  # 30 дней
     
-    def get_daily_warns(self, moderator_id: int) -> int:
-        """Получает количество варнов за сегодня"""
-        # Реализуйте логику подсчета варнов за день
-        return 0
+    async def get_daily_warns(self, moderator_id: int, chat_id: int) -> int:
+        """Получает количество варнов за сегодня в чате"""
+        # Читаем только сегмент журнала за текущий день
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        db = await self.db.chat(chat_id)
+        logs = await db.get_logs(since=today)
+        return sum(
+            1 for log in logs
+            if log["action"] == "warn" and log["moderator_id"] == moderator_id
+        )
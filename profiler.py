@@ -0,0 +1,151 @@
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from config import PROFILING
+from metrics import LOOP_BLOCKS
+
+logger = logging.getLogger(__name__)
+
+class ProfileReport:
+    """Итог сессии профилирования: текстовая сводка и дамп для pstats"""
+
+    def __init__(self, profile: cProfile.Profile, duration: float, top: int):
+        self.duration = duration
+        stats = pstats.Stats(profile)
+        # Формат файла pstats — marshal словаря stats (как в Stats.dump_stats)
+        self.dump = marshal.dumps(stats.stats)
+
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.strip_dirs().sort_stats("cumulative").print_stats(top)
+        self.summary = stream.getvalue()
+
+class Profiler:
+    """Профилирование цикла событий по запросу: cProfile на ограниченное время"""
+
+    # cProfile включается в потоке цикла событий и видит все обработчики;
+    # вне сессии профилировщик выключен и ничего не стоит
+
+    def __init__(self):
+        self._profile: Optional[cProfile.Profile] = None
+        self._started = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._on_done: Optional[Callable[[ProfileReport], Awaitable[None]]] = None
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start(self, duration: float, on_done: Callable[[ProfileReport], Awaitable[None]]) -> bool:
+        """Запускает сессию; по истечении duration отчет передается в on_done"""
+        if self.active:
+            return False
+        duration = min(duration, PROFILING["max_duration"])
+        self._on_done = on_done
+        self._started = time.perf_counter()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._timer = asyncio.get_running_loop().call_later(duration, self._finish)
+        logger.info(f"Профилирование запущено на {duration} с")
+        return True
+
+    def stop(self) -> Optional[ProfileReport]:
+        """Останавливает сессию досрочно и возвращает отчет"""
+        if not self.active:
+            return None
+        self._profile.disable()
+        if self._timer:
+            self._timer.cancel()
+        report = ProfileReport(self._profile, time.perf_counter() - self._started, PROFILING["top"])
+        self._profile = None
+        self._timer = None
+        logger.info(f"Профилирование остановлено через {report.duration:.1f} с")
+        return report
+
+    def _finish(self):
+        """Срабатывает по таймеру"""
+        on_done = self._on_done
+        report = self.stop()
+        if report and on_done:
+            asyncio.create_task(self._deliver(on_done, report))
+
+    @staticmethod
+    async def _deliver(on_done, report: ProfileReport):
+        try:
+            await on_done(report)
+        except Exception as e:
+            logger.error(f"Ошибка отправки отчета профилирования: {e}")
+
+class LoopWatchdog:
+    """Обнаруживает обработчики, блокирующие цикл событий дольше порога"""
+
+    # Корутина в цикле отмечается каждые interval секунд. Если отметки нет дольше
+    # порога, фоновый поток снимает стек потока цикла — в нем виден виновник.
+    # Когда цикл оживает, эпизод с длительностью пишется в лог и в метрики
+
+    def __init__(self, threshold: float = None, interval: float = None):
+        self.threshold = threshold or PROFILING["slow_callback"]
+        self.interval = interval or PROFILING["watchdog_interval"]
+        self.episodes = deque(maxlen=20)
+        self._beat = time.monotonic()
+        self._loop_thread_id = None
+        self._captured = None   # (обработчик, стек), снятые во время блокировки
+        self._stopped = threading.Event()
+
+    async def run(self):
+        """Фоновая корутина: отметки цикла и запуск потока-наблюдателя"""
+        self._loop_thread_id = threading.get_ident()
+        thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        thread.start()
+        try:
+            while True:
+                before = time.monotonic()
+                self._beat = before
+                await asyncio.sleep(self.interval)
+                lag = time.monotonic() - before - self.interval
+                if lag > self.threshold:
+                    self._record(lag)
+        finally:
+            self._stopped.set()
+
+    def _record(self, lag: float):
+        handler, stack = self._captured or ("unknown", "")
+        self._captured = None
+        LOOP_BLOCKS.observe(lag, handler)
+        self.episodes.append({
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "duration": lag,
+            "handler": handler,
+            "stack": stack
+        })
+        logger.warning(f"Цикл событий заблокирован на {lag:.3f} с (обработчик: {handler})\n{stack}")
+
+    def _watch(self):
+        """Поток-наблюдатель: снимает стек, пока цикл стоит"""
+        while not self._stopped.wait(self.interval):
+            if self._captured is not None:
+                continue
+            if time.monotonic() - self._beat > self.interval + self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._captured = (self._handler_name(frame), "".join(traceback.format_stack(frame)[-8:]))
+
+    @staticmethod
+    def _handler_name(frame) -> str:
+        """Имя обработчика из обертки metrics.track_handler в стеке"""
+        while frame is not None:
+            if frame.f_code.co_name == "wrapper" and frame.f_globals.get("__name__") == "metrics":
+                return frame.f_locals.get("name", "unknown")
+            frame = frame.f_back
+        return "unknown"
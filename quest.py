@@ -1,14 +1,136 @@
-from datetime import datetime
+from datetime import date
+from typing import Dict, Optional
 from config import QUESTS_BY_RANK
+from models import UserRecord
+from ranks import RankSystem
+
+# Описания квестов по имени
+QUESTS = {
+    quest["name"]: quest
+    for quests in QUESTS_BY_RANK.values()
+    for quest in quests
+}
+
+# Действия модерации, которые считаются наказанием
+PUNISHMENTS = {"warn", "mute", "ban"}
+
+class DailyTop:
+    """Топ-N по дневному счетчику: хранит не больше N участников"""
+    
+    # Счетчики за день только растут, поэтому вытесненный участник может
+    # вернуться лишь со следующим обновлением своего счетчика — и мы его увидим.
+    # Топ живет в памяти: после перезапуска участники возвращаются в него
+    # со своим сохраненным счетчиком при первом же событии
+    
+    def __init__(self, size: int):
+        self.size = size
+        self.day = None
+        self.scores: Dict[int, int] = {}
+    
+    def _roll(self):
+        today = date.today().isoformat()
+        if today != self.day:
+            self.day = today
+            self.scores = {}
+    
+    def update(self, user_id: int, score: int):
+        """Учитывает новое значение счетчика пользователя"""
+        self._roll()
+        if user_id in self.scores or len(self.scores) < self.size:
+            self.scores[user_id] = score
+            return
+        
+        loser = min(self.scores, key=self.scores.get)
+        if score > self.scores[loser]:
+            del self.scores[loser]
+            self.scores[user_id] = score
+    
+    def place(self, user_id: int) -> Optional[int]:
+        """Место пользователя в топе (равные счетчики делят место)"""
+        self._roll()
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return 1 + sum(1 for other in self.scores.values() if other > score)
+
+def daily_counter(user_data: UserRecord, counter: str) -> int:
+    """Значение дневного счетчика квестов"""
+    daily_stats = user_data.roll_daily()
+    # Сообщения за день уже считаются в daily_stats.messages (горячее поле),
+    # отдельный счетчик квестов для них не заводится
+    if counter == "messages":
+        return daily_stats.messages
+    return daily_stats.counters.get(counter, 0) if daily_stats.counters else 0
 
 class QuestSystem:
     def __init__(self, db):
-        self.db = db
+        self.db = db  # shards.ChatStorage: квесты и дневные топы у каждого чата свои
+        
+        # Для каждого счетчика из квестов "top" — один топ нужного размера в каждом чате
+        self._top_places = {}
+        for quest in QUESTS.values():
+            if "top" in quest:
+                self._top_places[quest["top"]] = max(self._top_places.get(quest["top"], 0), quest["places"])
+        self._tops: Dict[int, Dict[str, DailyTop]] = {}
+    
+    def _chat_tops(self, chat_id: int) -> Dict[str, DailyTop]:
+        tops = self._tops.get(chat_id)
+        if tops is None:
+            tops = self._tops[chat_id] = {
+                counter: DailyTop(size) for counter, size in self._top_places.items()
+            }
+        return tops
+    
+    # События вызываются внутри транзакций вызывающего кода и меняют только
+    # переданные записи, поэтому счетчики сохраняются вместе с основным изменением
+    
+    def record(self, chat_id: int, user_data: UserRecord, counter: str, amount: int = 1):
+        """Увеличивает дневной счетчик квестов"""
+        daily_stats = user_data.roll_daily()
+        if daily_stats.counters is None:
+            daily_stats.counters = {}
+        counters = daily_stats.counters
+        counters[counter] = counters.get(counter, 0) + amount
+        
+        top = self._chat_tops(chat_id).get(counter)
+        if top:
+            top.update(user_data.user_id, counters[counter])
+    
+    def on_message(self, chat_id: int, user_data: UserRecord, count: int = 1):
+        """Событие: пользователь написал count сообщений (уже учтенных в daily_stats.messages)"""
+        top = self._chat_tops(chat_id).get("messages")
+        if top:
+            top.update(user_data.user_id, daily_counter(user_data, "messages"))
     
-    def get_available_quests(self, user_id: int) -> list:
+    def on_reaction(self, chat_id: int, from_user: UserRecord, to_user: UserRecord, reaction_type: str):
+        """Событие: реакция от одного пользователя другому"""
+        self.record(chat_id, from_user, f"{reaction_type}_given")
+        self.record(chat_id, to_user, f"{reaction_type}_received")
+    
+    def on_moderation(self, chat_id: int, action: str, moderator_data: Optional[UserRecord],
+                      target_data: Optional[UserRecord]):
+        """Событие: действие модерации"""
+        if moderator_data is not None:
+            self.record(chat_id, moderator_data, f"{action}s_issued")
+        if target_data is not None and action in PUNISHMENTS:
+            self.record(chat_id, target_data, "punishments")
+    
+    def is_quest_done(self, chat_id: int, user_data: UserRecord, quest: dict) -> bool:
+        """Проверяет условие квеста по дневным счетчикам за O(1)"""
+        if "top" in quest:
+            place = self._chat_tops(chat_id)[quest["top"]].place(user_data.user_id)
+            return place is not None and place <= quest["places"]
+        
+        if daily_counter(user_data, quest["counter"]) < quest["target"]:
+            return False
+        if "without" in quest and daily_counter(user_data, quest["without"]) > 0:
+            return False
+        return True
+    
+    async def get_available_quests(self, chat_id: int, user_id: int) -> list:
         """Получает доступные квесты для пользователя"""
-        user_data = self.db.get_user(user_id)
-        rank = user_data["rank"]
+        user_data = await (await self.db.chat(chat_id)).get_user(user_id)
+        rank = user_data.rank
         
         available_quests = []
         
@@ -22,56 +144,49 @@ class QuestSystem:
         
         # Собираем все доступные квесты
         for group in quest_groups:
-            available_quests.extend(QUESTS_BY_RANK[group])
+            available_quests.extend(quest["name"] for quest in QUESTS_BY_RANK[group])
         
         # Убираем уже выполненные
-        completed = user_data.get("quests_completed", [])
+        completed = user_data.quests_completed
         available_quests = [q for q in available_quests if q not in completed]
         
         return available_quests
     
-    def check_quest_completion(self, user_id: int, quest_name: str) -> bool:
+    async def check_quest_completion(self, chat_id: int, user_id: int, quest_name: str) -> bool:
         """Проверяет выполнение квеста"""
-        user_data = self.db.get_user(user_id)
-        
-        # Логика проверки для каждого квеста
-        if quest_name == "Общительный 💬":
-            # ТОП-3 по сообщениям за день
-            # Нужно реализовать получение статистики за день
-            pass
-        
-        elif quest_name == "Оценщик ❤️":
-            # Отправить 3 ❤️ другим
-            return user_data["reactions_given"]["heart"]["count"] >= 3
-        
-        elif quest_name == "Послушатель 😇":
-            # Не получать наказаний за день
-            # Проверяем логи модерации
-            pass
-        
-        # ... остальные квесты
-        
-        return False
+        quest = QUESTS.get(quest_name)
+        if quest is None:
+            return False
+        user_data = await (await self.db.chat(chat_id)).get_user(user_id)
+        return self.is_quest_done(chat_id, user_data, quest)
     
-    def complete_quest(self, user_id: int, quest_name: str) -> dict:
+    async def complete_quest(self, chat_id: int, user_id: int, quest_name: str) -> dict:
         """Завершает квест и награждает пользователя"""
-        if not self.check_quest_completion(user_id, quest_name):
-            return {"success": False, "message": "Квест не выполнен"}
-        
-        user_data = self.db.get_user(user_id)
-        
-        # Награда за квест
-        xp_reward = 50  # Пример награды
-        
-        user_data["xp"] += xp_reward
-        if "quests_completed" not in user_data:
-            user_data["quests_completed"] = []
-        user_data["quests_completed"].append(quest_name)
-        
-        # Проверяем повышение ранга
-        user_data = RankSystem.update_rank(user_data)
-        
-        self.db.save_user(user_id, user_data)
+        quest = QUESTS.get(quest_name)
+        if quest is None:
+            return {"success": False, "message": "Нет такого квеста"}
+        
+        db = await self.db.chat(chat_id)
+        async with db.locks.hold(user_id):
+            async with db.transaction(user_id) as users:
+                user_data = users[user_id]
+                
+                if quest_name in user_data.quests_completed:
+                    users.clear()
+                    return {"success": False, "message": "Квест уже выполнен"}
+                
+                if not self.is_quest_done(chat_id, user_data, quest):
+                    users.clear()
+                    return {"success": False, "message": "Квест не выполнен"}
+                
+                # Награда за квест
+                xp_reward = quest["reward"]
+                
+                user_data.xp += xp_reward
+                user_data.quests_completed += (quest_name,)
+                
+                # Проверяем повышение ранга
+                RankSystem.update_rank(user_data)
         
         return {
             "success": True,
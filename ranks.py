@@ -1,52 +1,61 @@
+from bisect import bisect_right
 from config import RANKS
 
+# Таблицы строятся один раз при импорте: пороги XP по возрастанию
+# и готовые подписи рангов, чтобы не форматировать их на каждый вызов
+_RANK_IDS = sorted(RANKS)
+_THRESHOLDS = [RANKS[rank]["xp_required"] for rank in _RANK_IDS]
+_MAX_RANK = _RANK_IDS[-1]
+_RANK_LABELS = {
+    rank: f"{info['symbols']} {info['name']} {info['emoji']}"
+    for rank, info in RANKS.items()
+}
+
 class RankSystem:
+    @staticmethod
+    def get_rank(xp: int) -> int:
+        """Номер ранга для XP (бинарный поиск по порогам)"""
+        index = bisect_right(_THRESHOLDS, xp) - 1
+        return _RANK_IDS[max(index, 0)]
+
+    @staticmethod
+    def get_rank_label(rank: int) -> str:
+        """Готовая подпись ранга"""
+        return _RANK_LABELS[rank]
+
     @staticmethod
     def get_rank_info(xp: int) -> dict:
         """Получает информацию о ранге на основе XP"""
-        current_rank = 1
-        next_rank = 2
-        
-        for rank, info in RANKS.items():
-            if xp >= info["xp_required"]:
-                current_rank = rank
-                if rank < len(RANKS):
-                    next_rank = rank + 1
-        
+        current_rank = RankSystem.get_rank(xp)
+        next_rank = min(current_rank + 1, _MAX_RANK)
+
         current_info = RANKS[current_rank]
-        next_info = RANKS.get(next_rank, current_info)
-        
+        next_info = RANKS[next_rank]
+
         xp_for_current = xp - current_info["xp_required"]
         xp_for_next = next_info["xp_required"] - current_info["xp_required"]
         progress = (xp_for_current / xp_for_next * 100) if xp_for_next > 0 else 100
-        
+
         return {
             "current_rank": current_rank,
-            "current_name": f"{current_info['symbols']} {current_info['name']} {current_info['emoji']}",
+            "current_name": _RANK_LABELS[current_rank],
             "next_rank": next_rank,
-            "next_name": f"{next_info['symbols']} {next_info['name']} {next_info['emoji']}",
+            "next_name": _RANK_LABELS[next_rank],
             "xp_current": xp,
             "xp_required_current": current_info["xp_required"],
             "xp_required_next": next_info["xp_required"],
             "progress": min(progress, 100),
             "symbols": current_info["symbols"]
         }
-    
+
     @staticmethod
-    def check_rank_up(user_data: dict) -> bool:
+    def check_rank_up(user_data) -> bool:
         """Проверяет, нужно ли повысить ранг"""
-        current_rank = user_data.get("rank", 1)
-        xp = user_data.get("xp", 0)
-        
-        if current_rank < len(RANKS):
-            next_rank_xp = RANKS[current_rank + 1]["xp_required"]
-            if xp >= next_rank_xp:
-                return True
-        return False
-    
+        return RankSystem.get_rank(user_data.xp) > user_data.rank
+
     @staticmethod
-    def update_rank(user_data: dict) -> dict:
-        """Обновляет ранг пользователя"""
+    def update_rank(user_data):
+        """Обновляет ранг пользователя (сразу до нужного, минуя промежуточные)"""
         if RankSystem.check_rank_up(user_data):
-            user_data["rank"] = min(user_data["rank"] + 1, len(RANKS))
+            user_data.rank = RankSystem.get_rank(user_data.xp)
         return user_data
@@ -0,0 +1,33 @@
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from config import RENDER_CACHE
+from metrics import RENDER_CACHE_REQUESTS
+
+class RenderCache:
+    """LRU-кэш готовых текстов; ключ включает версии данных, из которых собран текст"""
+
+    # Текст не инвалидируется явно: изменившиеся данные дают новую версию и новый ключ,
+    # а старые записи вытесняются как давно не запрошенные
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or RENDER_CACHE["max_entries"]
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """Текст по ключу; key[0] — вид текста для метрик"""
+        text = self._entries.get(key)
+        if text is not None:
+            self._entries.move_to_end(key)
+        RENDER_CACHE_REQUESTS.inc(key[0], "hit" if text is not None else "miss")
+        return text
+
+    def put(self, key: Hashable, text: str):
+        """Сохраняет текст, вытесняя самый давний"""
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
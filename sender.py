@@ -0,0 +1,326 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import SENDER
+from metrics import SEND_BACKLOG, SEND_QUEUE_SECONDS, TELEGRAM_ERRORS, TELEGRAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих запросов: чем меньше, тем раньше
+PRIORITY_MODERATION = 0
+PRIORITY_REPLY = 1
+PRIORITY_COSMETIC = 2
+
+# Методы API, которые не должны ждать за косметическими сообщениями
+URGENT_ENDPOINTS = {
+    "banChatMember", "unbanChatMember", "restrictChatMember",
+    "deleteMessage", "answerCallbackQuery"
+}
+
+class MessageDropped(Exception):
+    """Некритичное сообщение отброшено или заменено более новым"""
+
+class SlidingWindow:
+    """Скользящее окно: не больше rate запросов в любом окне длиной period секунд"""
+
+    def __init__(self, rate: int, period: float):
+        # Храним отметки последних rate запросов: следующий можно отправить, когда
+        # самая старая выйдет из окна. В отличие от ведра токенов это дает и полный rate
+        # в установившемся режиме, и отсутствие всплеска на стыке окон
+        self.rate = rate
+        self.period = period
+        self.sent: List[list] = []
+        self.paused_until = 0.0
+        self.pending = 0  # Отправленных запросов без ответа: их отметки еще сдвинутся
+
+    def _oldest(self) -> list:
+        return min(self.sent, key=lambda stamp: stamp[0])
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд можно отправить следующий запрос"""
+        wait = max(self.paused_until - now, 0.0)
+        if len(self.sent) >= self.rate:
+            wait = max(wait, self._oldest()[0] + self.period - now)
+        return wait
+
+    def take(self, now: float) -> list:
+        """Занимает место в окне; отметку можно сдвинуть на время ответа (см. complete)"""
+        if len(self.sent) >= self.rate:
+            self.sent.remove(self._oldest())
+        stamp = [now]
+        self.sent.append(stamp)
+        self.pending += 1
+        return stamp
+
+    def complete(self, stamp: list, now: float):
+        """Переносит отметку запроса на время ответа"""
+        # Telegram считает запрос в момент получения, а он наступает позже отправки.
+        # Время ответа не раньше времени получения, поэтому окно от него не даст
+        # превысить лимит при разбросе сетевых задержек
+        stamp[0] = now
+        self.pending -= 1
+
+    def idle(self, now: float) -> bool:
+        """Окно ничего не помнит: его можно удалить и завести заново без потери лимита"""
+        return (
+            not self.pending and self.paused_until <= now
+            and all(now - stamp[0] >= self.period for stamp in self.sent)
+        )
+
+    def pause(self, now: float, seconds: float):
+        """Останавливает отправку (ответ RetryAfter от Telegram)"""
+        self.paused_until = max(self.paused_until, now + seconds)
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "callback", "args", "kwargs",
+                 "future", "coalesce_key", "retries", "cancelled", "endpoint", "enqueued",
+                 "stamps")
+
+    def __init__(self, priority, seq, chat_id, callback, args, kwargs, coalesce_key, endpoint):
+        self.endpoint = endpoint
+        self.enqueued = time.monotonic()
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.coalesce_key = coalesce_key
+        self.retries = 0
+        self.cancelled = False
+        self.stamps: list = []  # (окно, отметка) в окнах лимитов, занятые отправкой
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class SendScheduler(BaseRateLimiter):
+    """Очередь исходящих запросов с лимитами на чат и глобально и с приоритетами"""
+
+    # Подключается к боту как rate_limiter, поэтому через нее проходят все вызовы API,
+    # включая reply_text и действия модерации. Параметры отдельного запроса передаются
+    # через rate_limit_args={"priority": ..., "coalesce_key": ...}
+
+    def __init__(self):
+        self.max_backlog = SENDER["max_backlog"]
+        self.max_retries = SENDER["max_retries"]
+        self._global = SlidingWindow(SENDER["global_rate"], 1)
+        # Окна чатов в порядке последнего обращения: простаивающие удаляются с начала
+        self._windows: "OrderedDict[Any, SlidingWindow]" = OrderedDict()
+        self._queues: Dict[Any, List[_Job]] = {}
+        self._coalesce: Dict[Any, _Job] = {}
+        self._ready: list = []      # (приоритет, seq, chat_id) — чаты, где можно отправить
+        self._waiting: list = []    # (время, seq, chat_id) — чаты, ждущие своего окна
+        self._seq = itertools.count()
+        self._backlog = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        SEND_BACKLOG.set_function(lambda: self._backlog)
+
+    @property
+    def backlog(self) -> int:
+        """Число запросов в очереди"""
+        return self._backlog
+
+    async def initialize(self) -> None:
+        """Запускает диспетчер"""
+        # Бот инициализирует rate_limiter при каждом своем initialize, в том числе из Updater
+        if self._dispatcher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        """Останавливает диспетчер и отменяет оставшиеся запросы"""
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.set_exception(MessageDropped("Бот остановлен"))
+        self._queues.clear()
+        self._coalesce.clear()
+        self._backlog = 0
+
+    def _window(self, chat_id) -> Optional[SlidingWindow]:
+        """Окно лимита чата: группы и личные чаты ограничены по-разному"""
+        if chat_id is None:
+            return None
+        window = self._windows.get(chat_id)
+        if window is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                window = SlidingWindow(SENDER["private_rate"], SENDER["private_period"])
+            else:
+                window = SlidingWindow(SENDER["group_rate"], SENDER["group_period"])
+            self._windows[chat_id] = window
+        else:
+            self._windows.move_to_end(chat_id)
+        return window
+
+    def _evict_idle(self, now: float):
+        """Удаляет окна чатов без очереди, все отметки которых вышли за период"""
+        windows = self._windows
+        while windows:
+            chat_id, window = next(iter(windows.items()))
+            if chat_id in self._queues or not window.idle(now):
+                break
+            del windows[chat_id]
+
+    def _schedule_chat(self, chat_id, now: float):
+        """Ставит чат в очередь готовых или ожидающих своего окна"""
+        queue = self._queues.get(chat_id)
+        if not queue:
+            return
+        window = self._window(chat_id)
+        delay = window.delay(now) if window else 0.0
+        if delay <= 0:
+            heapq.heappush(self._ready, (queue[0].priority, queue[0].seq, chat_id))
+        else:
+            heapq.heappush(self._waiting, (now + delay, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    def _enqueue(self, job: _Job):
+        heapq.heappush(self._queues.setdefault(job.chat_id, []), job)
+        self._backlog += 1
+        self._schedule_chat(job.chat_id, time.monotonic())
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        """Ставит запрос в очередь и ждет его выполнения"""
+        rate_limit_args = rate_limit_args or {}
+        priority = rate_limit_args.get(
+            "priority",
+            PRIORITY_MODERATION if endpoint in URGENT_ENDPOINTS else PRIORITY_REPLY
+        )
+        # Лимит на чат касается только сообщений; баны и ограничения
+        # идут в общую очередь без ведра чата и не ждут за ответами
+        chat_id = data.get("chat_id") if endpoint.startswith(("send", "copy", "forward")) else None
+
+        # Под нагрузкой некритичные сообщения не копятся, а отбрасываются
+        if priority >= PRIORITY_COSMETIC and self._backlog >= self.max_backlog:
+            raise MessageDropped("Очередь отправки переполнена")
+
+        job = _Job(priority, next(self._seq), chat_id, callback, args, kwargs,
+                   rate_limit_args.get("coalesce_key"), endpoint)
+
+        # Одинаковые некритичные сообщения в чате склеиваются: остается последнее
+        if job.coalesce_key is not None:
+            key = (chat_id, job.coalesce_key)
+            previous = self._coalesce.get(key)
+            if previous and not previous.future.done():
+                previous.cancelled = True
+                previous.future.set_exception(MessageDropped("Заменено более новым сообщением"))
+            self._coalesce[key] = job
+
+        self._enqueue(job)
+        return await job.future
+
+    async def _dispatch(self):
+        """Выдает запросы с учетом лимитов и приоритетов"""
+        while True:
+            now = time.monotonic()
+            self._evict_idle(now)
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._waiting)
+                self._schedule_chat(chat_id, now)
+
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            queue = self._queues.get(chat_id)
+            # Записи в _ready — подсказки: чат мог опустеть или исчерпать лимит
+            while queue and queue[0].cancelled:
+                heapq.heappop(queue)
+                self._backlog -= 1
+            if not queue:
+                self._queues.pop(chat_id, None)
+                continue
+            window = self._window(chat_id)
+            if window and window.delay(now) > 0:
+                self._schedule_chat(chat_id, now)
+                continue
+
+            job = heapq.heappop(queue)
+            self._backlog -= 1
+            job.stamps = [(self._global, self._global.take(now))]
+            if window:
+                job.stamps.append((window, window.take(now)))
+            if not queue:
+                self._queues.pop(chat_id, None)
+            else:
+                self._schedule_chat(chat_id, now)
+
+            asyncio.create_task(self._execute(job))
+
+    @staticmethod
+    def _complete(job: _Job):
+        now = time.monotonic()
+        for window, stamp in job.stamps:
+            window.complete(stamp, now)
+
+    async def _execute(self, job: _Job):
+        """Выполняет запрос; при RetryAfter ставит его обратно"""
+        if job.coalesce_key is not None and self._coalesce.get((job.chat_id, job.coalesce_key)) is job:
+            del self._coalesce[(job.chat_id, job.coalesce_key)]
+
+        started = time.monotonic()
+        SEND_QUEUE_SECONDS.observe(started - job.enqueued, job.priority)
+        try:
+            result = await job.callback(*job.args, **job.kwargs)
+        except RetryAfter as exc:
+            self._complete(job)
+            TELEGRAM_ERRORS.inc(job.endpoint, "RetryAfter")
+            now = time.monotonic()
+            window = self._window(job.chat_id) or self._global
+            window.pause(now, exc.retry_after + 0.1)
+            if job.retries >= self.max_retries:
+                logger.error(f"Лимит Telegram: запрос в чат {job.chat_id} отброшен после {job.retries} повторов")
+                job.future.set_exception(exc)
+                return
+            logger.info(f"Лимит Telegram в чате {job.chat_id}: пауза {exc.retry_after} с")
+            job.retries += 1
+            job.enqueued = now
+            self._enqueue(job)
+        except Exception as exc:
+            self._complete(job)
+            TELEGRAM_ERRORS.inc(job.endpoint, type(exc).__name__)
+            if not job.future.done():
+                job.future.set_exception(exc)
+        else:
+            self._complete(job)
+            TELEGRAM_SECONDS.observe(time.monotonic() - started, job.endpoint)
+            if not job.future.done():
+                job.future.set_result(result)
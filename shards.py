@@ -0,0 +1,216 @@
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from config import STORAGE
+from database import AsyncDatabase, create_database
+from metrics import STORAGE_SHARDS
+from models import UserRecord
+
+logger = logging.getLogger(__name__)
+
+def shard_path(data_dir: str, chat_id: int) -> str:
+    """Каталог данных чата"""
+    return os.path.join(data_dir, "chats", str(chat_id))
+
+def has_legacy(data_dir: str) -> bool:
+    """Есть ли общее хранилище прежних версий"""
+    if STORAGE["backend"] == "sqlite":
+        return os.path.exists(os.path.join(data_dir, STORAGE["sqlite_file"]))
+    return os.path.exists(os.path.join(data_dir, "users.json"))
+
+def prepare_legacy(data_dir: str = "data"):
+    """Приводит общее хранилище прежних версий в состояние, которое можно только читать"""
+    # Открытие дописывает миграции, применяет журнал и пересобирает колонки. Сделанное
+    # однажды до запуска рабочих процессов, после этого оно только читается ими одновременно
+    if has_legacy(data_dir):
+        create_database(data_dir, background=False).close()
+
+class ChatStorage:
+    """Хранилище, разделенное по чатам: у каждого чата свои пользователи, логи и рейтинг"""
+
+    # Хранилище чата открывается при первом обращении и закрывается после
+    # STORAGE["shard_idle"] секунд простоя, если никто не держит его блокировки.
+    # Открытых хранилищ не больше STORAGE["max_open_shards"]: перед открытием нового
+    # закрывается давно не использованное, иначе кончатся файловые дескрипторы.
+    # Все чаты делят один пул потоков и одну фоновую задачу сброса на диск,
+    # поэтому число открытых чатов не умножает потоки.
+    # Данные из общего хранилища прежних версий (users.json в корне data/) не переносятся
+    # целиком: пользователь копируется в чат при первом обращении к нему в этом чате
+
+    def __init__(self, data_dir: str = "data", partitioned: Optional[bool] = None):
+        self.data_dir = data_dir
+        self.partitioned = STORAGE["partition_by_chat"] if partitioned is None else partitioned
+        self.idle_timeout = STORAGE["shard_idle"]
+        self.max_open = STORAGE["max_open_shards"]
+        self._executor = ThreadPoolExecutor(
+            max_workers=STORAGE["io_workers"], thread_name_prefix="db-io"
+        )
+        self._shards: Dict[int, AsyncDatabase] = {}
+        self._last_used: Dict[int, float] = {}
+        self._opening: Dict[int, asyncio.Future] = {}
+        self._closing: Dict[int, asyncio.Future] = {}
+        self._generations = itertools.count(1)
+        self._pins: Dict[int, int] = {}
+        self._legacy = None
+        self._legacy_lock = threading.Lock()
+        self._stopped = asyncio.Event()
+        STORAGE_SHARDS.set_function(lambda: len(self._shards))
+
+        # Без разделения все чаты работают с одним хранилищем, как раньше
+        self._global: Optional[AsyncDatabase] = None
+        if not self.partitioned:
+            self._global = AsyncDatabase(create_database(data_dir), executor=self._executor)
+
+    async def chat(self, chat_id: int) -> AsyncDatabase:
+        """Хранилище чата (открывается при первом обращении)"""
+        if self._global is not None:
+            return self._global
+
+        self._last_used[chat_id] = time.monotonic()
+        shard = self._shards.get(chat_id)
+        if shard is not None:
+            return shard
+
+        opening = self._opening.get(chat_id)
+        if opening is not None:
+            return await asyncio.shield(opening)
+
+        opening = self._opening[chat_id] = asyncio.get_running_loop().create_future()
+        try:
+            # Закрытие того же чата должно завершиться до повторного открытия его файлов
+            closing = self._closing.get(chat_id)
+            if closing is not None:
+                await closing
+            await self._evict_lru()
+            loop = asyncio.get_running_loop()
+            db = await loop.run_in_executor(self._executor, self._open, chat_id)
+            shard = AsyncDatabase(db, executor=self._executor, generation=next(self._generations))
+            self._shards[chat_id] = shard
+            opening.set_result(shard)
+            return shard
+        except BaseException as e:
+            opening.set_exception(e)
+            # Ошибку увидят ожидающие; если их нет, future не должна ругаться в лог
+            opening.exception()
+            raise
+        finally:
+            del self._opening[chat_id]
+
+    def _open(self, chat_id: int):
+        """Открывает хранилище чата (в пуле потоков)"""
+        db = create_database(shard_path(self.data_dir, chat_id), background=False)
+        db.seed_user = self._seed_user
+        logger.info(f"Открыто хранилище чата {chat_id}")
+        return db
+
+    def _seed_user(self, user_id: int) -> Optional[UserRecord]:
+        """Запись пользователя из общего хранилища прежних версий, если она там есть"""
+        with self._legacy_lock:
+            if self._legacy is None:
+                if not has_legacy(self.data_dir):
+                    self._legacy = False
+                    return None
+                self._legacy = create_database(self.data_dir, background=False)
+            if self._legacy is False:
+                return None
+            user_data = self._legacy.find_user(user_id)
+        return user_data.copy() if user_data is not None else None
+
+    @asynccontextmanager
+    async def pin(self, chat_id: int):
+        """Не дает закрыть хранилище чата, пока выполняется блок (например, обработка апдейта)"""
+        # Обработчик держит ссылку на хранилище и между обращениями, без блокировок:
+        # закрытое в этот момент хранилище отвергло бы его запись
+        self._pins[chat_id] = self._pins.get(chat_id, 0) + 1
+        try:
+            yield
+        finally:
+            if self._pins[chat_id] == 1:
+                del self._pins[chat_id]
+            else:
+                self._pins[chat_id] -= 1
+
+    def _in_use(self, chat_id: int, shard: AsyncDatabase) -> bool:
+        """Хранилище нельзя закрыть: оно закреплено или держит блокировки незавершенной операции"""
+        return chat_id in self._pins or bool(len(shard.locks))
+
+    async def _unload(self, chat_id: int, shard: AsyncDatabase):
+        """Закрывает хранилище чата; повторное открытие дождется закрытия"""
+        del self._shards[chat_id]
+        self._last_used.pop(chat_id, None)
+        closing = self._closing[chat_id] = asyncio.ensure_future(shard.close())
+        try:
+            await closing
+        finally:
+            del self._closing[chat_id]
+
+    async def _unload_idle(self):
+        """Закрывает хранилища чатов, простаивающие дольше idle_timeout"""
+        now = time.monotonic()
+        for chat_id, shard in list(self._shards.items()):
+            if now - self._last_used.get(chat_id, now) < self.idle_timeout or self._in_use(chat_id, shard):
+                continue
+            await self._unload(chat_id, shard)
+            logger.info(f"Хранилище чата {chat_id} выгружено после простоя")
+
+    async def _evict_lru(self):
+        """Освобождает место под новое хранилище, закрывая давно не использованные"""
+        while len(self._shards) >= self.max_open:
+            candidates = [
+                chat_id for chat_id, shard in self._shards.items()
+                if not self._in_use(chat_id, shard)
+            ]
+            if not candidates:
+                # Все открытые заняты: лучше превысить предел, чем ждать
+                logger.warning(f"Все {len(self._shards)} открытых хранилищ чатов заняты, предел превышен")
+                return
+            chat_id = min(candidates, key=lambda key: self._last_used.get(key, 0.0))
+            await self._unload(chat_id, self._shards[chat_id])
+            logger.info(f"Хранилище чата {chat_id} выгружено: открыто {self.max_open} хранилищ")
+
+    async def flush(self):
+        """Сбрасывает изменения всех открытых чатов на диск"""
+        if self._global is not None:
+            await self._global.flush()
+        for shard in list(self._shards.values()):
+            await shard.flush()
+
+    async def run(self):
+        """Фоновый цикл: сброс на диск раз в STORAGE["flush_interval"] и выгрузка простаивающих"""
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=STORAGE["flush_interval"])
+            except asyncio.TimeoutError:
+                pass
+            if self._global is not None:
+                # Общее хранилище сбрасывается собственным потоком
+                continue
+            try:
+                await self.flush()
+                await self._unload_idle()
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания хранилищ чатов: {e}")
+
+    def stop(self):
+        """Останавливает фоновый цикл"""
+        self._stopped.set()
+
+    async def close(self):
+        """Закрывает все хранилища и пул потоков"""
+        self.stop()
+        shards = list(self._shards.values())
+        self._shards.clear()
+        if self._global is not None:
+            shards.append(self._global)
+        for shard in shards:
+            await shard.close()
+        if self._legacy:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._legacy.close)
+        self._executor.shutdown(wait=True)
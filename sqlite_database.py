@@ -0,0 +1,246 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import RENDER_CACHE, STORAGE
+from database import Database, default_user
+from locks import KeyedLocks
+from metrics import STORAGE_READ_BYTES, STORAGE_WRITTEN_BYTES
+from models import UserRecord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    xp INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_xp ON users (xp DESC);
+
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    action TEXT NOT NULL,
+    moderator_id INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
+    reason TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_logs_moderator ON logs (moderator_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_logs_target ON logs (target_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class SQLiteDatabase:
+    """Хранилище на SQLite с тем же API, что и Database"""
+
+    def __init__(self, data_dir: str = "data"):
+        self.data_dir = data_dir
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.db_file = os.path.join(self.data_dir, STORAGE["sqlite_file"])
+
+        self._lock = threading.RLock()
+        self.locks = KeyedLocks()
+        # Версии для кэша отрисовки. Рейтинга в памяти нет, поэтому версия топа
+        # растет при сохранении участника последнего прочитанного топа
+        # или пользователя, набравшего не меньше XP, чем последнее место в нем
+        self.user_versions: Dict[int, int] = {}
+        # Начальные данные нового пользователя (например, из общего хранилища)
+        self.seed_user = None
+        self.top_version = 0
+        self._top_ids = frozenset()
+        self._top_floor = 0
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        try:
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._migrate_from_json()
+        except BaseException:
+            self._conn.close()
+            raise
+
+    def _migrate_from_json(self):
+        """Однократно переносит данные из JSON-хранилища (users.json и журнал модерации)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'migrated_from_json'"
+            ).fetchone()
+            if row:
+                return
+
+            users = []
+            logs = []
+            if os.path.exists(os.path.join(self.data_dir, "users.json")):
+                # Открываем JSON-хранилище, чтобы учесть журналы пользователей и модерации.
+                # Оно нужно только на время чтения: без фонового потока сброса и atexit
+                legacy = Database(self.data_dir, background=False)
+                try:
+                    users = list(legacy.iter_users())
+                    logs = list(legacy.iter_logs())
+                finally:
+                    legacy.close()
+
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO users (user_id, xp, data) VALUES (?, ?, ?)",
+                    [
+                        (user.user_id, user.xp, json.dumps(user.to_dict(), ensure_ascii=False))
+                        for user in users
+                    ]
+                )
+                self._conn.executemany(
+                    "INSERT INTO logs (id, action, moderator_id, target_id, reason, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (log["id"], log["action"], log["moderator_id"], log["target_id"],
+                         log.get("reason", ""), log["timestamp"])
+                        for log in logs
+                    ]
+                )
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                    (datetime.now().isoformat(),)
+                )
+
+    def find_user(self, user_id: int) -> Optional[UserRecord]:
+        """Получает пользователя, не создавая нового"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        STORAGE_READ_BYTES.inc("sqlite", amount=len(row["data"].encode('utf-8')))
+        user_data = UserRecord.from_dict(json.loads(row["data"]))
+        user_data.roll_daily()
+        return user_data
+
+    def get_user(self, user_id: int) -> UserRecord:
+        """Получает данные пользователя"""
+        user_data = self.find_user(user_id)
+        if user_data is None:
+            user_data = (self.seed_user and self.seed_user(user_id)) or default_user(user_id)
+            self.save_user(user_id, user_data)
+        return user_data
+
+    def save_user(self, user_id: int, user_data: UserRecord):
+        """Сохраняет данные пользователя"""
+        self.save_users({user_id: user_data})
+
+    def save_users(self, users: Dict[int, UserRecord]):
+        """Сохраняет несколько пользователей одной транзакцией"""
+        rows = [
+            (user_id, user_data.xp, json.dumps(user_data.to_dict(), ensure_ascii=False))
+            for user_id, user_data in users.items()
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, xp, data) VALUES (?, ?, ?)", rows
+            )
+            for user_id, user_data in users.items():
+                self.user_versions[user_id] = self.user_versions.get(user_id, 0) + 1
+                if user_id in self._top_ids or user_data.xp >= self._top_floor:
+                    self.top_version += 1
+        STORAGE_WRITTEN_BYTES.inc("sqlite", amount=sum(len(row[2].encode('utf-8')) for row in rows))
+
+    @contextmanager
+    def transaction(self, *user_ids: int):
+        """Загружает пользователей один раз и сохраняет их одной транзакцией"""
+        with self._lock:
+            users = {user_id: self.get_user(user_id) for user_id in user_ids}
+            yield users
+            # Пустой словарь означает «ничего не сохранять»
+            if users:
+                self.save_users(users)
+
+    def iter_users(self):
+        """Перебирает всех пользователей"""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM users").fetchall()
+        return (UserRecord.from_dict(json.loads(row["data"])) for row in rows)
+
+    def add_log(self, action: str, moderator_id: int, target_id: int, reason: str = "") -> int:
+        """Добавляет лог модерации"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO logs (action, moderator_id, target_id, reason, timestamp) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (action, moderator_id, target_id, reason, datetime.now().isoformat())
+            )
+            return cursor.lastrowid
+
+    def add_logs(self, entries: list) -> list:
+        """Добавляет пачку логов модерации одной транзакцией"""
+        timestamp = datetime.now().isoformat()
+        with self._lock, self._conn:
+            ids = []
+            for entry in entries:
+                cursor = self._conn.execute(
+                    "INSERT INTO logs (action, moderator_id, target_id, reason, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (entry["action"], entry["moderator_id"], entry["target_id"],
+                     entry.get("reason", ""), timestamp)
+                )
+                ids.append(cursor.lastrowid)
+            return ids
+
+    def iter_logs(self, since: Optional[datetime] = None, until: Optional[datetime] = None):
+        """Читает логи модерации за интервал"""
+        query = "SELECT * FROM logs WHERE timestamp >= ? AND timestamp <= ? ORDER BY timestamp"
+        with self._lock:
+            rows = self._conn.execute(query, (
+                since.isoformat() if since else "",
+                until.isoformat() if until else "9999"
+            )).fetchall()
+        return (dict(row) for row in rows)
+
+    def get_top_users(self, limit: int = 10) -> list:
+        """Получает топ пользователей по XP (проход по индексу idx_users_xp)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM users ORDER BY xp DESC, user_id LIMIT ?", (limit,)
+            ).fetchall()
+            users = [UserRecord.from_dict(json.loads(row["data"])) for row in rows]
+            if limit >= RENDER_CACHE["top_size"]:
+                window = users[:RENDER_CACHE["top_size"]]
+                self._top_ids = frozenset(user.user_id for user in window)
+                self._top_floor = window[-1].xp if len(window) == RENDER_CACHE["top_size"] else 0
+        return users
+
+    def get_user_position(self, user_id: int) -> Optional[int]:
+        """Место пользователя в топе по XP (подсчет по индексу idx_users_xp)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT xp FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            ahead = self._conn.execute(
+                "SELECT COUNT(*) FROM users WHERE xp > ? OR (xp = ? AND user_id < ?)",
+                (row["xp"], row["xp"], user_id)
+            ).fetchone()[0]
+        return ahead + 1
+
+    def reset_daily_stats(self):
+        """Сбрасывает ежедневную статистику"""
+        # daily_stats обнуляются лениво в get_user (см. UserRecord.roll_daily)
+        pass
+
+    def flush(self):
+        """Совместимость с Database: SQLite пишет сразу"""
+
+    def close(self):
+        """Закрывает соединение"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,89 @@
+import os
+import sys
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import REACTION_INDEX, UserRecord
+
+class DailyStatsTest(unittest.TestCase):
+    """Ленивый сброс дневной статистики при чтении записи"""
+
+    def make_record(self, daily_stats: dict) -> dict:
+        record = UserRecord(1).to_dict()
+        record["daily_stats"] = daily_stats
+        return record
+
+    def assert_reset(self, user_data: UserRecord):
+        daily = user_data.roll_daily()
+        self.assertEqual(daily.day, date.today().toordinal())
+        self.assertEqual(daily.messages, 0)
+        self.assertEqual(list(daily.reactions_given), [0, 0, 0])
+        self.assertIsNone(daily.counters)
+
+    def test_missing_date_resets(self):
+        user_data = UserRecord.from_dict(self.make_record({
+            "messages": 7,
+            "reactions_given": {"heart": 3},
+            "counters": {"messages": 7}
+        }))
+        self.assert_reset(user_data)
+
+    def test_stale_date_resets(self):
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        user_data = UserRecord.from_dict(self.make_record({
+            "date": yesterday, "messages": 7, "reactions_given": {"heart": 3}
+        }))
+        self.assert_reset(user_data)
+
+    def test_today_is_kept(self):
+        user_data = UserRecord.from_dict(self.make_record({
+            "date": date.today().isoformat(), "messages": 7, "reactions_given": {"heart": 3}
+        }))
+        daily = user_data.roll_daily()
+        self.assertEqual(daily.messages, 7)
+        self.assertEqual(daily.reactions_given[REACTION_INDEX["heart"]], 3)
+
+    def test_dateless_round_trip(self):
+        user_data = UserRecord.from_dict(self.make_record({"messages": 7}))
+        again = UserRecord.from_dict(user_data.to_dict())
+        self.assertEqual(again.daily_stats.day, 0)
+        self.assert_reset(again)
+
+class ReactionsTest(unittest.TestCase):
+    """Записи без реакций делят нулевые массивы, изменение их не затрагивает"""
+
+    def test_shared_zeros_are_not_modified(self):
+        first = UserRecord.from_dict(UserRecord(1).to_dict())
+        second = UserRecord.from_dict(UserRecord(2).to_dict())
+        index = REACTION_INDEX["heart"]
+        first.give_reaction(index, 1700000000)
+        second.receive_reaction(index)
+        self.assertEqual(list(first.reactions_given), [1, 0, 0])
+        self.assertEqual(first.reactions_given_at[index], 1700000000)
+        self.assertEqual(list(first.daily_stats.reactions_given), [1, 0, 0])
+        self.assertEqual(list(first.reactions_received), [0, 0, 0])
+        self.assertEqual(list(second.reactions_received), [1, 0, 0])
+        self.assertEqual(list(second.reactions_given), [0, 0, 0])
+        self.assertEqual(list(UserRecord(3).reactions_given), [0, 0, 0])
+
+    def test_copy_is_independent(self):
+        user_data = UserRecord(1)
+        user_data.give_reaction(REACTION_INDEX["nerd"], 1700000000)
+        copy = user_data.copy()
+        copy.give_reaction(REACTION_INDEX["nerd"], 1700000001)
+        self.assertEqual(list(user_data.reactions_given), [0, 0, 1])
+        self.assertEqual(list(copy.reactions_given), [0, 0, 2])
+
+    def test_round_trip(self):
+        user_data = UserRecord(1)
+        user_data.give_reaction(REACTION_INDEX["thumbs_up"], 1700000000)
+        user_data.receive_reaction(REACTION_INDEX["heart"])
+        user_data.moderation.warns = 2
+        again = UserRecord.from_dict(user_data.to_dict())
+        self.assertEqual(again.to_dict(), user_data.to_dict())
+        self.assertEqual(again.hot_values(), user_data.hot_values())
+
+if __name__ == '__main__':
+    unittest.main()
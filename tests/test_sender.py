@@ -0,0 +1,49 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SENDER
+from sender import SendScheduler
+
+async def ok():
+    return True
+
+class SendSchedulerWindowsTest(unittest.IsolatedAsyncioTestCase):
+    """Окна лимитов чатов не копятся: простаивающие удаляются диспетчером"""
+
+    async def asyncSetUp(self):
+        self.scheduler = SendScheduler()
+        await self.scheduler.initialize()
+
+    async def asyncTearDown(self):
+        await self.scheduler.shutdown()
+
+    def send(self, chat_id: int, callback=ok):
+        return self.scheduler.process_request(
+            callback, (), {}, "sendMessage", {"chat_id": chat_id}, None
+        )
+
+    async def test_idle_windows_are_evicted(self):
+        await asyncio.gather(*(self.send(chat_id) for chat_id in range(1, 21)))
+        self.assertEqual(len(self.scheduler._windows), 20)
+
+        await asyncio.sleep(SENDER["private_period"] + 0.1)
+        await self.send(1000)
+        self.assertEqual(list(self.scheduler._windows), [1000])
+
+    async def test_window_with_request_in_flight_is_kept(self):
+        async def slow():
+            await asyncio.sleep(SENDER["private_period"] + 0.5)
+            return True
+
+        request = asyncio.ensure_future(self.send(1, slow))
+        await asyncio.sleep(SENDER["private_period"] + 0.1)
+        await self.send(2)
+        self.assertIn(1, self.scheduler._windows)
+        await request
+
+if __name__ == '__main__':
+    unittest.main()
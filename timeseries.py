@@ -0,0 +1,349 @@
+import asyncio
+import json
+import os
+import struct
+import threading
+from array import array
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import ACTIVITY
+
+# Дневные счетчики активности
+FIELDS = ("messages", "reactions_given", "reactions_received", "warns")
+
+# Формат хранения: записи фиксированной ширины, отсортированные по id,
+# поэтому значение одного пользователя ищется бинарным поиском по файлу.
+# У пользователей дни и недели хранят счетчики в uint16 (с насыщением),
+# у чатов и в месячных сводках — uint32
+_HEADER = 10  # Дата последнего учтенного дня в файлах сводок (идемпотентность)
+
+def _iso_week(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def _week_start(name: str) -> date:
+    year, week = name.split("-W")
+    return date.fromisocalendar(int(year), int(week), 1)
+
+class TimeSeries:
+    """Ряд дневных счетчиков по сущностям (пользователям или чатам) с недельными и месячными сводками"""
+
+    # Текущий день живет в памяти: индекс id -> строка и плоский массив счетчиков.
+    # Закрытый день сворачивается в сводки недели и месяца, старые файлы удаляются
+    # согласно ACTIVITY["retention_*"]
+
+    RESOLUTIONS = ("day", "week", "month")
+
+    def __init__(self, path: str, fields: tuple = FIELDS, wide: bool = False):
+        self.path = path
+        self.fields = fields
+        self._field_index = {field: i for i, field in enumerate(fields)}
+        counter = "I" if wide else "H"
+        self._formats = {
+            "day": struct.Struct("<q" + counter * len(fields)),
+            "week": struct.Struct("<q" + counter * len(fields)),
+            "month": struct.Struct("<q" + "I" * len(fields))
+        }
+        for resolution in self.RESOLUTIONS:
+            os.makedirs(os.path.join(self.path, resolution), exist_ok=True)
+        self.meta_file = os.path.join(self.path, "meta.json")
+
+        self._lock = threading.Lock()
+        self._day = date.today()
+        self._index: Dict[int, int] = {}
+        self._values = array('I')
+        # Закрытые дни, еще не записанные на диск: ключ дня -> (индекс, счетчики)
+        self._closed: Dict[str, Tuple[Dict[int, int], array]] = {}
+        for entity_id, values in self._read_all("day", self._day.isoformat()).items():
+            self._row(entity_id)
+            self._values[-len(fields):] = array('I', values)
+
+        self._seal_needed = False
+        self._seal_pending()
+
+    # ---------- файлы ----------
+
+    def _file(self, resolution: str, key: str) -> str:
+        return os.path.join(self.path, resolution, key + ".bin")
+
+    def _keys(self, resolution: str) -> List[str]:
+        """Отсортированные ключи периодов, за которые есть файлы"""
+        return sorted(
+            name[:-4] for name in os.listdir(os.path.join(self.path, resolution))
+            if name.endswith(".bin")
+        )
+
+    def _offset(self, resolution: str) -> int:
+        return 0 if resolution == "day" else _HEADER
+
+    def _read_all(self, resolution: str, key: str) -> Dict[int, tuple]:
+        """Читает файл периода целиком"""
+        path = self._file(resolution, key)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'rb') as f:
+            data = f.read()[self._offset(resolution):]
+        record = self._formats[resolution]
+        return {values[0]: values[1:] for values in record.iter_unpack(data)}
+
+    def _read_header(self, resolution: str, key: str) -> str:
+        path = self._file(resolution, key)
+        if not os.path.exists(path):
+            return ""
+        with open(path, 'rb') as f:
+            return f.read(_HEADER).decode("ascii")
+
+    def _write(self, resolution: str, key: str, records: Dict[int, tuple], header: str = ""):
+        """Атомарно записывает файл периода, отсортированный по id"""
+        record = self._formats[resolution]
+        limit = 0xFFFF if record.format.endswith("H") else 0xFFFFFFFF
+        chunks = [header.encode("ascii")] if resolution != "day" else []
+        for entity_id in sorted(records):
+            values = [min(value, limit) for value in records[entity_id]]
+            chunks.append(record.pack(entity_id, *values))
+
+        path = self._file(resolution, key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b"".join(chunks))
+        os.replace(tmp_path, path)
+
+    def _lookup(self, resolution: str, key: str, entity_id: int) -> Optional[tuple]:
+        """Бинарный поиск записи сущности в файле периода"""
+        path = self._file(resolution, key)
+        if not os.path.exists(path):
+            return None
+        record = self._formats[resolution]
+        offset = self._offset(resolution)
+        with open(path, 'rb') as f:
+            low = 0
+            high = (os.path.getsize(path) - offset) // record.size
+            while low < high:
+                middle = (low + high) // 2
+                f.seek(offset + middle * record.size)
+                values = record.unpack(f.read(record.size))
+                if values[0] < entity_id:
+                    low = middle + 1
+                elif values[0] > entity_id:
+                    high = middle
+                else:
+                    return values[1:]
+        return None
+
+    # ---------- текущий день ----------
+
+    def _row(self, entity_id: int) -> int:
+        row = self._index.get(entity_id)
+        if row is None:
+            row = self._index[entity_id] = len(self._index)
+            self._values.extend([0] * len(self.fields))
+        return row
+
+    def add(self, entity_id: int, field: str, amount: int = 1):
+        """Увеличивает счетчик сущности за сегодня (в памяти, O(1))"""
+        with self._lock:
+            today = date.today()
+            if today != self._day:
+                self._rotate(today)
+            row = self._row(entity_id)
+            self._values[row * len(self.fields) + self._field_index[field]] += amount
+
+    def _records(self, index: Dict[int, int], values: array) -> Dict[int, tuple]:
+        width = len(self.fields)
+        return {
+            entity_id: tuple(values[row * width:(row + 1) * width])
+            for entity_id, row in index.items()
+        }
+
+    def _snapshot(self) -> Dict[int, tuple]:
+        return self._records(self._index, self._values)
+
+    def flush(self):
+        """Записывает счетчики текущего дня на диск и сворачивает закрытые дни"""
+        with self._lock:
+            closed = dict(self._closed)
+        # Закрытые дни пишутся до свертки: она читает их файлы
+        for key, (index, values) in closed.items():
+            self._write("day", key, self._records(index, values))
+        with self._lock:
+            for key in closed:
+                del self._closed[key]
+            day, records = self._day, self._snapshot()
+            seal_needed, self._seal_needed = self._seal_needed, False
+        if records:
+            self._write("day", day.isoformat(), records)
+        if seal_needed:
+            self._seal_pending()
+
+    def _rotate(self, today: date):
+        """Закрывает прошедший день (вызывается под блокировкой)"""
+        # add вызывается из цикла событий, поэтому день только откладывается в память:
+        # файл дня и сводки пишет следующий flush в пуле потоков
+        if self._index:
+            self._closed[self._day.isoformat()] = (self._index, self._values)
+        self._day = today
+        self._index = {}
+        self._values = array('I')
+        self._seal_needed = True
+
+    # ---------- сводки и хранение ----------
+
+    def _load_meta(self) -> dict:
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {"sealed_through": ""}
+
+    def _seal_pending(self):
+        """Сворачивает в сводки все прошедшие дни, которые еще не учтены"""
+        meta = self._load_meta()
+        today = self._day.isoformat()
+        for key in self._keys("day"):
+            if meta["sealed_through"] < key < today:
+                self._seal(key)
+                meta["sealed_through"] = key
+                with open(self.meta_file, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+        self._apply_retention()
+
+    def _seal(self, key: str):
+        """Добавляет закрытый день в сводки его недели и месяца"""
+        day = date.fromisoformat(key)
+        records = self._read_all("day", key)
+        for resolution, period in (("week", _iso_week(day)), ("month", key[:7])):
+            # Заголовок хранит последний учтенный день: повтор после сбоя не удвоит счетчики
+            if self._read_header(resolution, period) >= key:
+                continue
+            totals = self._read_all(resolution, period)
+            for entity_id, values in records.items():
+                previous = totals.get(entity_id)
+                totals[entity_id] = (
+                    tuple(a + b for a, b in zip(previous, values)) if previous else values
+                )
+            self._write(resolution, period, totals, header=key)
+
+    def _apply_retention(self):
+        """Удаляет периоды старше сроков хранения"""
+        today = self._day
+        oldest_day = (today - timedelta(days=ACTIVITY["retention_days"])).isoformat()
+        oldest_week = today - timedelta(weeks=ACTIVITY["retention_weeks"])
+        month_index = today.year * 12 + today.month - 1 - ACTIVITY["retention_months"]
+        oldest_month = f"{month_index // 12:04d}-{month_index % 12 + 1:02d}"
+
+        meta = self._load_meta()
+        for key in self._keys("day"):
+            # Несвернутые дни не удаляются, даже если устарели
+            if key < oldest_day and key <= meta["sealed_through"]:
+                os.remove(self._file("day", key))
+        for key in self._keys("week"):
+            if _week_start(key) < oldest_week:
+                os.remove(self._file("week", key))
+        for key in self._keys("month"):
+            if key < oldest_month:
+                os.remove(self._file("month", key))
+
+    # ---------- запросы ----------
+
+    def _period_key(self, resolution: str, day: date) -> str:
+        if resolution == "day":
+            return day.isoformat()
+        if resolution == "week":
+            return _iso_week(day)
+        return day.isoformat()[:7]
+
+    def query(self, entity_id: int, since: date, until: date,
+              resolution: str = "day") -> List[Tuple[str, Dict[str, int]]]:
+        """Счетчики сущности по периодам, пересекающим [since, until]; читаются только эти периоды"""
+        first = self._period_key(resolution, since)
+        last = self._period_key(resolution, until)
+        width = len(self.fields)
+        with self._lock:
+            today = self._day
+            row = self._index.get(entity_id)
+            live = tuple(self._values[row * width:(row + 1) * width]) if row is not None else None
+            # Закрытые, но еще не записанные дни читаются из памяти
+            closed = {}
+            if resolution == "day":
+                for key, (index, values) in self._closed.items():
+                    row = index.get(entity_id)
+                    closed[key] = tuple(values[row * width:(row + 1) * width]) if row is not None else None
+
+        result = []
+        for key in sorted(set(self._keys(resolution)) | closed.keys()):
+            if not first <= key <= last:
+                continue
+            # Файл текущего дня может отставать от памяти
+            if resolution == "day" and key == today.isoformat():
+                continue
+            values = closed[key] if key in closed else self._lookup(resolution, key, entity_id)
+            if values is not None:
+                result.append((key, dict(zip(self.fields, values))))
+
+        # Текущий день еще не свернут: добавляем его к своему периоду
+        today_key = self._period_key(resolution, today)
+        if live is not None and first <= today_key <= last:
+            if result and result[-1][0] == today_key:
+                merged = {field: result[-1][1][field] + value for field, value in zip(self.fields, live)}
+                result[-1] = (today_key, merged)
+            else:
+                result.append((today_key, dict(zip(self.fields, live))))
+        return result
+
+    def totals(self, entity_id: int, since: date, until: date) -> Dict[str, int]:
+        """Сумма дневных счетчиков сущности за [since, until]"""
+        totals = dict.fromkeys(self.fields, 0)
+        for _, values in self.query(entity_id, since, until):
+            for field, value in values.items():
+                totals[field] += value
+        return totals
+
+class ActivityStats:
+    """История активности пользователей и чатов по дням"""
+
+    def __init__(self, data_dir: str = "data"):
+        path = os.path.join(data_dir, "activity")
+        self.users = TimeSeries(os.path.join(path, "users"))
+        self.chats = TimeSeries(os.path.join(path, "chats"), wide=True)
+        self._stopped = asyncio.Event()
+
+    def add_message(self, user_id: int, chat_id: int, count: int = 1):
+        """Учитывает сообщения пользователя в чате"""
+        self.users.add(user_id, "messages", count)
+        self.chats.add(chat_id, "messages", count)
+
+    def add_reaction(self, from_user_id: int, to_user_id: int, chat_id: Optional[int] = None):
+        """Учитывает реакцию"""
+        self.users.add(from_user_id, "reactions_given")
+        self.users.add(to_user_id, "reactions_received")
+        if chat_id is not None:
+            self.chats.add(chat_id, "reactions_given")
+
+    def add_warn(self, target_id: int, chat_id: Optional[int] = None):
+        """Учитывает предупреждение"""
+        self.users.add(target_id, "warns")
+        if chat_id is not None:
+            self.chats.add(chat_id, "warns")
+
+    def chat_summary(self, chat_id: int, days: int = 7) -> Dict[str, int]:
+        """Сумма счетчиков чата за последние days дней"""
+        today = date.today()
+        return self.chats.totals(chat_id, today - timedelta(days=days - 1), today)
+
+    def flush(self):
+        """Записывает текущий день обоих рядов"""
+        self.users.flush()
+        self.chats.flush()
+
+    async def run(self):
+        """Фоновый цикл: запись на диск раз в ACTIVITY["flush_interval"] секунд"""
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=ACTIVITY["flush_interval"])
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.to_thread(self.flush)
+
+    def stop(self):
+        """Останавливает фоновый цикл (последняя запись выполняется в нем)"""
+        self._stopped.set()
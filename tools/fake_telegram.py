@@ -0,0 +1,100 @@
+"""Локальная замена Bot API для проверок без сети.
+
+FakeRequest подключается к настоящему telegram.Bot/ExtBot вместо HTTP-клиента:
+отвечает на вызовы API из памяти, имитирует задержку сети и flood-лимиты
+Telegram (ответ 429 с retry_after) и запоминает все запросы.
+"""
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+from typing import Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Community Bot", "username": "community_bot"}
+
+class FakeRequest(BaseRequest):
+    """Отвечает на запросы Bot API локально"""
+
+    def __init__(self, latency: float = 0.0, enforce_limits: bool = True,
+                 group_limit: int = 20, group_period: float = 60, global_limit: int = 30):
+        self.latency = latency
+        self.enforce_limits = enforce_limits
+        self.group_limit = group_limit
+        self.group_period = group_period
+        self.global_limit = global_limit
+        self.calls = []             # (время, метод, параметры)
+        self.flood_errors = 0
+        self._message_id = 0
+        self._chat_sends = defaultdict(deque)
+        self._global_sends = deque()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _flood_wait(self, chat_id, is_message: bool, now: float) -> Optional[int]:
+        """Возвращает retry_after, если запрос превысил бы лимиты Telegram"""
+        sends = self._global_sends
+        while sends and now - sends[0] >= 1:
+            sends.popleft()
+        if len(sends) >= self.global_limit:
+            return 1
+
+        if chat_id is not None and int(chat_id) < 0 and is_message:
+            sends = self._chat_sends[chat_id]
+            while sends and now - sends[0] >= self.group_period:
+                sends.popleft()
+            if len(sends) >= self.group_limit:
+                return int(self.group_period - (now - sends[0])) + 1
+        return None
+
+    def _result(self, method: str, params: dict):
+        """Ответ на конкретный метод API"""
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "sendSticker", "sendDocument", "editMessageText"):
+            self._message_id += 1
+            chat_id = params.get("chat_id")
+            return {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if int(chat_id) < 0 else "private"},
+                "from": BOT_USER,
+                "text": params.get("text", "")
+            }
+        return True
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        """Обрабатывает один вызов API"""
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        now = time.monotonic()
+        self.calls.append((now, api_method, params))
+
+        if self.enforce_limits and api_method not in ("getMe", "getUpdates", "answerCallbackQuery"):
+            # Групповой лимит Telegram считает только отправку сообщений
+            is_message = api_method.startswith(("send", "copy", "forward"))
+            retry_after = self._flood_wait(params.get("chat_id"), is_message, now)
+            if retry_after is not None:
+                self.flood_errors += 1
+                payload = {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after}
+                }
+                return 429, json.dumps(payload).encode("utf-8")
+            self._global_sends.append(now)
+            if params.get("chat_id") is not None and is_message:
+                self._chat_sends[params["chat_id"]].append(now)
+
+        payload = {"ok": True, "result": self._result(api_method, params)}
+        return 200, json.dumps(payload).encode("utf-8")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Отправляет синтетические апдейты на локальный вебхук бота.
+
+Пример:
+    BOT_MODE=webhook python main.py
+    python tools/post_update.py --count 100 --chats 5 --text "привет"
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SERVER
+
+def make_update(update_id: int, chat_id: int, user_id: int, text: str) -> dict:
+    """Минимальный апдейт с текстовым сообщением в группе"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Чат {chat_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Тест {user_id}"},
+            "text": text
+        }
+    }
+
+def make_callback_update(update_id: int, chat_id: int, user_id: int, data: str,
+                         reply_to_user_id: int = None) -> dict:
+    """Нажатие кнопки под сообщением бота (меню может отвечать на сообщение reply_to_user_id)"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup", "title": f"Чат {chat_id}"},
+        "from": {"id": 1, "is_bot": True, "first_name": "Community Bot"},
+        "text": "📋 МЕНЮ"
+    }
+    if reply_to_user_id is not None:
+        message["reply_to_message"] = make_update(update_id, chat_id, reply_to_user_id, "сообщение")["message"]
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(chat_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Тест {user_id}"},
+            "message": message,
+            "data": data
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=f"http://127.0.0.1:{SERVER['port']}/{SERVER['url_path']}")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--chats", type=int, default=1)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--text", default="тестовое сообщение")
+    args = parser.parse_args()
+
+    headers = {"Content-Type": "application/json"}
+    if SERVER["secret_token"]:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = SERVER["secret_token"]
+
+    started = time.perf_counter()
+    for i in range(args.count):
+        update = make_update(
+            update_id=int(time.time() * 1000) % 10**9 + i,
+            chat_id=-1000000000000 - (i % args.chats),
+            user_id=1000 + (i % args.users),
+            text=args.text
+        )
+        request = urllib.request.Request(
+            args.url, data=json.dumps(update).encode("utf-8"), headers=headers
+        )
+        with urllib.request.urlopen(request) as response:
+            response.read()
+
+    elapsed = time.perf_counter() - started
+    print(f"Отправлено {args.count} апдейтов за {elapsed:.2f} с")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Проверка очереди отправки на локальном фейковом Bot API.
+
+Шлет смесь ответов, действий модерации и поздравлений в несколько групп
+и показывает задержки по приоритетам и число ответов 429 от «Telegram».
+Окно группового лимита можно сжать (--period), чтобы прогон шел секунды.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram.ext import ExtBot
+
+from config import SENDER
+from fake_telegram import FakeRequest
+from sender import PRIORITY_COSMETIC, MessageDropped, SendScheduler
+
+async def run(args):
+    SENDER["group_period"] = args.period
+    request = FakeRequest(latency=args.latency, group_period=args.period)
+    scheduler = SendScheduler()
+    bot = ExtBot("1:fake", request=request, get_updates_request=FakeRequest(), rate_limiter=scheduler)
+    await bot.initialize()
+
+    latencies = {"moderation": [], "reply": [], "cosmetic": []}
+    dropped = 0
+
+    async def timed(kind, coroutine):
+        nonlocal dropped
+        started = time.perf_counter()
+        try:
+            await coroutine
+        except MessageDropped:
+            dropped += 1
+            return
+        latencies[kind].append(time.perf_counter() - started)
+
+    tasks = []
+    for i in range(args.messages):
+        chat_id = -100 - (i % args.chats)
+        tasks.append(timed("reply", bot.send_message(chat_id, f"ответ {i}")))
+        if i % 5 == 0:
+            tasks.append(timed("cosmetic", bot.send_message(
+                chat_id, f"новый ранг {i}",
+                rate_limit_args={"priority": PRIORITY_COSMETIC, "coalesce_key": ("rank_up", i % 3)}
+            )))
+        if i % 10 == 0:
+            tasks.append(timed("moderation", bot.ban_chat_member(chat_id, 5000 + i)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await bot.shutdown()
+
+    print(f"Запросов: {len(tasks)} за {elapsed:.2f} с, ответов 429: {request.flood_errors}, отброшено: {dropped}")
+    for kind, values in latencies.items():
+        if values:
+            print(f"  {kind:<10} n={len(values):<4} медиана {statistics.median(values):.3f} с, макс {max(values):.3f} с")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--period", type=float, default=3.0, help="окно группового лимита, с")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка фейкового API, с")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import asyncio
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, List, Optional
+
+from telegram import Update
+from telegram.ext import (
+    Application, BaseUpdateProcessor, CallbackQueryHandler,
+    CommandHandler, MessageHandler
+)
+
+from locks import KeyedLocks
+from metrics import UPDATES_PENDING
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов с сохранением порядка внутри одного чата"""
+
+    # Очередь ожидающих апдейтов в разы больше числа обработчиков:
+    # внешний семафор PTB лишь ограничивает память, а реальный параллелизм
+    # задает внутренний семафор, который берется уже после блокировки чата.
+    # Иначе апдейты одного шумного чата заняли бы все слоты, ожидая друг друга.
+    QUEUE_FACTOR = 64
+
+    def __init__(self, max_concurrent_updates: int, pin: Optional[Callable] = None):
+        super().__init__(max_concurrent_updates * self.QUEUE_FACTOR)
+        self.concurrency = max_concurrent_updates
+        # pin(chat_id) — контекст, удерживающий ресурсы чата на время обработки
+        # (shards.ChatStorage.pin: хранилище чата не выгружается посреди обработчика)
+        self._pin = pin
+        self._chat_locks = KeyedLocks()
+        self._workers = asyncio.Semaphore(max_concurrent_updates)
+        self.waiting = 0   # Ждут блокировки чата или свободного обработчика
+        self.running = 0
+        self.completed = 0  # Обработано всего (для ожидания опустевшей очереди)
+        UPDATES_PENDING.set_function(lambda: self.waiting, "waiting")
+        UPDATES_PENDING.set_function(lambda: self.running, "running")
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Обрабатывает апдейт после предыдущих апдейтов того же чата"""
+        chat = update.effective_chat if isinstance(update, Update) else None
+        chat_lock = self._chat_locks.hold(chat.id) if chat is not None else nullcontext()
+        self.waiting += 1
+        waiting = True
+        try:
+            async with chat_lock:
+                async with self._workers:
+                    self.waiting -= 1
+                    waiting = False
+                    self.running += 1
+                    try:
+                        if self._pin is not None and chat is not None:
+                            async with self._pin(chat.id):
+                                await coroutine
+                        else:
+                            await coroutine
+                    finally:
+                        self.running -= 1
+        finally:
+            if waiting:
+                self.waiting -= 1
+            self.completed += 1
+
+    async def initialize(self) -> None:
+        """Ресурсы создаются в конструкторе"""
+
+    async def shutdown(self) -> None:
+        """Освобождать нечего"""
+
+def get_allowed_updates(app: Application) -> List[str]:
+    """Типы апдейтов, для которых зарегистрированы обработчики"""
+    allowed = set()
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, (CommandHandler, MessageHandler)):
+                # Только новые сообщения: правки не должны давать опыт
+                allowed.add(Update.MESSAGE)
+            elif isinstance(handler, CallbackQueryHandler):
+                allowed.add(Update.CALLBACK_QUERY)
+    return sorted(allowed)
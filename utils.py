@@ -1,6 +1,9 @@
 import html
 from datetime import datetime
+from typing import Optional
 from config import RANKS
+from models import REACTION_INDEX, UserRecord
+from ranks import RankSystem
 
 class Utils:
     @staticmethod
@@ -21,22 +24,28 @@ class Utils:
             return f"{seconds // 86400} дней"
     
     @staticmethod
-    def create_profile_card(user_data: dict) -> str:
+    def create_profile_card(user_data: UserRecord, position: Optional[int] = None) -> str:
         """Создает карточку профиля"""
-        rank_info = RankSystem.get_rank_info(user_data["xp"])
+        rank_info = RankSystem.get_rank_info(user_data.xp)
+        received = user_data.reactions_received
+        position_line = f"\n<b>Место в топе:</b> #{position}" if position else ""
+        # Имена задают сами пользователи: без экранирования Telegram отклонит разметку
+        first_name = Utils.escape_html(user_data.first_name)
+        last_name = Utils.escape_html(user_data.last_name)
+        username = Utils.escape_html(user_data.username)
         
         card = f"""
-{rank_info['symbols']} <b>{user_data.get('first_name', '')} {user_data.get('last_name', '')}</b>
-@{user_data.get('username', 'Без username')}
+{rank_info['symbols']} <b>{first_name} {last_name}</b>
+@{username}
 
 <b>Ранг:</b> {rank_info['current_name']}
-<b>Опыт:</b> {user_data['xp']} XP
+<b>Опыт:</b> {user_data.xp} XP{position_line}
 <b>Прогресс:</b> {rank_info['progress']:.1f}% до {rank_info['next_name']}
 
-<b>Сообщений:</b> {user_data['messages_count']}
-<b>Реакций получено:</b> ❤️{user_data['reactions_received']['heart']} 👍{user_data['reactions_received']['thumbs_up']} 🤓{user_data['reactions_received']['nerd']}
+<b>Сообщений:</b> {user_data.messages_count}
+<b>Реакций получено:</b> ❤️{received[REACTION_INDEX['heart']]} 👍{received[REACTION_INDEX['thumbs_up']]} 🤓{received[REACTION_INDEX['nerd']]}
 
-<b>Дата присоединения:</b> {user_data['join_date'][:10]}
+<b>Дата присоединения:</b> {datetime.fromtimestamp(user_data.join_date):%Y-%m-%d}
         """.strip()
         
         return card
@@ -50,11 +59,11 @@ class Utils:
         top_text = "🏆 <b>ТОП-10 ИГРОКОВ</b>\n\n"
         
         for i, user in enumerate(top_users[:10], 1):
-            rank_info = RankSystem.get_rank_info(user["xp"])
-            username = user.get("username", "Без username")
-            name = user.get("first_name", "")
+            rank_info = RankSystem.get_rank_info(user.xp)
             
+            name = Utils.escape_html(user.first_name)
+            username = Utils.escape_html(user.username)
             top_text += f"{i}. {rank_info['symbols']} <b>{name}</b> (@{username})\n"
-            top_text += f"   ⭐ {user['xp']} XP | 📨 {user['messages_count']} сообщ.\n\n"
+            top_text += f"   ⭐ {user.xp} XP | 📨 {user.messages_count} сообщ.\n\n"
         
         return top_text
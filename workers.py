@@ -0,0 +1,463 @@
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import zlib
+from typing import Any, Dict, Optional
+
+from telegram import InputFile, Update
+from telegram.error import (
+    BadRequest, ChatMigrated, Forbidden, InvalidToken, NetworkError,
+    RetryAfter, TelegramError, TimedOut
+)
+from telegram.ext import Application, BaseRateLimiter, ContextTypes, TypeHandler
+from telegram.request import RequestData
+# Не экспортируется из telegram.request, но именно из таких параметров Bot собирает запрос
+from telegram.request._requestparameter import RequestParameter
+
+from config import METRICS, WORKERS
+from metrics import WORKER_RESTARTS, WORKER_UPDATES, start_http_server
+from sender import MessageDropped
+from shards import prepare_legacy
+
+logger = logging.getLogger(__name__)
+
+# Номер рабочего процесса передается ему через окружение
+WORKER_ENV = "BOT_WORKER_INDEX"
+
+_HEADER = struct.Struct("<I")
+
+# Ошибки, которые воссоздаются в рабочем процессе по имени
+_ERRORS = {cls.__name__: cls for cls in (
+    BadRequest, Forbidden, InvalidToken, NetworkError, TimedOut, MessageDropped
+)}
+
+def worker_index() -> Optional[int]:
+    """Номер рабочего процесса; None в однопроцессном режиме и в принимающем процессе"""
+    value = os.getenv(WORKER_ENV)
+    return int(value) if value is not None else None
+
+def worker_data_dir(data_dir: str = "data") -> str:
+    """Каталог для данных, которые ведет только этот процесс"""
+    index = worker_index()
+    return data_dir if index is None else os.path.join(data_dir, "workers", str(index))
+
+def worker_for(chat_id: int, count: int) -> int:
+    """Рабочий процесс, которому принадлежит чат"""
+    # crc32, а не hash(): распределение не должно зависеть от процесса и версии Python
+    return zlib.crc32(chat_id.to_bytes(8, "little", signed=True)) % count
+
+class Channel:
+    """Сообщения JSON с префиксом длины поверх сокета между процессами"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, sock: socket.socket) -> "Channel":
+        reader, writer = await asyncio.open_connection(sock=sock)
+        return cls(reader, writer)
+
+    async def send(self, message: dict):
+        """Отправляет сообщение; ConnectionError, если другой процесс завершился"""
+        data = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if self.writer.is_closing():
+            raise ConnectionResetError("Канал закрыт")
+        self.writer.write(_HEADER.pack(len(data)) + data)
+        await self.writer.drain()
+
+    async def receive(self) -> Optional[dict]:
+        """Следующее сообщение или None, если другой процесс закрыл соединение"""
+        try:
+            header = await self.reader.readexactly(_HEADER.size)
+            data = await self.reader.readexactly(_HEADER.unpack(header)[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return json.loads(data)
+
+    def close(self):
+        self.writer.close()
+
+def _encode_request(data: Dict[str, Any]) -> dict:
+    """Параметры вызова API в виде, пригодном для передачи другому процессу"""
+    request_data = RequestData([RequestParameter.from_input(key, value) for key, value in data.items()])
+    files = {
+        name: [filename, base64.b64encode(content).decode("ascii"), mimetype]
+        for name, (filename, content, mimetype) in request_data.multipart_data.items()
+    }
+    return {"parameters": request_data.parameters, "files": files}
+
+def _decode_request(message: dict) -> RequestData:
+    """Тело запроса к API из параметров рабочего процесса"""
+    parameters = [RequestParameter(name, value, None) for name, value in message["parameters"].items()]
+    for name, (filename, content, mimetype) in message["files"].items():
+        input_file = InputFile(base64.b64decode(content), filename=filename)
+        input_file.mimetype = mimetype
+        parameters.append(RequestParameter(name, None, [input_file]))
+    return RequestData(parameters)
+
+def _encode_error(exc: Exception) -> dict:
+    error = {"type": type(exc).__name__, "message": str(exc)}
+    if isinstance(exc, RetryAfter):
+        error["retry_after"] = exc.retry_after
+    elif isinstance(exc, ChatMigrated):
+        error["new_chat_id"] = exc.new_chat_id
+    return error
+
+def _decode_error(error: dict) -> Exception:
+    if error["type"] == "RetryAfter":
+        return RetryAfter(error["retry_after"])
+    if error["type"] == "ChatMigrated":
+        return ChatMigrated(error["new_chat_id"])
+    return _ERRORS.get(error["type"], TelegramError)(error["message"])
+
+def _freeze(value):
+    """Списки из JSON обратно в кортежи: coalesce_key служит ключом словаря"""
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _freeze(item) for key, item in value.items()}
+    return value
+
+class FrontLink(BaseRateLimiter):
+    """Запросы к API рабочего процесса: выполняет их принимающий процесс"""
+
+    # Подключается к боту рабочего процесса как rate_limiter, поэтому через него проходят
+    # все вызовы API вместе с rate_limit_args. Сам запрос к Telegram здесь не выполняется:
+    # общие лимиты и очередь отправки есть только у принимающего процесса
+
+    def __init__(self, channel: Channel):
+        self.channel = channel
+        self._ids = itertools.count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._closed = False
+
+    async def initialize(self) -> None:
+        """Канал открыт при запуске процесса"""
+
+    async def shutdown(self) -> None:
+        """Канал нужен и после остановки бота: сброс данных может отправлять сообщения"""
+
+    async def process_request(self, callback, args, kwargs, endpoint: str,
+                              data: Dict[str, Any], rate_limit_args) -> Any:
+        """Передает вызов API принимающему процессу и ждет результата"""
+        if self._closed:
+            raise NetworkError("Принимающий процесс недоступен")
+
+        call_id = next(self._ids)
+        future = self._pending[call_id] = asyncio.get_running_loop().create_future()
+        try:
+            await self.channel.send({
+                "type": "call", "id": call_id, "endpoint": endpoint,
+                "rate_limit_args": rate_limit_args, **_encode_request(data)
+            })
+            reply = await future
+        except ConnectionError as e:
+            raise NetworkError(f"Принимающий процесс недоступен: {e}") from e
+        finally:
+            self._pending.pop(call_id, None)
+
+        if "error" in reply:
+            raise _decode_error(reply["error"])
+        return reply["result"]
+
+    def resolve(self, message: dict):
+        """Ответ принимающего процесса на вызов"""
+        future = self._pending.get(message["id"])
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    def close(self):
+        """Принимающий процесс завершился: ожидающие вызовы получают ошибку"""
+        self._closed = True
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionResetError("Канал закрыт"))
+
+class Worker:
+    """Рабочий процесс: обработчики бота для своей доли чатов"""
+
+    def __init__(self, channel: Channel, app: Application, link: FrontLink):
+        self.channel = channel
+        self.app = app
+        self.link = link
+        self.received = 0
+        self._stopped = asyncio.Event()
+
+    async def run(self):
+        """Запускает бота, принимает апдейты до команды остановки и сохраняет данные"""
+        app = self.app
+        # Канал читается с самого начала: уже initialize ждет ответа на getMe
+        reader = asyncio.create_task(self._receive())
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        await self.channel.send({"type": "ready"})
+        await self._stopped.wait()
+
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+        self.channel.close()
+        reader.cancel()
+
+    async def _receive(self):
+        """Разбирает сообщения принимающего процесса"""
+        drains = set()
+        while True:
+            message = await self.channel.receive()
+            if message is None:
+                # Принимающий процесс завершился: сохраняем данные и выходим
+                self.link.close()
+                self._stopped.set()
+                return
+
+            kind = message["type"]
+            if kind == "update":
+                self.received += 1
+                await self.app.update_queue.put(Update.de_json(message["update"], self.app.bot))
+            elif kind == "result":
+                self.link.resolve(message)
+            elif kind == "drain":
+                task = asyncio.create_task(self._drain(message["id"], self.received))
+                drains.add(task)
+                task.add_done_callback(drains.discard)
+            elif kind == "stop":
+                self._stopped.set()
+
+    async def _drain(self, drain_id: int, target: int):
+        """Отвечает, когда обработаны все апдейты, полученные до запроса"""
+        processor = self.app.update_processor
+        while processor.completed < target:
+            await asyncio.sleep(0.005)
+        await self.channel.send({"type": "drained", "id": drain_id})
+
+async def run_worker(fd: int):
+    """Точка входа рабочего процесса"""
+    channel = await Channel.connect(socket.socket(fileno=fd))
+    # main при импорте создает хранилище и системы — уже в каталогах этого процесса
+    import main
+    link = FrontLink(channel)
+    app = main.build_application(Application.builder().token(main.BOT_TOKEN).rate_limiter(link))
+    await Worker(channel, app, link).run()
+
+class _WorkerHandle:
+    """Рабочий процесс со стороны принимающего"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.channel: Optional[Channel] = None
+        self.ready = asyncio.Event()
+        # Сообщения процессу: пока он перезапускается, копятся здесь,
+        # не задерживая апдейты чатов остальных процессов
+        self.outbox: asyncio.Queue = asyncio.Queue(WORKERS["max_backlog"])
+        self.forwarder: Optional[asyncio.Task] = None
+
+class WorkerPool:
+    """Рабочие процессы бота: апдейты уходят процессу своего чата, вызовы API возвращаются сюда"""
+
+    # Чат всегда обрабатывается одним процессом: его хранилище (shards.py), дневные топы,
+    # антиспам и пачки опыта живут только там и не требуют согласования между процессами.
+    # Порядок апдейтов чата сохраняется: они идут по одному каналу и внутри процесса
+    # обрабатываются ChatOrderedUpdateProcessor
+
+    def __init__(self, count: int):
+        self.count = count
+        self.bot = None
+        self._workers = [_WorkerHandle(index) for index in range(count)]
+        self._stopping = False
+        self._ids = itertools.count()
+        self._drains: Dict[int, asyncio.Future] = {}
+        self._tasks = set()
+
+    async def start(self, bot):
+        """Запускает процессы; bot выполняет их вызовы API"""
+        self.bot = bot
+        await asyncio.gather(*(self._spawn(worker) for worker in self._workers))
+        for worker in self._workers:
+            worker.forwarder = asyncio.create_task(self._forward(worker))
+
+    async def _spawn(self, worker: _WorkerHandle):
+        front_sock, worker_sock = socket.socketpair()
+        try:
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), str(worker_sock.fileno()),
+                pass_fds=(worker_sock.fileno(),),
+                env=dict(os.environ, **{WORKER_ENV: str(worker.index)})
+            )
+        finally:
+            worker_sock.close()
+        worker.channel = await Channel.connect(front_sock)
+
+        serving = self._track(self._serve(worker, worker.channel, worker.process))
+        ready = asyncio.ensure_future(worker.ready.wait())
+        await asyncio.wait((ready, serving), timeout=WORKERS["start_timeout"],
+                           return_when=asyncio.FIRST_COMPLETED)
+        if not worker.ready.is_set():
+            ready.cancel()
+            raise RuntimeError(f"Рабочий процесс {worker.index} не запустился")
+        logger.info(f"Рабочий процесс {worker.index} запущен (pid {worker.process.pid})")
+
+    def _track(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _serve(self, worker: _WorkerHandle, channel: Channel, process):
+        """Обслуживает процесс до его завершения и перезапускает его после падения"""
+        while True:
+            message = await channel.receive()
+            if message is None:
+                break
+            kind = message["type"]
+            if kind == "call":
+                self._track(self._call(channel, message))
+            elif kind == "ready":
+                worker.ready.set()
+            elif kind == "drained":
+                future = self._drains.pop(message["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+        worker.ready.clear()
+        channel.close()
+        code = await process.wait()
+        if self._stopping:
+            return
+        # Данные чатов на диске, поэтому процесс можно просто запустить заново;
+        # апдейты его чатов ждут готовности нового процесса в его очереди (_forward)
+        logger.error(f"Рабочий процесс {worker.index} завершился с кодом {code}, перезапуск")
+        WORKER_RESTARTS.inc(str(worker.index))
+        while not self._stopping:
+            await asyncio.sleep(WORKERS["restart_delay"])
+            try:
+                await self._spawn(worker)
+                return
+            except Exception as e:
+                logger.error(f"Не удалось перезапустить рабочий процесс {worker.index}: {e}")
+
+    async def _forward(self, worker: _WorkerHandle):
+        """Передает сообщения из очереди процесса по порядку, дожидаясь его готовности"""
+        while True:
+            message = await worker.outbox.get()
+            while True:
+                await worker.ready.wait()
+                try:
+                    await worker.channel.send(message)
+                    break
+                except ConnectionError:
+                    # Процесс упал: сообщение уйдет новому процессу после перезапуска
+                    worker.ready.clear()
+
+    async def _call(self, channel: Channel, message: dict):
+        """Выполняет вызов API рабочего процесса через очередь отправки этого процесса"""
+        reply = {"type": "result", "id": message["id"]}
+        try:
+            reply["result"] = await self._request(message)
+        except Exception as e:
+            reply["error"] = _encode_error(e)
+        try:
+            await channel.send(reply)
+        except ConnectionError:
+            # Процесс завершился, не дождавшись ответа
+            pass
+
+    async def _request(self, message: dict) -> Any:
+        endpoint = message["endpoint"]
+        request_data = _decode_request(message)
+
+        async def post():
+            return await self.bot.request.post(url=f"{self.bot.base_url}/{endpoint}", request_data=request_data)
+
+        if self.bot.rate_limiter is None:
+            return await post()
+        return await self.bot.rate_limiter.process_request(
+            callback=post, args=(), kwargs={}, endpoint=endpoint,
+            data=message["parameters"], rate_limit_args=_freeze(message["rate_limit_args"])
+        )
+
+    async def route(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Передает апдейт процессу его чата"""
+        chat = update.effective_chat
+        user = update.effective_user
+        key = chat.id if chat else user.id if user else update.update_id
+        worker = self._workers[worker_for(key, self.count)]
+        try:
+            worker.outbox.put_nowait({"type": "update", "update": update.to_dict()})
+        except asyncio.QueueFull:
+            logger.error(f"Рабочий процесс {worker.index} не принимает апдейты, апдейт {update.update_id} отброшен")
+            return
+        WORKER_UPDATES.inc(str(worker.index))
+
+    async def drain(self):
+        """Ждет, пока процессы обработают все переданные им апдейты"""
+        loop = asyncio.get_running_loop()
+        waiting = []
+        for worker in self._workers:
+            drain_id = next(self._ids)
+            future = self._drains[drain_id] = loop.create_future()
+            waiting.append(future)
+            await worker.outbox.put({"type": "drain", "id": drain_id})
+        await asyncio.gather(*waiting)
+
+    async def stop(self):
+        """Останавливает процессы; пока они сохраняют данные, их вызовы API выполняются"""
+        self._stopping = True
+        for worker in self._workers:
+            # Через очередь: процесс получит и обработает все апдейты, переданные до остановки
+            await worker.outbox.put({"type": "stop"})
+
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                await asyncio.wait_for(worker.process.wait(), WORKERS["stop_timeout"])
+            except asyncio.TimeoutError:
+                logger.error(f"Рабочий процесс {worker.index} не остановился, завершаем принудительно")
+                worker.process.kill()
+                await worker.process.wait()
+            if worker.forwarder is not None:
+                # Упавший при остановке процесс не перезапускается: его очередь уже не нужна
+                worker.forwarder.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+def build_front_application(builder, count: int) -> Application:
+    """Принимающий процесс: получает апдейты и выполняет вызовы API рабочих процессов"""
+    pool = WorkerPool(count)
+
+    async def post_init(app: Application):
+        await asyncio.get_running_loop().run_in_executor(None, prepare_legacy)
+        await pool.start(app.bot)
+        if METRICS["http_port"]:
+            app.bot_data['metrics_server'] = await start_http_server(METRICS["listen"], METRICS["http_port"])
+
+    async def post_stop(app: Application):
+        # Бот еще работает: процессы могут отправить поздравления из последних пачек опыта
+        await pool.stop()
+        if 'metrics_server' in app.bot_data:
+            app.bot_data['metrics_server'].close()
+
+    app = builder.post_init(post_init).post_stop(post_stop).build()
+    app.bot_data['workers'] = pool
+    app.add_handler(TypeHandler(Update, pool.route))
+    return app
+
+if __name__ == '__main__':
+    # Ctrl+C получает вся группа процессов; останавливает рабочих принимающий процесс,
+    # чтобы они успели сохранить данные
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(int(sys.argv[1])))